@@ -0,0 +1,207 @@
+"""向量化的点在多边形内判断
+
+区域（region）是多边形列表，每个多边形是环的列表：第一个环为外边界，
+其余为洞；每个环是 (lat, lon) 顶点序列。判断时先用边界框预筛选，
+再对候选点按边循环做向量化射线法（奇偶规则，自动处理洞），
+多个多边形之间取并集。轴对齐矩形直接用边界框判断（含边界），
+与 between 筛选的结果一致。
+
+稀疏采样的轨迹可能在两个定位点之间穿过小区域而没有任何点落在区域内，
+segments_in_region 对相邻点构成的线段做向量化的线段-多边形相交判断，
+同样先用线段边界框与多边形边界框预筛选。
+"""
+import numpy as np
+
+
+def rectangle(min_lat, max_lat, min_lon, max_lon):
+    """矩形区域"""
+    return [[np.array([(min_lat, min_lon), (min_lat, max_lon),
+                       (max_lat, max_lon), (max_lat, min_lon)], dtype=np.float64)]]
+
+
+def make_region(polygons):
+    """规范化区域：接受单个环、单个多边形（环列表）或多多边形（多边形列表）"""
+    def depth(obj):
+        d = 0
+        while isinstance(obj, (list, tuple, np.ndarray)) and len(obj) > 0:
+            obj = obj[0]
+            d += 1
+        return d
+
+    d = depth(polygons)
+    if d == 2:
+        polygons = [[polygons]]
+    elif d == 3:
+        polygons = [polygons]
+    elif d != 4:
+        raise ValueError("无法识别的多边形格式")
+
+    region = []
+    for polygon in polygons:
+        rings = []
+        for ring in polygon:
+            ring = np.asarray(ring, dtype=np.float64)
+            if len(ring) > 1 and (ring[0] == ring[-1]).all():
+                ring = ring[:-1]
+            if len(ring) < 3:
+                raise ValueError("多边形至少需要3个顶点")
+            rings.append(ring)
+        region.append(rings)
+    return region
+
+
+def parse_region(text):
+    """解析文本形式的区域："lat,lon; lat,lon; ..."，多个多边形用 | 分隔"""
+    polygons = []
+    for part in text.split('|'):
+        part = part.strip()
+        if not part:
+            continue
+        ring = []
+        for vertex in part.split(';'):
+            vertex = vertex.strip()
+            if vertex:
+                lat, lon = (float(v) for v in vertex.split(','))
+                ring.append((lat, lon))
+        polygons.append([ring])
+    if not polygons:
+        raise ValueError("未输入多边形顶点")
+    return make_region(polygons)
+
+
+def region_bbox(region):
+    """区域的整体边界框 (min_lat, max_lat, min_lon, max_lon)"""
+    vertices = np.concatenate([polygon[0] for polygon in region])
+    return (float(vertices[:, 0].min()), float(vertices[:, 0].max()),
+            float(vertices[:, 1].min()), float(vertices[:, 1].max()))
+
+
+def region_key(region):
+    """可哈希的区域表示（用作缓存键）"""
+    return tuple(tuple(tuple(map(tuple, ring.tolist())) for ring in polygon) for polygon in region)
+
+
+def is_rectangle(region):
+    """区域是否为单个轴对齐矩形"""
+    if len(region) != 1 or len(region[0]) != 1 or len(region[0][0]) != 4:
+        return False
+    ring = region[0][0]
+    lats, lons = ring[:, 0], ring[:, 1]
+    edges_lat = lats == np.roll(lats, -1)
+    edges_lon = lons == np.roll(lons, -1)
+    return bool((edges_lat ^ edges_lon).all())
+
+
+def points_in_ring(lats, lons, ring):
+    """射线法判断点是否在环内（按边循环，对点向量化）"""
+    inside = np.zeros(len(lats), dtype=bool)
+    y1, x1 = ring[:, 0], ring[:, 1]
+    y2, x2 = np.roll(y1, -1), np.roll(x1, -1)
+    for i in range(len(ring)):
+        if y1[i] == y2[i]:
+            continue
+        crosses = (y1[i] > lats) != (y2[i] > lats)
+        x_cross = (x2[i] - x1[i]) * (lats - y1[i]) / (y2[i] - y1[i]) + x1[i]
+        inside ^= crosses & (lons < x_cross)
+    return inside
+
+
+def points_in_region(lats, lons, region):
+    """返回点是否位于区域内的布尔数组"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    result = np.zeros(len(lats), dtype=bool)
+
+    for polygon in region:
+        exterior = polygon[0]
+        min_lat, max_lat = exterior[:, 0].min(), exterior[:, 0].max()
+        min_lon, max_lon = exterior[:, 1].min(), exterior[:, 1].max()
+
+        # 边界框预筛选
+        candidates = np.flatnonzero((lats >= min_lat) & (lats <= max_lat) &
+                                    (lons >= min_lon) & (lons <= max_lon) & ~result)
+        if len(candidates) == 0:
+            continue
+        if is_rectangle([polygon]):
+            result[candidates] = True
+            continue
+
+        c_lats, c_lons = lats[candidates], lons[candidates]
+        inside = np.zeros(len(candidates), dtype=bool)
+        for ring in polygon:
+            inside ^= points_in_ring(c_lats, c_lons, ring)
+        result[candidates] = inside
+    return result
+
+
+def _orientation(ay, ax, by, bx, cy, cx):
+    """三点方向（叉积），向量化"""
+    return (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+
+
+def segments_cross_ring(y1, x1, y2, x2, ring):
+    """判断线段 (y1,x1)-(y2,x2) 是否与环的任意一条边相交（按边循环，对线段向量化）"""
+    crosses = np.zeros(len(y1), dtype=bool)
+    seg_min_y, seg_max_y = np.minimum(y1, y2), np.maximum(y1, y2)
+    seg_min_x, seg_max_x = np.minimum(x1, x2), np.maximum(x1, x2)
+    ey1, ex1 = ring[:, 0], ring[:, 1]
+    ey2, ex2 = np.roll(ey1, -1), np.roll(ex1, -1)
+    for i in range(len(ring)):
+        # 边界框重叠是相交的必要条件，同时排除共线但不重叠的情况
+        overlap = ((seg_max_y >= min(ey1[i], ey2[i])) & (seg_min_y <= max(ey1[i], ey2[i])) &
+                   (seg_max_x >= min(ex1[i], ex2[i])) & (seg_min_x <= max(ex1[i], ex2[i])))
+        o1 = _orientation(y1, x1, y2, x2, ey1[i], ex1[i])
+        o2 = _orientation(y1, x1, y2, x2, ey2[i], ex2[i])
+        o3 = _orientation(ey1[i], ex1[i], ey2[i], ex2[i], y1, x1)
+        o4 = _orientation(ey1[i], ex1[i], ey2[i], ex2[i], y2, x2)
+        crosses |= overlap & (o1 * o2 <= 0) & (o3 * o4 <= 0)
+    return crosses
+
+
+def segments_in_region(lats, lons, region):
+    """返回相邻点构成的每条线段（共 n-1 条）是否与区域相交"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if len(lats) < 2:
+        return np.zeros(0, dtype=bool)
+
+    # 任一端点在区域内的线段必然相交
+    inside = points_in_region(lats, lons, region)
+    result = inside[:-1] | inside[1:]
+    y1, x1, y2, x2 = lats[:-1], lons[:-1], lats[1:], lons[1:]
+
+    for polygon in region:
+        exterior = polygon[0]
+        min_lat, max_lat = exterior[:, 0].min(), exterior[:, 0].max()
+        min_lon, max_lon = exterior[:, 1].min(), exterior[:, 1].max()
+
+        # 线段边界框与多边形边界框预筛选
+        candidates = np.flatnonzero(
+            ~result &
+            (np.maximum(y1, y2) >= min_lat) & (np.minimum(y1, y2) <= max_lat) &
+            (np.maximum(x1, x2) >= min_lon) & (np.minimum(x1, x2) <= max_lon)
+        )
+        if len(candidates) == 0:
+            continue
+
+        c = candidates
+        crosses = np.zeros(len(c), dtype=bool)
+        for ring in polygon:
+            crosses |= segments_cross_ring(y1[c], x1[c], y2[c], x2[c], ring)
+        result[c] = crosses
+    return result
+
+
+def track_in_region(lats, lons, region, segments=False):
+    """判断一条轨迹是否经过区域；segments=True 时同时检测穿越区域的航段"""
+    if segments:
+        lats = np.asarray(lats, dtype=np.float64)
+        if len(lats) < 2:
+            return bool(points_in_region(lats, lons, region).any())
+        return bool(segments_in_region(lats, lons, region).any())
+    return bool(points_in_region(lats, lons, region).any())
+
+
+def region_to_latlon_lists(region):
+    """转换为folium可用的 [[(lat, lon), ...], ...] 外边界列表"""
+    return [[tuple(v) for v in polygon[0]] for polygon in region]
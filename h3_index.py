@@ -0,0 +1,216 @@
+"""H3特征文件的倒排索引
+
+把每个H3单元映射到含有该单元的文件集合。为减小索引，文件中的单元按比数据粗
+INDEX_PARENT_LEVELS 级的父单元记录（轨迹很少重复经过同一数据单元）。区域查询时先按数据分辨率把区域分成
+两类单元：内部单元（单元及其一环邻居都不与区域边界相交）和边界单元
+（区域各边经过的单元，向外扩展一环）。只在内部单元中出现的文件必然经过区域；
+出现在边界单元中的文件只是候选，需要按真实坐标逐行检查（见 track_scan）；
+其余已索引的文件不经过区域。
+
+center_lat/center_lon 是四舍五入到4位小数的单元中心（与真实中心最多相差约5e-5度），
+因此边界附近的行不能只按单元判断。
+"""
+import os
+import numpy as np
+from track_manifest import list_csv_files, read_sidecar, write_sidecar, folder_fingerprint
+from track_schema import read_header, read_csv_fast
+from geo_filter import rectangle, make_region
+
+try:
+    import h3
+except ImportError:
+    h3 = None
+
+INDEX_NAME = '.h3_index.json'
+INDEX_VERSION = 2
+H3_COLUMN = 'h3'
+CENTER_COLUMNS = ('center_lat', 'center_lon')
+# 索引记录的父单元比数据单元粗的级数
+INDEX_PARENT_LEVELS = 2
+# 区域各边的采样间距（单元平均边长的比例），保证各边经过的单元都在采样单元的一环邻居内
+EDGE_SAMPLE_FRACTION = 0.25
+KM_PER_DEGREE = 111.0
+
+# 进程内已加载的索引：{(文件夹, 是否递归): (文件夹指纹, 索引)}
+_LOADED = {}
+
+
+def h3_available():
+    """是否安装了h3库"""
+    return h3 is not None
+
+
+def cell_resolution(cell):
+    """获取H3单元的分辨率（兼容h3 v3/v4）"""
+    if hasattr(h3, 'get_resolution'):
+        return h3.get_resolution(cell)
+    return h3.h3_get_resolution(cell)
+
+
+def polygon_cells(rings, resolution):
+    """把多边形（外边界+洞，每个环为 (lat, lon) 顶点）填充为H3单元集合（兼容h3 v3/v4）"""
+    rings = [[(float(lat), float(lon)) for lat, lon in ring] for ring in rings]
+    if hasattr(h3, 'LatLngPoly'):
+        return set(h3.polygon_to_cells(h3.LatLngPoly(*rings), resolution))
+    geojson = {'type': 'Polygon', 'coordinates': [[(lon, lat) for lat, lon in ring] for ring in rings]}
+    return set(h3.polyfill(geojson, resolution, geo_json_conformant=True))
+
+
+def parent_cell(cell, levels=INDEX_PARENT_LEVELS):
+    """粗 levels 级的父单元（兼容h3 v3/v4）"""
+    resolution = max(cell_resolution(cell) - levels, 0)
+    if hasattr(h3, 'cell_to_parent'):
+        return h3.cell_to_parent(cell, resolution)
+    return h3.h3_to_parent(cell, resolution)
+
+
+def cell_neighbours(cell):
+    """单元及其一环邻居（兼容h3 v3/v4）"""
+    if hasattr(h3, 'grid_disk'):
+        return h3.grid_disk(cell, 1)
+    return h3.k_ring(cell, 1)
+
+
+def point_cell(lat, lon, resolution):
+    """点所在的单元（兼容h3 v3/v4）"""
+    if hasattr(h3, 'latlng_to_cell'):
+        return h3.latlng_to_cell(lat, lon, resolution)
+    return h3.geo_to_h3(lat, lon, resolution)
+
+
+def edge_length_km(resolution):
+    """分辨率的单元平均边长（兼容h3 v3/v4）"""
+    if hasattr(h3, 'average_hexagon_edge_length'):
+        return h3.average_hexagon_edge_length(resolution, unit='km')
+    return h3.edge_length(resolution, unit='km')
+
+
+def boundary_cells(polygon, resolution):
+    """多边形各边（含洞的边）经过的单元，向外扩展一环"""
+    step = edge_length_km(resolution) * EDGE_SAMPLE_FRACTION / KM_PER_DEGREE
+    cells = set()
+    for ring in polygon:
+        ring = np.asarray(ring, dtype=np.float64)
+        ends = np.roll(ring, -1, axis=0)
+        for (lat0, lon0), (lat1, lon1) in zip(ring, ends):
+            samples = max(int(np.ceil(max(abs(lat1 - lat0), abs(lon1 - lon0)) / step)), 1)
+            for t in np.linspace(0.0, 1.0, samples + 1):
+                cells.add(point_cell(lat0 + t * (lat1 - lat0), lon0 + t * (lon1 - lon0), resolution))
+    return {neighbour for cell in cells for neighbour in cell_neighbours(cell)}
+
+
+def read_file_cells(filepath):
+    """读取文件的h3列，返回出现的父单元列表；无h3和单元中心列、或有行缺少单元时返回None"""
+    header = read_header(filepath)
+    if H3_COLUMN not in header or not set(CENTER_COLUMNS) <= set(header):
+        return None
+    cells = read_csv_fast(filepath, usecols=[H3_COLUMN])[H3_COLUMN]
+    if cells.isna().any():
+        return None
+    return sorted({parent_cell(cell) for cell in set(cells)})
+
+
+def load_index(folder, recursive=False, progress_callback=None):
+    """返回文件夹的H3索引，文件夹未变化（见 folder_fingerprint）时复用进程内已加载的索引"""
+    key = (os.path.abspath(folder), recursive)
+    fingerprint = folder_fingerprint(folder, recursive)
+    loaded = _LOADED.get(key)
+    if loaded is not None and loaded[0] == fingerprint:
+        return loaded[1]
+    index = H3CellIndex(folder, recursive).update(progress_callback)
+    _LOADED[key] = (fingerprint, index)
+    return index
+
+
+class H3CellIndex:
+    """H3单元 -> 文件集合 的磁盘倒排索引"""
+
+    def __init__(self, folder, recursive=False):
+        self.folder = folder
+        self.recursive = recursive
+        self.index_path = os.path.join(folder, INDEX_NAME)
+        self.files = {}
+        self.cells = {}
+        self.resolutions = set()
+
+    def update(self, progress_callback=None):
+        """加载磁盘索引，按 mtime/size 只重新索引新增或变化的文件"""
+        data = read_sidecar(self.index_path, INDEX_VERSION)
+        if data is None or data.get('recursive') != self.recursive:
+            data = {'version': INDEX_VERSION, 'recursive': self.recursive, 'files': {}}
+
+        old_files = data['files']
+        files = {}
+        changed = False
+        csv_files = list_csv_files(self.folder, self.recursive)
+
+        for i, name in enumerate(csv_files):
+            filepath = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue
+
+            entry = old_files.get(name)
+            if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+                try:
+                    cells = read_file_cells(filepath)
+                except Exception:
+                    cells = None
+                entry = {'mtime': stat.st_mtime, 'size': stat.st_size, 'cells': cells}
+                changed = True
+            files[name] = entry
+
+            if progress_callback:
+                progress_callback(i + 1, len(csv_files))
+
+        if changed or len(files) != len(old_files):
+            data['files'] = files
+            write_sidecar(self.index_path, data)
+
+        self.files = files
+        self._invert()
+        return self
+
+    def _invert(self):
+        """由逐文件的单元表构建内存中的倒排表"""
+        self.cells = {}
+        for name, entry in self.files.items():
+            for cell in entry['cells'] or ():
+                self.cells.setdefault(cell, set()).add(name)
+        self.resolutions = {cell_resolution(cell) for cell in self.cells}
+
+    def is_indexed(self, name):
+        """文件是否带有h3列并已建立索引"""
+        entry = self.files.get(name)
+        return entry is not None and entry['cells'] is not None
+
+    def query_cells(self, cells):
+        """含有任一单元的文件集合"""
+        names = set()
+        for cell in cells:
+            names |= self.cells.get(cell, set())
+        return names
+
+    def query_region(self, region):
+        """查询区域（见 geo_filter），返回 (命中文件集合, 候选文件集合)
+
+        命中文件有行位于区域内部单元，必然经过区域；候选文件只有行位于边界单元，
+        需按真实坐标检查；不在两者中的已索引文件没有行位于区域内。
+        """
+        inside, boundary = set(), set()
+        for resolution in self.resolutions:
+            for polygon in region:
+                edges = boundary_cells(polygon, resolution)
+                boundary |= edges
+                inside |= polygon_cells(polygon, resolution) - edges
+        hits = self.query_cells(inside)
+        return hits, self.query_cells(boundary) - hits
+
+    def query_polygon(self, polygon):
+        """查询多边形 [(lat, lon), ...]，返回值同 query_region"""
+        return self.query_region(make_region(polygon))
+
+    def query_bbox(self, min_lat, max_lat, min_lon, max_lon):
+        """查询矩形区域，返回值同 query_region"""
+        return self.query_region(rectangle(min_lat, max_lat, min_lon, max_lon))
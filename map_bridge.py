@@ -0,0 +1,285 @@
+"""folium 地图页面的增量更新桥
+
+地图页面只用 setHtml 加载一次，页面中注入 window.trackBridge 对象；
+之后的轨迹增删、样式切换、筛选区域、密度图和底图切换都以 GeoJSON / JSON
+消息通过 runJavaScript 发送。MapBridge 记录页面上已有的轨迹，
+筛选结果变化时只发送新增和移除的轨迹，大批轨迹分块发送，
+避免单条脚本过大，也不受 setHtml 的页面大小限制。
+
+点数较多的轨迹集合改由本地瓦片服务（见 track_server）提供：页面中的
+TrackTileLoader 只请求当前视图内的 z/x/y 瓦片，移出视图的瓦片随即移除。
+"""
+import json
+from branca.element import MacroElement
+from jinja2 import Template
+
+# 每条 runJavaScript 消息最多携带的轨迹数
+CHUNK_FEATURES = 200
+# 坐标保留的小数位数（约1米）
+COORD_DECIMALS = 5
+
+TILE_LOADER_JS = """
+function trackEndpoint(latlng, fillColor, tooltip, renderer) {
+    return L.circleMarker(latlng, {renderer: renderer, radius: 4, weight: 1, color: '#FFFFFF',
+                                   fillColor: fillColor, fillOpacity: 0.9}).bindTooltip(tooltip);
+}
+
+function TrackTileLoader(map) {
+    var source = null;
+    var renderer = L.canvas({padding: 0.5});
+
+    function decodePolyline(str) {
+        var points = [], index = 0, lat = 0, lon = 0;
+        while (index < str.length) {
+            var values = [0, 0];
+            for (var k = 0; k < 2; k++) {
+                var shift = 0, result = 0, b;
+                do {
+                    b = str.charCodeAt(index++) - 63;
+                    result |= (b & 0x1f) << shift;
+                    shift += 5;
+                } while (b >= 0x20);
+                values[k] = (result & 1) ? ~(result >> 1) : (result >> 1);
+            }
+            lat += values[0];
+            lon += values[1];
+            points.push([lat / 1e5, lon / 1e5]);
+        }
+        return points;
+    }
+
+    function addTile(group, data) {
+        data.tracks.forEach(function(t) {
+            t.lines.forEach(function(line) {
+                L.polyline(decodePolyline(line), Object.assign({color: t.color, renderer: renderer}, source.style))
+                    .bindTooltip(t.tooltip).addTo(group);
+            });
+            if (t.start) { trackEndpoint(t.start, 'green', t.id + ' 起点', renderer).addTo(group); }
+            if (t.end) { trackEndpoint(t.end, 'red', t.id + ' 终点', renderer).addTo(group); }
+        });
+    }
+
+    function update() {
+        if (!source) { return; }
+        var z = Math.min(Math.round(map.getZoom()), source.maxZoom);
+        var n = 1 << z;
+        var bounds = map.getBounds();
+        function column(lon) { return Math.floor((lon + 180) / 360 * n); }
+        function row(lat) {
+            lat = Math.max(Math.min(lat, 85.0511), -85.0511) * Math.PI / 180;
+            return Math.floor((1 - Math.log(Math.tan(lat) + 1 / Math.cos(lat)) / Math.PI) / 2 * n);
+        }
+        var x0 = Math.max(column(bounds.getWest()), 0), x1 = Math.min(column(bounds.getEast()), n - 1);
+        var y0 = Math.max(row(bounds.getNorth()), 0), y1 = Math.min(row(bounds.getSouth()), n - 1);
+
+        var wanted = {};
+        for (var x = x0; x <= x1; x++) {
+            for (var y = y0; y <= y1; y++) {
+                var key = z + '/' + x + '/' + y;
+                wanted[key] = true;
+                if (!source.tiles[key]) { fetchTile(source, key, z, x, y); }
+            }
+        }
+        Object.keys(source.tiles).forEach(function(key) {
+            if (!wanted[key]) {
+                map.removeLayer(source.tiles[key]);
+                delete source.tiles[key];
+            }
+        });
+    }
+
+    function fetchTile(current, key, z, x, y) {
+        var group = L.layerGroup().addTo(map);
+        current.tiles[key] = group;
+        var url = current.url.replace('{z}', z).replace('{x}', x).replace('{y}', y);
+        fetch(url).then(function(response) {
+            return response.ok ? response.json() : null;
+        }).then(function(data) {
+            // 瓦片已移出视图或图层已被替换时丢弃
+            if (data && current === source && current.tiles[key] === group) { addTile(group, data); }
+        }).catch(function() {});
+    }
+
+    function remove() {
+        if (!source) { return; }
+        Object.keys(source.tiles).forEach(function(key) { map.removeLayer(source.tiles[key]); });
+        source = null;
+    }
+
+    map.on('moveend', update);
+    return {
+        set: function(url, style, maxZoom) {
+            remove();
+            source = {url: url, style: style, maxZoom: maxZoom, tiles: {}};
+            update();
+        },
+        remove: remove
+    };
+}
+"""
+
+BRIDGE_JS = TILE_LOADER_JS + """
+(function() {
+    var map = {{ this._parent.get_name() }};
+    window.map = map;
+    var tracks = {};
+    var overlays = {};
+    var trackStyle = {weight: 2, opacity: 0.7};
+    // 轨迹线和起终点画在同一个canvas上，数千条轨迹也不产生DOM节点
+    var renderer = L.canvas({padding: 0.5});
+    var endpoints = L.featureGroup().addTo(map);
+    var trackTiles = TrackTileLoader(map);
+
+    window.trackBridge = {
+        addTracks: function(fc) {
+            fc.features.forEach(function(f) {
+                var p = f.properties;
+                if (tracks[p.id]) { return; }
+                var line = L.geoJSON(f, {style: Object.assign({color: p.color}, trackStyle), renderer: renderer})
+                    .bindTooltip(p.tooltip).addTo(map);
+                var markers = [];
+                if (p.start) {
+                    markers.push(trackEndpoint(p.start, 'green', p.id + ' 起点', renderer));
+                    markers.push(trackEndpoint(p.end, 'red', p.id + ' 终点', renderer));
+                }
+                markers.forEach(function(m) { endpoints.addLayer(m); });
+                tracks[p.id] = {line: line, markers: markers};
+            });
+        },
+        removeTracks: function(ids) {
+            ids.forEach(function(id) {
+                var t = tracks[id];
+                if (!t) { return; }
+                map.removeLayer(t.line);
+                t.markers.forEach(function(m) { endpoints.removeLayer(m); });
+                delete tracks[id];
+            });
+        },
+        clearTracks: function() {
+            window.trackBridge.removeTracks(Object.keys(tracks));
+        },
+        setTrackStyle: function(style) {
+            trackStyle = style;
+            Object.keys(tracks).forEach(function(id) { tracks[id].line.setStyle(style); });
+        },
+        setTrackTiles: function(url, style, maxZoom) { trackTiles.set(url, style, maxZoom); },
+        removeTrackTiles: function() { trackTiles.remove(); },
+        setOverlay: function(name, geojson, style, tooltip) {
+            window.trackBridge.removeOverlay(name);
+            overlays[name] = L.geoJSON(geojson, {style: style}).bindTooltip(tooltip).addTo(map);
+        },
+        setImageOverlay: function(name, url, bounds) {
+            window.trackBridge.removeOverlay(name);
+            overlays[name] = L.imageOverlay(url, bounds).addTo(map);
+        },
+        removeOverlay: function(name) {
+            if (overlays[name]) {
+                map.removeLayer(overlays[name]);
+                delete overlays[name];
+            }
+        },
+        setView: function(center, zoom) { map.setView(center, zoom); },
+        fitBounds: function(bounds) { map.fitBounds(bounds); },
+        setTiles: function(url, options) {
+            map.eachLayer(function(layer) {
+                if (layer instanceof L.TileLayer) { map.removeLayer(layer); }
+            });
+            L.tileLayer(url, options).addTo(map).bringToBack();
+        }
+    };
+})();
+"""
+
+
+class BridgeScript(MacroElement):
+    """注入 window.trackBridge 的脚本，渲染在地图对象创建之后"""
+    _template = Template("{% macro script(this, kwargs) %}" + BRIDGE_JS + "{% endmacro %}")
+
+    def __init__(self):
+        super().__init__()
+        self._name = 'BridgeScript'
+
+
+def track_feature(track_id, lats, lons, color, tooltip):
+    """单条轨迹的 GeoJSON LineString 要素，起终点放在属性中"""
+    coords = [[round(float(lon), COORD_DECIMALS), round(float(lat), COORD_DECIMALS)]
+              for lat, lon in zip(lats, lons)]
+    properties = {'id': track_id, 'color': color, 'tooltip': tooltip}
+    if coords:
+        properties['start'] = coords[0][::-1]
+        properties['end'] = coords[-1][::-1]
+    return {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': coords},
+            'properties': properties}
+
+
+def region_geojson(region):
+    """geo_filter 区域转换为 GeoJSON MultiPolygon"""
+    polygons = []
+    for polygon in region:
+        rings = []
+        for ring in polygon:
+            coords = [[float(lon), float(lat)] for lat, lon in ring]
+            rings.append(coords + coords[:1])
+        polygons.append(rings)
+    return {'type': 'MultiPolygon', 'coordinates': polygons}
+
+
+class MapBridge:
+    """常驻地图页面的增量更新接口"""
+
+    def __init__(self, page, chunk_features=CHUNK_FEATURES):
+        self.page = page
+        self.chunk_features = chunk_features
+        self.ready = False
+        self.pending = []
+        self.shown = set()
+        self.page.loadFinished.connect(self._on_load_finished)
+
+    def load(self, folium_map, base_url=None):
+        """加载基础地图页面（只在初始化时调用一次）
+
+        base_url 为页面的来源（QUrl），设为瓦片服务的地址时页面与瓦片同源，瓦片服务无需允许跨域请求。
+        """
+        root = folium_map.get_root()
+        folium_map.add_child(BridgeScript())
+
+        self.ready = False
+        self.pending = []
+        self.shown = set()
+        if base_url is None:
+            self.page.setHtml(root.render())
+        else:
+            self.page.setHtml(root.render(), base_url)
+
+    def _on_load_finished(self, ok):
+        self.ready = ok
+        if ok:
+            for script in self.pending:
+                self.page.runJavaScript(script)
+            self.pending = []
+
+    def call(self, method, *args):
+        """调用页面中的 trackBridge.<method>(*args)，页面未就绪时排队"""
+        script = f"window.trackBridge.{method}({', '.join(json.dumps(a, ensure_ascii=False) for a in args)});"
+        if self.ready:
+            self.page.runJavaScript(script)
+        else:
+            self.pending.append(script)
+
+    def sync_tracks(self, track_ids, make_feature):
+        """使页面上的轨迹与 track_ids 一致：只移除离开的、只为新增的轨迹生成并发送要素"""
+        wanted = set(track_ids)
+        removed = self.shown - wanted
+        if removed:
+            self.call('removeTracks', sorted(removed))
+
+        added = [track_id for track_id in track_ids if track_id not in self.shown]
+        for i in range(0, len(added), self.chunk_features):
+            features = [make_feature(track_id) for track_id in added[i:i + self.chunk_features]]
+            self.call('addTracks', {'type': 'FeatureCollection', 'features': features})
+        self.shown = wanted
+        return len(added), len(removed)
+
+    def clear_tracks(self):
+        self.call('clearTracks')
+        self.shown = set()
@@ -6,14 +6,27 @@ import folium
 from streamlit_folium import st_folium
 from pathlib import Path
 import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from track_manifest import load_manifest, bbox_intersects, bbox_within, folder_fingerprint
+from h3_index import load_index, h3_available, CENTER_COLUMNS
+from track_scan import file_in_region
+from geo_filter import rectangle, is_rectangle, parse_region, region_bbox, region_key, region_to_latlon_lists
+from track_simplify import SimplifiedTrack, fit_zoom, zoom_tolerance
+from track_prefetch import TrackLRU, TrackPrefetcher, neighbours
+from track_schema import SCHEMAS
+
+# 共享筛选结果缓存的条目上限
+SCAN_CACHE_ENTRIES = 128
+# 各会话共用的预取线程数
+PREFETCH_WORKERS = 2
 
 # 初始化session_state
 if 'current_index' not in st.session_state:
     st.session_state.current_index = 0
 if 'filtered_files' not in st.session_state:
     st.session_state.filtered_files = []
-if 'map' not in st.session_state:
-    st.session_state.map = None
 if 'column_mapping' not in st.session_state:
     st.session_state.column_mapping = {
         'time': 'date',
@@ -29,35 +42,158 @@ def create_save_folder():
     save_path.mkdir(exist_ok=True)
     return save_path
 
-# 绘制单条航迹
-def plot_track_on_map(df, map_obj, column_mapping):
+# 筛选结果缓存（线程安全），超过条目上限时淘汰最久未使用的结果
+class ScanCache:
+    def __init__(self, max_entries=SCAN_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return list(self.entries[key])
+
+    def put(self, key, filtered):
+        with self.lock:
+            self.entries[key] = list(filtered)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+# 筛选结果缓存（进程内共享，多个用户查询相同区域时直接复用）
+@st.cache_resource
+def scan_cache():
+    return ScanCache()
+
+# 轨迹缓存和预取线程（进程内共享），翻页时直接从内存读取
+@st.cache_resource
+def track_lru():
+    return TrackLRU()
+
+@st.cache_resource
+def prefetch_executor():
+    return ThreadPoolExecutor(PREFETCH_WORKERS, thread_name_prefix='prefetch')
+
+# 每个会话一个预取器：翻页只使本会话尚未开始的预取失效，不影响其他用户
+def track_prefetcher():
+    if 'track_prefetcher' not in st.session_state:
+        st.session_state.track_prefetcher = TrackPrefetcher(cache=track_lru(), executor=prefetch_executor())
+    return st.session_state.track_prefetcher
+
+# 底图和筛选区域：每次运行重新生成，内容只随区域变化，st_folium 据此判断是否需要重新加载页面
+def base_map(region):
+    min_lat, max_lat, min_lon, max_lon = region_bbox(region)
+    map_obj = folium.Map(location=[(min_lat + max_lat) / 2, (min_lon + max_lon) / 2], zoom_start=9)
+    
+    # 绘制筛选区域
+    for area_coords in region_to_latlon_lists(region):
+        folium.Polygon(
+            locations=area_coords,
+            color='#ff7800',
+            fill=True,
+            fill_color='#ffff00',
+            fill_opacity=0.2,
+            weight=2,
+            tooltip="筛选区域"
+        ).add_to(map_obj)
+    return map_obj
+
+# 当前航迹图层：作为 FeatureGroup 替换页面上的上一条航迹，返回 (图层, 中心点, 缩放级别)
+def track_layer(df, column_mapping, width=800, height=500):
     # 获取映射后的列名
     lat_col = column_mapping['latitude']
     lon_col = column_mapping['longitude']
+    layer = folium.FeatureGroup(name="当前航迹")
+    
+    # 地图范围
+    lat_min, lat_max = df[lat_col].min(), df[lat_col].max()
+    lon_min, lon_max = df[lon_col].min(), df[lon_col].max()
+    zoom = fit_zoom((lon_min, lon_max), (lat_min, lat_max), width, height)
+    center = [(lat_min + lat_max) / 2, (lon_min + lon_max) / 2]
     
-    # 绘制完整航迹
-    track_points = list(zip(df[lat_col], df[lon_col]))
-    folium.PolyLine(track_points, color='blue', weight=2.5, opacity=1).add_to(map_obj)
+    # 绘制航迹（按适配地图范围的缩放级别简化，首尾点始终保留；地图在浏览器中绘制，
+    # 长航迹也以简化后的折线直接发送，不使用只监听本机回环地址的瓦片服务）
+    track = SimplifiedTrack(df[lat_col], df[lon_col])
+    track_points = list(zip(*track.coords(zoom_tolerance(zoom))))
+    folium.PolyLine(track_points, color='blue', weight=2.5, opacity=1).add_to(layer)
     
     # 标记起点和终点
     folium.Marker(
         location=track_points[0],
         icon=folium.Icon(color='green', icon='play', prefix='fa'),
         tooltip="起点"
-    ).add_to(map_obj)
+    ).add_to(layer)
     
     folium.Marker(
         location=track_points[-1],
         icon=folium.Icon(color='red', icon='stop', prefix='fa'),
         tooltip="终点"
-    ).add_to(map_obj)
+    ).add_to(layer)
     
-    # 设置地图范围
-    sw = df[[lat_col, lon_col]].min().values.tolist()
-    ne = df[[lat_col, lon_col]].max().values.tolist()
-    map_obj.fit_bounds([sw, ne])
+    return layer, center, zoom
+
+# 扫描文件夹，返回经过区域的 [(文件路径, 点数), ...]，没有CSV文件时返回None
+def scan_folder(data_dir, lat_col, lon_col, region, segments):
+    min_lat, max_lat, min_lon, max_lon = region_bbox(region)
+    rectangular = is_rectangle(region)
     
-    return map_obj
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+
+    # 加载（或增量更新）文件夹清单
+    files = load_manifest(
+        data_dir, recursive=True, lat_col=lat_col, lon_col=lon_col,
+        progress_callback=lambda done, total: status_text.text(f"更新文件清单: {done}/{total} 文件")
+    )
+
+    if not files:
+        st.warning("未找到CSV文件！")
+        return None
+
+    filtered = []
+
+    # H3特征文件（按单元中心点筛选）先通过单元倒排索引判断，
+    # 只在边界单元出现的文件仍按真实坐标扫描
+    h3_index, h3_hits, h3_candidates = None, set(), set()
+    if h3_available() and (lat_col, lon_col) == CENTER_COLUMNS:
+        h3_index = load_index(data_dir, recursive=True)
+        h3_hits, h3_candidates = h3_index.query_region(region)
+
+    for i, (name, entry) in enumerate(files.items()):
+        file_path = os.path.join(data_dir, name)
+        try:
+            # 检查列名是否存在于数据中
+            if entry['error']:
+                st.warning(f"文件 {os.path.basename(file_path)} {entry['error']}")
+                continue
+
+            # 边界框不相交的文件无需读取，完全位于矩形区域内的文件必然命中
+            if rectangular and bbox_within(entry, min_lat, max_lat, min_lon, max_lon):
+                filtered.append((file_path, entry['rows']))
+            elif (h3_index is not None and h3_index.is_indexed(name) and
+                  (name in h3_hits or (name not in h3_candidates and not segments))):
+                # H3索引只能判断点；航段模式下未命中的文件仍需检查航段
+                if name in h3_hits:
+                    filtered.append((file_path, entry['rows']))
+            elif bbox_intersects(entry, min_lat, max_lat, min_lon, max_lon):
+                # 流式读取，遇到第一个区域内的点即停止
+                if file_in_region(file_path, lat_col, lon_col, region, entry['chunks'], segments):
+                    filtered.append((file_path, entry['rows']))
+
+        except Exception as e:
+            st.error(f"处理文件 {file_path} 时出错: {str(e)}")
+
+        progress_bar.progress((i + 1) / len(files))
+        status_text.text(f"处理中: {i+1}/{len(files)} 文件")
+    
+    return filtered
 
 # 主应用
 def main():
@@ -74,6 +210,16 @@ def main():
     st.subheader("列名映射设置")
     st.info("如果您的CSV文件使用不同的列名，请在此指定映射关系")
     
+    def apply_schema():
+        # 选择已登记的数据格式时按格式填写列名映射
+        schema = SCHEMAS.get(st.session_state.schema_name)
+        if schema is not None:
+            st.session_state.column_mapping = dict(schema.mapping)
+
+    st.selectbox("数据格式", ['custom'] + list(SCHEMAS), key='schema_name', on_change=apply_schema,
+                 format_func=lambda name: SCHEMAS[name].title if name in SCHEMAS else "自定义",
+                 help="已登记格式的文件按登记的列类型快速读取")
+
     with st.expander("配置列名映射"):
         col1, col2 = st.columns(2)
         with col1:
@@ -103,51 +249,48 @@ def main():
     with col2:
         min_lon = st.number_input("最小经度", value=110.0)
         max_lon = st.number_input("最大经度", value=130.0)
+    polygon_text = st.text_input("多边形顶点（可选）", "",
+                                 help="格式: lat,lon; lat,lon; ...，多个多边形用 | 分隔；填写后代替上面的矩形")
+    
+    segments = st.checkbox("检测定位点之间穿越区域的航段", value=False,
+                           help="采样稀疏时，船舶可能在两个定位点之间穿过小区域")
+    
+    # 筛选区域：填写了多边形顶点时使用多边形，否则使用经纬度矩形
+    try:
+        region = parse_region(polygon_text) if polygon_text.strip() else rectangle(min_lat, max_lat, min_lon, max_lon)
+    except ValueError as e:
+        st.error(f"多边形顶点格式错误: {str(e)}")
+        return
     
     # 筛选按钮
-    if st.button("筛选航迹数据"):
-        all_files = []
-        for root, _, files in os.walk(data_dir):
-            for file in files:
-                if file.endswith(".csv"):
-                    all_files.append(os.path.join(root, file))
-        
-        if not all_files:
+    col1, col2 = st.columns([3, 1])
+    with col2:
+        if st.button("🗑️ 清除缓存", help="清除共享的筛选结果和航迹数据缓存（文件变化时缓存会自动失效）"):
+            scan_cache().clear()
+            track_prefetcher().cache.clear()
+            st.info("缓存已清除")
+    with col1:
+        run_filter = st.button("筛选航迹数据")
+    if run_filter:
+        if not os.path.isdir(data_dir):
             st.warning("未找到CSV文件！")
             return
-        
-        filtered = []
-        progress_bar = st.progress(0)
-        status_text = st.empty()
 
         # 获取映射后的列名
         lat_col = st.session_state.column_mapping['latitude']
         lon_col = st.session_state.column_mapping['longitude']
-        
-        for i, file_path in enumerate(all_files):
-            try:
-                df = pd.read_csv(file_path)
-
-                # 检查列名是否存在于数据中
-                required_cols = {lat_col, lon_col}
-                if not required_cols.issubset(df.columns):
-                    missing_cols = required_cols - set(df.columns)
-                    st.warning(f"文件 {os.path.basename(file_path)} 缺少必要列: {', '.join(missing_cols)}")
-                    continue
-                
-                # 筛选区域内的点
-                in_area = df[
-                    (df[lat_col].between(min_lat, max_lat)) & 
-                    (df[lon_col].between(min_lon, max_lon))
-                ]
-                if not in_area.empty:
-                    filtered.append((file_path, len(df)))
-                
-            except Exception as e:
-                st.error(f"处理文件 {file_path} 时出错: {str(e)}")
-            
-            progress_bar.progress((i + 1) / len(all_files))
-            status_text.text(f"处理中: {i+1}/{len(all_files)} 文件")
+
+        # 文件夹内容、列名映射、区域和模式都相同时直接复用（其他用户的）筛选结果
+        key = (os.path.abspath(data_dir), folder_fingerprint(data_dir, recursive=True),
+               lat_col, lon_col, region_key(region), segments)
+        filtered = scan_cache().get(key)
+        if filtered is None:
+            filtered = scan_folder(data_dir, lat_col, lon_col, region, segments)
+            if filtered is None:
+                return
+            scan_cache().put(key, filtered)
+        else:
+            st.info("使用缓存的筛选结果")
         
         # 排序结果
         st.session_state.filtered_files = sorted(filtered, key=lambda x: x[0])
@@ -160,43 +303,23 @@ def main():
         current_file, point_count = st.session_state.filtered_files[st.session_state.current_index]
         st.write(f"当前航迹: {os.path.basename(current_file)} (点数: {point_count})")
         
-        # 加载当前航迹数据
+        # 加载当前航迹数据，并在后台预取前后几条
         try:
-            current_df = pd.read_csv(current_file)
-            
-            # 创建地图
-            if st.session_state.map is None:
-                center_lat = (min_lat + max_lat) / 2
-                center_lon = (min_lon + max_lon) / 2
-                st.session_state.map = folium.Map(location=[center_lat, center_lon], zoom_start=9)
-                
-                # 绘制筛选区域
-                area_coords = [
-                    [min_lat, min_lon],
-                    [min_lat, max_lon],
-                    [max_lat, max_lon],
-                    [max_lat, min_lon]
-                ]
-                folium.Rectangle(
-                    bounds=area_coords,
-                    color='#ff7800',
-                    fill=True,
-                    fill_color='#ffff00',
-                    fill_opacity=0.2,
-                    weight=2,
-                    tooltip="筛选区域"
-                ).add_to(st.session_state.map)
+            current_df = track_prefetcher().load(current_file)
+            track_prefetcher().prefetch(neighbours([f for f, _ in st.session_state.filtered_files],
+                                                   st.session_state.current_index))
             
-            # 绘制当前航迹
-            st.session_state.map = plot_track_on_map(current_df, 
-                                                   st.session_state.map, 
-                                                   st.session_state.column_mapping)
+            # 当前航迹图层
+            layer, center, zoom = track_layer(current_df, st.session_state.column_mapping)
             
         except Exception as e:
             st.error(f"加载航迹数据时出错: {str(e)}")
+            layer, center, zoom = None, None, None
         
-        # 显示地图
-        st_map = st_folium(st.session_state.map, width=800, height=500)
+        # 显示地图：底图不变时只替换航迹图层并移动视图，不重新加载页面
+        st_map = st_folium(base_map(region), width=800, height=500, key="track_map",
+                           feature_group_to_add=layer, center=center, zoom=zoom,
+                           returned_objects=[])
         
         # 航迹控制按钮
         col1, col2, col3 = st.columns(3)
@@ -0,0 +1,401 @@
+"""底图瓦片缓存与离线瓦片源
+
+瓦片按 (样式, z, x, y) 缓存在磁盘上（默认 .tile_cache/），总大小超过上限时
+按最近最少使用（LRU）淘汰；切换轨迹、样式时命中的瓦片无需重新下载。
+
+瓦片源可以是：
+  - 在线URL模板，如 https://tile.openstreetmap.org/{z}/{x}/{y}.png
+  - MBTiles文件（*.mbtiles，TMS行号）
+  - 本地XYZ目录（<目录>/{z}/{x}/{y}.png，或带 {z}/{x}/{y} 的路径模板）
+离线源不经过磁盘缓存。在线源的下载函数（fetcher）可替换，
+默认使用带连接池的 requests.Session。
+
+TileFetcher 用线程池并发获取并解码瓦片，每个瓦片完成后立即回调，
+界面可以逐块绘制；发起新请求时尚未开始的旧请求被取消。
+
+瓦片为Web墨卡托投影，tile_image 把单个瓦片按行重采样为经纬度线性的图像，
+可以直接用 imshow 绘制在 EPSG:4326 坐标轴上。
+"""
+import os
+import math
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+TILE_SIZE = 256
+MAX_LAT = 85.0511287798
+# 单次视图最多请求的瓦片数，超过时降低缩放级别
+MAX_VIEW_TILES = 64
+# 并发下载线程数（同时也是HTTP连接池大小）
+FETCH_WORKERS = 8
+# 预热瓦片（只写入磁盘缓存）的线程数，与视图请求分开，不占用其线程
+WARM_WORKERS = 2
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.tile_cache')
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+TILE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def http_fetcher(timeout=10, session=None, pool_size=FETCH_WORKERS):
+    """默认下载函数：url -> 瓦片字节，404返回None，其余错误抛出异常"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    session.headers.setdefault('User-Agent', 'relate_data_make tile client')
+
+    def fetch(url):
+        response = session.get(url, timeout=timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.content
+    return fetch
+
+
+class UrlTileSource:
+    """在线瓦片源"""
+    cacheable = True
+
+    def __init__(self, url, fetcher=None, max_zoom=19):
+        self.url = url
+        self.fetcher = fetcher or http_fetcher()
+        self.max_zoom = max_zoom
+
+    def get(self, z, x, y):
+        return self.fetcher(self.url.format(z=z, x=x, y=y))
+
+
+class XYZDirectorySource:
+    """本地 {z}/{x}/{y} 瓦片目录"""
+    cacheable = False
+
+    def __init__(self, root, max_zoom=None):
+        if '{z}' in root:
+            self.template = root
+        else:
+            self.template = None
+            self.root = root
+        self.max_zoom = max_zoom if max_zoom is not None else self._detect_max_zoom()
+
+    def _detect_max_zoom(self):
+        if self.template is not None:
+            return 19
+        levels = [int(d) for d in os.listdir(self.root) if d.isdigit()]
+        return max(levels) if levels else 19
+
+    def get(self, z, x, y):
+        if self.template is not None:
+            candidates = [self.template.format(z=z, x=x, y=y)]
+        else:
+            base = os.path.join(self.root, str(z), str(x), str(y))
+            candidates = [base + ext for ext in TILE_EXTENSIONS]
+        for path in candidates:
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    return f.read()
+        return None
+
+
+class MBTilesSource:
+    """MBTiles 瓦片文件（SQLite，tile_row 为TMS行号）"""
+    cacheable = False
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        self.max_zoom = 19
+        try:
+            row = self.conn.execute("SELECT value FROM metadata WHERE name = 'maxzoom'").fetchone()
+            if row is None:
+                row = self.conn.execute("SELECT MAX(zoom_level) FROM tiles").fetchone()
+            if row and row[0] is not None:
+                self.max_zoom = int(row[0])
+        except sqlite3.Error:
+            pass
+
+    def get(self, z, x, y):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, (1 << z) - 1 - y)
+            ).fetchone()
+        return bytes(row[0]) if row else None
+
+
+def make_source(spec, fetcher=None):
+    """由配置项（URL模板 / .mbtiles路径 / 瓦片目录）创建瓦片源"""
+    if not isinstance(spec, str):
+        return spec
+    if spec.startswith(('http://', 'https://')):
+        return UrlTileSource(spec, fetcher)
+    if spec.lower().endswith('.mbtiles'):
+        return MBTilesSource(spec)
+    return XYZDirectorySource(spec)
+
+
+def discover_offline_sources(folder):
+    """扫描文件夹中的 *.mbtiles 文件和瓦片目录，返回 {样式名: 路径}"""
+    sources = {}
+    if not os.path.isdir(folder):
+        return sources
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if name.lower().endswith('.mbtiles'):
+            sources[f'离线: {os.path.splitext(name)[0]}'] = path
+        elif os.path.isdir(path) and any(d.isdigit() for d in os.listdir(path)):
+            sources[f'离线: {name}'] = path
+    return sources
+
+
+class DiskTileCache:
+    """按 (样式, z, x, y) 存放瓦片的磁盘LRU缓存（线程安全）"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self._scan()
+
+    def _scan(self):
+        """按修改时间（即最近访问时间）由旧到新载入已有瓦片"""
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if file.endswith('.tile'):
+                    path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(found):
+            self.entries[path] = size
+            self.total_bytes += size
+
+    def path(self, key):
+        style, z, x, y = key
+        safe_style = ''.join(c if c.isalnum() or c in '-_' else '_' for c in style)
+        return os.path.join(self.cache_dir, safe_style, str(z), str(x), f'{y}.tile')
+
+    def get(self, key):
+        path = self.path(key)
+        with self.lock:
+            if path not in self.entries:
+                return None
+            self.entries.move_to_end(path)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            with self.lock:
+                self.total_bytes -= self.entries.pop(path, 0)
+            return None
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.total_bytes -= self.entries.pop(path, 0)
+            self.entries[path] = len(data)
+            self.total_bytes += len(data)
+            evicted = []
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                old_path, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                evicted.append(old_path)
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+
+class TileCache:
+    """按样式取瓦片：离线源直接读取，在线源先查磁盘缓存，未命中再下载并写入缓存"""
+
+    def __init__(self, sources, disk_cache=None, fetcher=None):
+        self.specs = dict(sources)
+        self.fetcher = fetcher
+        self.disk_cache = disk_cache if disk_cache is not None else DiskTileCache()
+        self.sources = {}
+
+    def source(self, style):
+        if style not in self.sources:
+            self.sources[style] = make_source(self.specs[style], self.fetcher)
+        return self.sources[style]
+
+    def get_tile(self, style, z, x, y):
+        """返回瓦片字节，瓦片不存在时返回None"""
+        source = self.source(style)
+        if not source.cacheable:
+            return source.get(z, x, y)
+
+        key = (style, z, x, y)
+        data = self.disk_cache.get(key)
+        if data is None:
+            data = source.get(z, x, y)
+            if data is not None:
+                self.disk_cache.put(key, data)
+        return data
+
+
+def tile_xy(lon, lat, z):
+    """经纬度对应的（浮点）瓦片坐标"""
+    n = 1 << z
+    lat = np.clip(lat, -MAX_LAT, MAX_LAT)
+    x = (np.asarray(lon) + 180.0) / 360.0 * n
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lat))) / math.pi) / 2.0 * n
+    return x, y
+
+
+def tile_lat(y, z):
+    """瓦片行号（可为浮点）对应的纬度"""
+    return np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * np.asarray(y) / (1 << z)))))
+
+
+def choose_zoom(xlim, width_px, max_zoom=19):
+    """使瓦片像素与屏幕像素大致相当的缩放级别"""
+    lon_span = max(abs(xlim[1] - xlim[0]), 1e-9)
+    z = math.log2(max(width_px, 1) * 360.0 / (TILE_SIZE * lon_span))
+    return int(min(max(round(z), 0), max_zoom))
+
+
+def view_tiles(xlim, ylim, width_px, max_zoom=19):
+    """覆盖视图范围的瓦片列表 [(z, x, y), ...]，从视图中心向外排列"""
+    z = choose_zoom(xlim, width_px, max_zoom)
+    while True:
+        n = 1 << z
+        x0, y1 = tile_xy(min(xlim), min(ylim), z)
+        x1, y0 = tile_xy(max(xlim), max(ylim), z)
+        xs = range(max(int(x0), 0), min(int(x1), n - 1) + 1)
+        ys = range(max(int(y0), 0), min(int(y1), n - 1) + 1)
+        if len(xs) * len(ys) <= MAX_VIEW_TILES or z == 0:
+            break
+        z -= 1
+
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    tiles = [(z, x, y) for x in xs for y in ys]
+    tiles.sort(key=lambda t: (t[1] + 0.5 - cx) ** 2 + (t[2] + 0.5 - cy) ** 2)
+    return tiles
+
+
+def tile_image(data, z, x, y):
+    """解码瓦片并按行重采样为纬度线性，返回 (RGBA数组, imshow用的extent)"""
+    image = np.asarray(Image.open(BytesIO(data)).convert('RGBA'))
+    n = 1 << z
+    lon_left, lon_right = x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+    lat_top, lat_bottom = float(tile_lat(y, z)), float(tile_lat(y + 1, z))
+
+    # 每个输出行的纬度 -> 墨卡托瓦片内的源行号
+    rows = image.shape[0]
+    lats = lat_top - (np.arange(rows) + 0.5) / rows * (lat_top - lat_bottom)
+    _, source_y = tile_xy(0.0, lats, z)
+    source_rows = np.clip(((source_y - y) * rows).astype(np.int64), 0, rows - 1)
+    return image[source_rows], (lon_left, lon_right, lat_bottom, lat_top)
+
+
+class TileFetcher:
+    """并发获取视图瓦片，逐个回调结果；新请求或 cancel() 使旧请求失效
+
+    失效只取消尚未开始的瓦片；已在下载的瓦片不会中断，下载完成后照常写入磁盘缓存
+    （之后的视图可直接使用），但不再解码和回调。
+    """
+
+    def __init__(self, tile_cache, max_workers=FETCH_WORKERS):
+        self.tile_cache = tile_cache
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='tile')
+        self.warm_executor = ThreadPoolExecutor(WARM_WORKERS, thread_name_prefix='tile-warm')
+        self.warm_futures = []
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.futures = []
+
+    def request(self, style, tiles, on_tile, on_done=None):
+        """异步获取瓦片，返回本次请求的编号
+
+        on_tile(编号, 图像, extent) 在工作线程中对每个成功的瓦片调用，
+        on_done(编号, 失败数) 在全部瓦片处理完后调用；请求失效后不再回调。
+        tiles 为空时 on_done 在本函数返回之前同步调用，此时调用方还拿不到返回的编号。
+        """
+        with self.lock:
+            self._cancel_pending()
+            generation = self.generation
+            state = {'remaining': len(tiles), 'failed': 0}
+
+        def task(z, x, y):
+            if generation != self.generation:
+                return
+            try:
+                data = self.tile_cache.get_tile(style, z, x, y)
+                if data is not None and generation == self.generation:
+                    image, extent = tile_image(data, z, x, y)
+                    if generation == self.generation:
+                        on_tile(generation, image, extent)
+            except Exception:
+                with self.lock:
+                    state['failed'] += 1
+            finally:
+                with self.lock:
+                    state['remaining'] -= 1
+                    finished = state['remaining'] == 0 and generation == self.generation
+                if finished and on_done:
+                    on_done(generation, state['failed'])
+
+        with self.lock:
+            self.futures = [self.executor.submit(task, *tile) for tile in tiles]
+        if not tiles and on_done:
+            on_done(generation, 0)
+        return generation
+
+    def warm(self, style, tiles):
+        """在后台把瓦片取到磁盘缓存（不解码、不回调），与视图请求互不影响"""
+        def task(z, x, y):
+            try:
+                self.tile_cache.get_tile(style, z, x, y)
+            except Exception:
+                pass
+
+        with self.lock:
+            self.warm_futures = [f for f in self.warm_futures if not f.done()]
+            self.warm_futures.extend(self.warm_executor.submit(task, *tile) for tile in tiles)
+
+    def cancel_warm(self):
+        """取消尚未开始的预热"""
+        with self.lock:
+            for future in self.warm_futures:
+                future.cancel()
+            self.warm_futures = []
+
+    def _cancel_pending(self):
+        self.generation += 1
+        for future in self.futures:
+            future.cancel()
+        self.futures = []
+
+    def cancel(self):
+        """使所有未完成的请求失效（已在下载的瓦片见类说明）"""
+        with self.lock:
+            self._cancel_pending()
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
+        self.warm_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,198 @@
+"""轨迹文件夹的列式二进制缓存
+
+"编译"文件夹时把每个CSV转换为 .track_cache/<文件名>.bin：
+坐标列保存为float64，其余浮点列为float32，时间列为int64纳秒时间戳，
+文本列（label、status、h3等）按字典编码为整数码。读取时整文件内存映射，
+各列直接由映射缓冲区得到，无需解析文本。
+
+缓存头中记录源CSV的 mtime/size，源文件变化后缓存自动失效，
+read_track 会退回读取CSV。
+
+用法: python track_cache.py <数据文件夹>
+"""
+import os
+import sys
+import json
+import struct
+import threading
+import numpy as np
+import pandas as pd
+from track_manifest import list_csv_files, LAT_COLUMNS, LON_COLUMNS, TIME_COLUMNS
+from track_schema import read_csv_fast, parse_times
+
+CACHE_DIR = '.track_cache'
+CACHE_MAGIC = b'TRKC'
+CACHE_VERSION = 1
+ALIGN = 8
+
+COORD_COLUMNS = set(LAT_COLUMNS + LON_COLUMNS)
+
+
+def cache_path(filepath):
+    """CSV文件对应的缓存文件路径"""
+    folder, filename = os.path.split(filepath)
+    return os.path.join(folder, CACHE_DIR, filename + '.bin')
+
+
+def encode_column(name, series):
+    """把一列转换为 (类型, numpy数组, 字典)"""
+    if name in TIME_COLUMNS:
+        times = parse_times(series)
+        if times.notna().any() or series.isna().all():
+            return 'time', times.to_numpy('datetime64[ns]').view(np.int64), None
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = [str(c) for c in series.cat.categories]
+        codes = series.cat.codes.to_numpy()
+        return 'dict', codes.astype(np.int32 if len(categories) > 32767 else np.int16), categories
+
+    if pd.api.types.is_bool_dtype(series):
+        return 'num', series.to_numpy(np.bool_), None
+    if pd.api.types.is_integer_dtype(series):
+        return 'num', series.to_numpy(np.int64), None
+    if pd.api.types.is_float_dtype(series):
+        dtype = np.float64 if name in COORD_COLUMNS else np.float32
+        return 'num', series.to_numpy(dtype), None
+
+    codes, categories = pd.factorize(series.astype(object), use_na_sentinel=True)
+    codes = codes.astype(np.int32 if len(categories) > 32767 else np.int16)
+    return 'dict', codes, [str(c) for c in categories]
+
+
+def _read_header(f):
+    """读取缓存头，格式不符时返回None"""
+    prefix = f.read(8)
+    if len(prefix) != 8 or prefix[:4] != CACHE_MAGIC:
+        return None
+    header_len = struct.unpack('<I', prefix[4:])[0]
+    try:
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    except ValueError:
+        return None
+    if header.get('version') != CACHE_VERSION:
+        return None
+    header['data_start'] = 8 + header_len
+    return header
+
+
+def compile_file(filepath):
+    """把单个CSV文件编译为列式缓存"""
+    stat = os.stat(filepath)
+    df = read_csv_fast(filepath)
+
+    columns = []
+    arrays = []
+    offset = 0
+    for name in df.columns:
+        kind, array, categories = encode_column(name, df[name])
+        array = np.ascontiguousarray(array)
+        columns.append({'name': name, 'kind': kind, 'dtype': array.dtype.str,
+                        'offset': offset, 'categories': categories})
+        arrays.append(array)
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+
+    header = {'version': CACHE_VERSION, 'mtime': stat.st_mtime, 'size': stat.st_size,
+              'rows': len(df), 'columns': columns}
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    header_bytes += b' ' * (-(len(header_bytes) + 8) % ALIGN)
+
+    path = cache_path(filepath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 临时文件名带进程号和线程号，同时编译同一文件时互不覆盖
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(CACHE_MAGIC + struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        for array in arrays:
+            f.write(array.tobytes())
+            f.write(b'\0' * (-array.nbytes % ALIGN))
+    os.replace(tmp_path, path)
+
+
+def cache_header(filepath):
+    """返回新鲜缓存的头信息，缓存不存在或已过期时返回None"""
+    try:
+        stat = os.stat(filepath)
+        with open(cache_path(filepath), 'rb') as f:
+            header = _read_header(f)
+    except OSError:
+        return None
+    if header is None or header['mtime'] != stat.st_mtime or header['size'] != stat.st_size:
+        return None
+    return header
+
+
+def is_fresh(filepath):
+    """缓存是否存在且与源文件一致"""
+    return cache_header(filepath) is not None
+
+
+def compile_folder(folder, progress_callback=None):
+    """编译文件夹中所有过期或缺失缓存的CSV文件，返回编译的文件数"""
+    csv_files = list_csv_files(folder)
+    compiled = 0
+    for i, name in enumerate(csv_files):
+        filepath = os.path.join(folder, name)
+        if not is_fresh(filepath):
+            try:
+                compile_file(filepath)
+                compiled += 1
+            except Exception as e:
+                print(f"Error compiling {name}: {e}")
+        if progress_callback:
+            progress_callback(i + 1, len(csv_files))
+    return compiled
+
+
+def read_cached_columns(filepath, usecols=None):
+    """从新鲜缓存中内存映射读取各列，返回 {列名: 数组}；无可用缓存时返回None
+
+    数值列直接是映射缓冲区上的只读视图，字典编码列返回Categorical。
+    """
+    header = cache_header(filepath)
+    if header is None:
+        return None
+
+    path = cache_path(filepath)
+    data_start = header['data_start']
+    rows = header['rows']
+    buffer = np.memmap(path, dtype=np.uint8, mode='r') if rows else None
+
+    columns = {}
+    for col in header['columns']:
+        if usecols is not None and col['name'] not in usecols:
+            continue
+        dtype = np.dtype(col['dtype'])
+        start = data_start + col['offset']
+        if rows:
+            array = buffer[start:start + rows * dtype.itemsize].view(dtype)
+        else:
+            array = np.empty(0, dtype=dtype)
+
+        if col['kind'] == 'time':
+            array = array.view('datetime64[ns]')
+        elif col['kind'] == 'dict':
+            array = pd.Categorical.from_codes(array, categories=col['categories'])
+        columns[col['name']] = array
+
+    if usecols is not None and set(usecols) - set(columns):
+        return None
+    return columns
+
+
+def read_track(filepath, usecols=None):
+    """读取轨迹文件，缓存新鲜时直接使用列式缓存，否则解析CSV（见 track_schema）"""
+    columns = read_cached_columns(filepath, usecols)
+    if columns is None:
+        return read_csv_fast(filepath, usecols=usecols)
+    if usecols is not None:
+        columns = {name: columns[name] for name in usecols}
+    return pd.DataFrame(columns, copy=False)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("用法: python track_cache.py <数据文件夹>")
+        sys.exit(1)
+    count = compile_folder(sys.argv[1])
+    print(f"已编译 {count} 个文件")
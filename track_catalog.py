@@ -0,0 +1,134 @@
+"""按需加载的轨迹目录
+
+打开文件夹时只加载文件清单（见 track_manifest）中每条轨迹的点数、边界框、
+船舶类型和时间范围，统计、图例颜色和按边界框的初筛都只用这些元数据。
+坐标在轨迹真正要绘制或精确筛选时才读取（只读经纬度两列，单精度），
+放入按内存大小淘汰的LRU缓存（见 track_prefetch）：离开视图的轨迹不再被访问，
+最先被淘汰。
+
+TrackCatalog 提供与 TrackStore 相同的常用接口（len、names、mode、bboxes、
+subset、tracks_in_region），界面代码可以不区分两者。
+"""
+import os
+import sys
+import numpy as np
+import pandas as pd
+from track_cache import read_track
+from track_manifest import load_manifest
+from track_prefetch import TrackLRU
+from track_store import TrackStore
+from geo_filter import region_bbox
+
+
+class TrackCatalog:
+    """只含元数据的轨迹集合，坐标按需读取并缓存"""
+
+    def __init__(self, folder, files, entries, cache=None):
+        self.folder = folder
+        self.files = list(files)
+        self.entries = list(entries)
+        self.names = [os.path.splitext(os.path.basename(name))[0] for name in self.files]
+        self.cache = cache if cache is not None else TrackLRU()
+        self.lengths = np.array([entry['rows'] for entry in self.entries], dtype=np.int64)
+        self._bboxes = tuple(
+            np.array([np.nan if entry[key] is None else entry[key] for entry in self.entries], dtype=np.float64)
+            for key in ('lat_min', 'lat_max', 'lon_min', 'lon_max')
+        )
+
+    @classmethod
+    def from_folder(cls, folder, progress_callback=None, cache=None):
+        """由文件夹清单构建（只重新扫描新增或变化的文件），只收录有经纬度列的文件"""
+        manifest = load_manifest(folder, progress_callback=progress_callback)
+        files = [name for name, entry in manifest.items() if not entry['error'] and entry['rows'] > 0]
+        return cls(folder, files, [manifest[name] for name in files], cache)
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def total_points(self):
+        return int(self.lengths.sum())
+
+    @property
+    def nbytes(self):
+        """元数据和已缓存坐标占用的字节数"""
+        return (self.lengths.nbytes + sum(array.nbytes for array in self._bboxes) +
+                sum(sys.getsizeof(name) for name in self.names) + self.cache.total_bytes)
+
+    @property
+    def bytes_per_track(self):
+        return self.nbytes / len(self) if len(self) else 0.0
+
+    def bboxes(self):
+        """每条轨迹的边界框，返回 (lat_min, lat_max, lon_min, lon_max) 四个数组"""
+        return self._bboxes
+
+    def mode(self, column):
+        """每条轨迹的主类型（清单中只记录 label 列）"""
+        if column != 'label':
+            raise KeyError(column)
+        return [entry.get('label') for entry in self.entries]
+
+    def time_range(self):
+        """全部轨迹的 (最早, 最晚) 时间，清单中没有时间信息时返回None"""
+        times = [(entry['time_min'], entry['time_max']) for entry in self.entries if entry['time_min']]
+        if not times:
+            return None
+        return pd.Timestamp(min(t[0] for t in times)), pd.Timestamp(max(t[1] for t in times))
+
+    def center(self):
+        """按点数加权的边界框中心，作为地图初始视图中心"""
+        lat_min, lat_max, lon_min, lon_max = self._bboxes
+        valid = ~np.isnan(lat_min)
+        if not valid.any():
+            return None
+        weights = self.lengths[valid]
+        return [float(np.average((lat_min[valid] + lat_max[valid]) / 2, weights=weights)),
+                float(np.average((lon_min[valid] + lon_max[valid]) / 2, weights=weights))]
+
+    def subset(self, indices):
+        """按轨迹编号选出子集，共享坐标缓存"""
+        return TrackCatalog(self.folder, [self.files[i] for i in indices],
+                            [self.entries[i] for i in indices], self.cache)
+
+    def coords(self, index):
+        """第 index 条轨迹的 (lats, lons)，命中缓存时不读文件"""
+        entry = self.entries[index]
+        path = os.path.join(self.folder, self.files[index])
+        df = self.cache.get(path, entry['mtime'])
+        if df is None:
+            raw = read_track(path, usecols=[entry['lat_col'], entry['lon_col']])
+            df = pd.DataFrame({
+                'lat': pd.to_numeric(raw[entry['lat_col']], errors='coerce').to_numpy(np.float32),
+                'lon': pd.to_numeric(raw[entry['lon_col']], errors='coerce').to_numpy(np.float32),
+            })
+            self.cache.put(path, entry['mtime'], df)
+        return df['lat'].to_numpy(), df['lon'].to_numpy()
+
+    def materialize(self, indices=None):
+        """读取（部分）轨迹的坐标，返回只含 lat/lon 两列的 TrackStore"""
+        indices = range(len(self)) if indices is None else indices
+        lats, lons, names = [], [], []
+        for index in indices:
+            track_lats, track_lons = self.coords(index)
+            lats.append(track_lats)
+            lons.append(track_lons)
+            names.append(self.names[index])
+        lengths = np.array([len(a) for a in lats], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        columns = {'lat': np.concatenate(lats) if lats else np.empty(0, np.float32),
+                   'lon': np.concatenate(lons) if lons else np.empty(0, np.float32)}
+        return TrackStore(columns, ends - lengths, ends, names)
+
+    def candidates(self, region):
+        """边界框与区域边界框相交的轨迹编号（不读坐标）"""
+        min_lat, max_lat, min_lon, max_lon = region_bbox(region)
+        lat_min, lat_max, lon_min, lon_max = self._bboxes
+        return np.flatnonzero((lat_min <= max_lat) & (lat_max >= min_lat) &
+                              (lon_min <= max_lon) & (lon_max >= min_lon))
+
+    def tracks_in_region(self, region, segments=False):
+        """返回经过区域的轨迹编号：先按边界框初筛，只读取候选轨迹的坐标"""
+        candidates = self.candidates(region)
+        hits = self.materialize(candidates).tracks_in_region(region, segments)
+        return candidates[hits]
@@ -0,0 +1,96 @@
+"""按文件大小分层抽样的文件夹统计估算
+
+文件数很多时先 stat 全部文件得到大小，按大小分位数分层；扫描顺序在各层内随机、
+按层内进度交错，因此已扫描的任何前缀都是按比例分层的随机样本。总量按分层估计
+（点数用文件字节数作比率估计），给出95%置信区间；已扫描部分计入精确值、
+只对未扫描部分外推，全部扫描完时估计值即为精确值、置信区间为0。
+"""
+import numpy as np
+
+# 按文件大小划分的层数
+SIZE_STRATA = 8
+# 每层至少抽样的文件数（据此估计层内方差）
+MIN_STRATUM_SAMPLES = 2
+# 95%置信区间的正态分位数
+CONFIDENCE_Z = 1.96
+
+
+def size_strata(sizes, strata=SIZE_STRATA):
+    """按文件大小分位数分层，返回每个文件的层号（大小相同的文件较多时部分层为空）"""
+    sizes = np.asarray(sizes, dtype=np.float64)
+    if len(sizes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    edges = np.quantile(sizes, np.linspace(0, 1, strata + 1)[1:-1])
+    return np.searchsorted(edges, sizes, side='right')
+
+
+def stratified_order(strata, seed=None, min_samples=MIN_STRATUM_SAMPLES):
+    """扫描顺序：各层先取 min_samples 个文件，其余按层内随机排列后按层内进度交错"""
+    rng = np.random.default_rng(seed)
+    key = np.empty(len(strata))
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        rank = rng.permutation(len(members))
+        key[members] = (rank + rng.random(len(members))) / len(members) - (rank < min_samples)
+    return np.argsort(key, kind='stable')
+
+
+class StratifiedSample:
+    """分层文件样本，估计全体文件上各量的总和及其95%置信区间"""
+
+    def __init__(self, sizes, strata=SIZE_STRATA):
+        self.sizes = np.asarray(sizes, dtype=np.float64)
+        self.strata = size_strata(self.sizes, strata)
+        self.count = np.bincount(self.strata, minlength=strata)
+        self.bytes = np.bincount(self.strata, weights=self.sizes, minlength=strata)
+        self.indices = []
+        # 各量只记录非零值：{量名: ([样本序号], [值])}
+        self.columns = {}
+
+    def order(self, seed=None):
+        return stratified_order(self.strata, seed)
+
+    def add(self, index, values):
+        """加入一个已扫描文件，values 为 {量名: 值}，未给出的量按0计"""
+        for key, value in values.items():
+            positions, column = self.columns.setdefault(key, ([], []))
+            positions.append(len(self.indices))
+            column.append(value)
+        self.indices.append(index)
+
+    def ready(self):
+        """每层都已有足够样本、可以估计方差"""
+        sampled = np.bincount(self.strata[self.indices], minlength=len(self.count))
+        return bool(np.all(sampled >= np.minimum(self.count, MIN_STRATUM_SAMPLES)))
+
+    def total(self, key, ratio=False):
+        """估计 key 在全体文件上的总和，返回 (估计值, 95%置信区间半宽)
+
+        ratio=True 时按层内 值/字节数 的比率外推（适用于与文件大小成正比的量，如点数）。
+        """
+        indices = np.asarray(self.indices, dtype=np.int64)
+        y = np.zeros(len(indices))
+        positions, column = self.columns.get(key, ([], []))
+        y[positions] = column
+        x = self.sizes[indices]
+        sampled_strata = self.strata[indices]
+
+        estimate = variance = 0.0
+        for stratum, population in enumerate(self.count):
+            mask = sampled_strata == stratum
+            n = int(mask.sum())
+            if population == 0 or n == 0:
+                continue
+            ys, xs = y[mask], x[mask]
+            if ratio:
+                rate = ys.sum() / xs.sum() if xs.sum() > 0 else 0.0
+                remaining = self.bytes[stratum] - xs.sum()
+                residuals = ys - rate * xs
+            else:
+                rate = ys.mean()
+                remaining = population - n
+                residuals = ys - rate
+            estimate += ys.sum() + rate * remaining
+            if n > 1:
+                variance += population ** 2 * (1 - n / population) * residuals.var(ddof=1) / n
+        return estimate, CONFIDENCE_Z * np.sqrt(variance)
@@ -0,0 +1,272 @@
+"""轨迹文件夹的边界框清单（sidecar manifest）
+
+清单保存在数据文件夹内的 .track_manifest.json 中，记录每个CSV文件的
+大小、修改时间、点数、经纬度范围、时间范围和船舶类型。按 mtime/size 校验是否过期，
+区域筛选时只需打开边界框与查询区域相交的文件。指定了列名或递归子文件夹的清单
+各自保存在 .track_manifest.<设置摘要>.json 中，不同应用交替使用同一文件夹时互不覆盖。
+
+较长的文件还按 CHUNK_ROWS 行分块记录每块的字节偏移和边界框，
+流式读取时可以直接跳过与查询区域不相交的块。
+"""
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from track_schema import read_header, read_csv_fast, parse_times
+
+MANIFEST_NAME = '.track_manifest.json'
+MANIFEST_VERSION = 3
+
+# 分块边界框的块大小（行数），不超过一块的文件不记录分块信息
+CHUNK_ROWS = 500
+
+# 两种数据格式的列名候选（原始AIS / H3特征）
+LAT_COLUMNS = ['lat', 'center_lat']
+LON_COLUMNS = ['lon', 'center_lon']
+TIME_COLUMNS = ['date', 'start_time']
+LABEL_COLUMNS = ['label']
+
+
+def list_csv_files(folder, recursive=False):
+    """列出文件夹中的CSV文件，返回相对路径列表"""
+    if not recursive:
+        return sorted(f for f in os.listdir(folder) if f.endswith('.csv'))
+
+    csv_files = []
+    for root, _, files in os.walk(folder):
+        for file in files:
+            if file.endswith('.csv'):
+                csv_files.append(os.path.relpath(os.path.join(root, file), folder))
+    return sorted(csv_files)
+
+
+def folder_fingerprint(folder, recursive=False):
+    """文件夹中CSV文件的指纹（路径、大小、修改时间的摘要），任一文件增删或改写时改变
+
+    只需 stat 各文件，不读取内容，可以作为筛选结果等缓存的键。
+    """
+    digest = hashlib.sha1()
+    for name in list_csv_files(folder, recursive):
+        try:
+            stat = os.stat(os.path.join(folder, name))
+        except OSError:
+            continue
+        digest.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def detect_column(columns, candidates, preferred=None):
+    """在列名中查找第一个匹配的候选列"""
+    if preferred:
+        return preferred if preferred in columns else None
+    for col in candidates:
+        if col in columns:
+            return col
+    return None
+
+
+def chunk_summaries(filepath, lats, lons, chunk_rows=CHUNK_ROWS):
+    """计算每块的 [字节偏移, 行数, lat_min, lat_max, lon_min, lon_max]
+
+    行号与字节偏移对不上（如含空行）时返回None，流式读取时退回顺序分块。
+    """
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    starts = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n')) + 1
+    starts = starts[starts < len(data)]
+    if len(starts) != len(lats):
+        return None
+
+    rows = np.arange(0, len(lats), chunk_rows)
+    with np.errstate(invalid='ignore'):
+        bounds = [np.fmin.reduceat(lats, rows), np.fmax.reduceat(lats, rows),
+                  np.fmin.reduceat(lons, rows), np.fmax.reduceat(lons, rows)]
+
+    chunks = []
+    for i, row in enumerate(rows):
+        nrows = int(min(chunk_rows, len(lats) - row))
+        bbox = [None if np.isnan(b[i]) else float(b[i]) for b in bounds]
+        chunks.append([int(starts[row]), nrows] + bbox)
+    return chunks
+
+
+def summarize_file(filepath, lat_col=None, lon_col=None, time_col=None):
+    """读取单个CSV文件并计算其摘要信息"""
+    stat = os.stat(filepath)
+    entry = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'rows': 0,
+        'lat_col': None,
+        'lon_col': None,
+        'time_col': None,
+        'lat_min': None,
+        'lat_max': None,
+        'lon_min': None,
+        'lon_max': None,
+        'time_min': None,
+        'time_max': None,
+        'label': None,
+        'chunks': None,
+        'error': None,
+    }
+
+    try:
+        header = read_header(filepath)
+    except Exception as e:
+        entry['error'] = str(e)
+        return entry
+
+    lat = detect_column(header, LAT_COLUMNS, lat_col)
+    lon = detect_column(header, LON_COLUMNS, lon_col)
+    tcol = detect_column(header, TIME_COLUMNS, time_col)
+    if lat is None or lon is None:
+        missing = [c for c, found in ((lat_col or 'lat', lat), (lon_col or 'lon', lon)) if found is None]
+        entry['error'] = f"缺少必要列: {', '.join(missing)}"
+        return entry
+
+    label = detect_column(header, LABEL_COLUMNS)
+    usecols = [lat, lon] + [col for col in (tcol, label) if col]
+    try:
+        df = read_csv_fast(filepath, usecols=usecols)
+    except Exception as e:
+        entry['error'] = str(e)
+        return entry
+
+    entry.update(lat_col=lat, lon_col=lon, time_col=tcol, rows=len(df))
+    if len(df) > 0:
+        lats = pd.to_numeric(df[lat], errors='coerce')
+        lons = pd.to_numeric(df[lon], errors='coerce')
+        valid = lats.notna() & lons.notna()
+        if valid.any():
+            entry.update(lat_min=float(lats[valid].min()), lat_max=float(lats[valid].max()),
+                         lon_min=float(lons[valid].min()), lon_max=float(lons[valid].max()))
+        if len(df) > CHUNK_ROWS:
+            lats = lats.where(valid).to_numpy(float)
+            lons = lons.where(valid).to_numpy(float)
+            entry['chunks'] = chunk_summaries(filepath, lats, lons)
+        if tcol:
+            times = parse_times(df[tcol])
+            if times.notna().any():
+                entry['time_min'] = times.min().isoformat()
+                entry['time_max'] = times.max().isoformat()
+        if label:
+            # 一个文件是一条轨迹，类型取出现最多的值
+            labels = df[label].dropna()
+            if len(labels):
+                entry['label'] = str(labels.mode().iloc[0])
+    return entry
+
+
+def read_sidecar(path, version):
+    """读取sidecar JSON文件，损坏或版本不符时返回None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get('version') != version:
+        return None
+    return data
+
+
+def write_sidecar(path, data):
+    """写入sidecar JSON文件，目录不可写时忽略
+
+    先写入同目录下唯一命名的临时文件再替换，多个线程或进程同时写同一文件夹的
+    sidecar 时互不覆盖对方的临时文件，最后完成替换的写入生效。
+    """
+    folder, name = os.path.split(path)
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=folder or '.', prefix=name + '.',
+                                         suffix='.tmp', delete=False) as f:
+            tmp_path = f.name
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def manifest_path(folder, columns, recursive=False):
+    """某一设置（列名、是否递归）对应的清单文件路径：默认设置为 MANIFEST_NAME，其他设置各用一个文件"""
+    if not recursive and not any(columns.values()):
+        return os.path.join(folder, MANIFEST_NAME)
+    key = json.dumps([columns, recursive], sort_keys=True, ensure_ascii=False)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+    name, ext = os.path.splitext(MANIFEST_NAME)
+    return os.path.join(folder, f'{name}.{digest}{ext}')
+
+
+def load_manifest(folder, recursive=False, lat_col=None, lon_col=None, time_col=None,
+                  progress_callback=None, entry_callback=None, order=None):
+    """加载文件夹清单，按 mtime/size 重新校验，只重新扫描新增或变化的文件
+
+    返回 {相对路径: 摘要} 字典。progress_callback(done, total) 在扫描文件时调用，
+    entry_callback(相对路径, 摘要) 在每个文件的摘要就绪（复用或重新扫描）时调用。
+    order 为文件夹中全部CSV文件的相对路径，按此顺序扫描（如分层抽样顺序），默认按名称。
+    """
+    columns = {'lat_col': lat_col, 'lon_col': lon_col, 'time_col': time_col}
+    path = manifest_path(folder, columns, recursive)
+
+    manifest = read_sidecar(path, MANIFEST_VERSION)
+    if manifest is None or manifest.get('columns') != columns or manifest.get('recursive') != recursive:
+        manifest = {'version': MANIFEST_VERSION, 'columns': columns,
+                    'recursive': recursive, 'files': {}}
+
+    old_files = manifest['files']
+    files = {}
+    changed = False
+    csv_files = list_csv_files(folder, recursive) if order is None else order
+
+    for i, name in enumerate(csv_files):
+        filepath = os.path.join(folder, name)
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            continue
+
+        entry = old_files.get(name)
+        if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+            entry = summarize_file(filepath, lat_col, lon_col, time_col)
+            changed = True
+        files[name] = entry
+
+        if entry_callback:
+            entry_callback(name, entry)
+        if progress_callback:
+            progress_callback(i + 1, len(csv_files))
+
+    if changed or len(files) != len(old_files):
+        manifest['files'] = files
+        write_sidecar(path, manifest)
+
+    return files
+
+
+def bbox_intersects(entry, min_lat, max_lat, min_lon, max_lon):
+    """判断文件边界框是否与查询区域相交"""
+    if entry.get('lat_min') is None:
+        return False
+    return not (entry['lat_max'] < min_lat or entry['lat_min'] > max_lat or
+                entry['lon_max'] < min_lon or entry['lon_min'] > max_lon)
+
+
+def bbox_within(entry, min_lat, max_lat, min_lon, max_lon):
+    """判断文件边界框是否完全位于查询区域内（此时无需读取文件即可确定命中）"""
+    if entry.get('lat_min') is None:
+        return False
+    return (entry['lat_min'] >= min_lat and entry['lat_max'] <= max_lat and
+            entry['lon_min'] >= min_lon and entry['lon_max'] <= max_lon)
+
+
+def candidate_files(files, min_lat, max_lat, min_lon, max_lon):
+    """返回边界框与查询区域相交的文件相对路径"""
+    return [name for name, entry in files.items()
+            if bbox_intersects(entry, min_lat, max_lat, min_lon, max_lon)]
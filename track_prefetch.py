@@ -0,0 +1,150 @@
+"""轨迹预取缓存
+
+逐条浏览筛选结果时，当前轨迹前后若干个文件在后台线程中预先读取，放入按
+内存大小淘汰的LRU缓存，翻页时直接从内存绘制。缓存项记录文件修改时间，
+文件被改写后自动失效；正在预取的文件被请求时等待该次读取，不重复读盘。
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from track_cache import read_track
+
+# 缓存的轨迹数据总内存上限
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# 预取当前轨迹之后与之前的文件数
+PREFETCH_NEXT = 3
+PREFETCH_PREV = 1
+
+
+def frame_bytes(df):
+    """DataFrame 占用的内存字节数"""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def neighbours(files, index, ahead=PREFETCH_NEXT, behind=PREFETCH_PREV):
+    """当前位置前后的文件，按被访问的可能性排列（先后一条、前一条，再依次向外）"""
+    order = []
+    for step in range(1, max(ahead, behind) + 1):
+        if step <= ahead and index + step < len(files):
+            order.append(files[index + step])
+        if step <= behind and index - step >= 0:
+            order.append(files[index - step])
+    return order
+
+
+class TrackLRU:
+    """按内存大小淘汰的轨迹缓存（线程安全），键为文件路径"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, path, mtime):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != mtime:
+                return None
+            self.entries.move_to_end(path)
+            return entry[1]
+
+    def put(self, path, mtime, df):
+        size = frame_bytes(df)
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.total_bytes -= old[2]
+            self.entries[path] = (mtime, df, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, _, old_size) = self.entries.popitem(last=False)
+                self.total_bytes -= old_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+class TrackPrefetcher:
+    """读取轨迹文件并在后台预取相邻文件；新的预取请求使旧请求中未开始的部分失效
+
+    多个预取器可共用同一个 cache 和 executor（如 Streamlit 每个会话一个预取器），
+    预取请求只使同一预取器的旧请求失效。
+    """
+
+    def __init__(self, cache=None, loader=read_track, max_workers=1, executor=None):
+        self.cache = cache if cache is not None else TrackLRU()
+        self.loader = loader
+        # 传入的 executor 由调用方管理，shutdown() 不关闭它
+        self.owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers, thread_name_prefix='prefetch')
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.pending = {}
+
+    def load(self, path):
+        """返回轨迹数据：命中缓存直接返回，正在预取时等待其完成，否则同步读取"""
+        mtime = os.stat(path).st_mtime_ns
+        df = self.cache.get(path, mtime)
+        if df is not None:
+            return df
+        with self.lock:
+            future = self.pending.get(path)
+        if future is not None and not future.cancel():
+            try:
+                df = future.result()
+            except Exception:
+                df = None
+            if df is not None:
+                return df
+        df = self.loader(path)
+        self.cache.put(path, mtime, df)
+        return df
+
+    def prefetch(self, paths, on_loaded=None):
+        """在后台依次读取 paths 中未缓存的文件
+
+        on_loaded(路径, DataFrame) 在工作线程中对每个预取的文件调用（如预热底图瓦片），
+        load() 可能在等待这次预取，因此 on_loaded 应只提交任务而不阻塞。
+        """
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            for future in self.pending.values():
+                future.cancel()
+            self.pending = {}
+
+        def task(path):
+            if generation != self.generation:
+                return None
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                df = self.cache.get(path, mtime)
+                if df is None:
+                    df = self.loader(path)
+                    self.cache.put(path, mtime, df)
+            except Exception:
+                return None
+            if on_loaded and generation == self.generation:
+                # 回调失败（如文件缺少所需的列）不影响已读取的数据
+                try:
+                    on_loaded(path, df)
+                except Exception:
+                    pass
+            return df
+
+        with self.lock:
+            for path in paths:
+                self.pending[path] = self.executor.submit(task, path)
+
+    def shutdown(self):
+        with self.lock:
+            self.generation += 1
+            for future in self.pending.values():
+                future.cancel()
+            self.pending = {}
+        if self.owns_executor:
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,194 @@
+"""基于进程池的轨迹文件并行扫描
+
+pandas 解析和布尔掩码计算受GIL限制，单线程只能用满一个核。
+ScanEngine 把文件分发到 ProcessPoolExecutor，每个工作进程只读取经纬度两列。
+工作进程用spawn启动但不导入启动脚本（GUI模块），只导入本模块；
+待扫描的文件不多时不启动进程池，直接在当前线程中扫描。
+
+文件有新鲜的列式缓存时直接内存映射读取；否则按行块流式读取，
+遇到第一个区域内的点即停止；若清单中有分块边界框，则直接跳过不相交的块，
+矩形区域下完全位于区域内的块无需读取。区域可以是任意多边形或多多边形。
+"""
+import os
+import sys
+import types
+import threading
+import multiprocessing
+import multiprocessing.context
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from track_cache import read_cached_columns
+from track_schema import read_header, iter_csv_fast, read_csv_rows
+from geo_filter import track_in_region, rectangle, region_bbox, is_rectangle
+
+
+def default_workers():
+    """默认工作进程数（CPU核数）"""
+    return os.cpu_count() or 1
+
+
+# 流式读取时每块的行数
+STREAM_CHUNK_ROWS = 500
+# 进程池未启动时，待扫描文件不少于此数才启动（启动约需1~2秒，单个文件扫描只需几毫秒）
+MIN_POOL_FILES = 400
+# 进程池已启动时，待扫描文件不少于此数（乘以进程数）才分发到进程池
+MIN_FILES_PER_WORKER = 2
+
+
+def _mask_any(df, lat_col, lon_col, region, segments=False):
+    """判断数据块（DataFrame或列字典）中的轨迹是否经过区域"""
+    return track_in_region(df[lat_col], df[lon_col], region, segments)
+
+
+def file_in_region(filepath, lat_col, lon_col, region, chunks=None, segments=False):
+    """判断文件中的轨迹是否经过区域（见 geo_filter），命中即停止读取
+
+    chunks 为清单中记录的 [字节偏移, 行数, lat_min, lat_max, lon_min, lon_max] 列表，
+    提供时按块边界框跳过与区域边界框不相交的块；否则按 STREAM_CHUNK_ROWS 行顺序分块读取。
+    segments=True 时同时检测相邻点之间穿越区域的航段，此时块与块之间的航段
+    不在块边界框内，因此不跳块，而是顺序读取并把上一块的末点接到下一块前面。
+    """
+    # 有新鲜的列式缓存时直接内存映射经纬度两列
+    columns = read_cached_columns(filepath, [lat_col, lon_col])
+    if columns is not None:
+        return _mask_any(columns, lat_col, lon_col, region, segments)
+
+    if not chunks or segments:
+        previous = None
+        for df in iter_csv_fast(filepath, usecols=[lat_col, lon_col], chunksize=STREAM_CHUNK_ROWS):
+            if segments and previous is not None:
+                df = pd.concat([previous, df])
+            if _mask_any(df, lat_col, lon_col, region, segments):
+                return True
+            previous = df.iloc[-1:]
+        return False
+
+    min_lat, max_lat, min_lon, max_lon = region_bbox(region)
+    rectangular = is_rectangle(region)
+    names = read_header(filepath)
+    with open(filepath, 'rb') as f:
+        for offset, nrows, c_min_lat, c_max_lat, c_min_lon, c_max_lon in chunks:
+            if c_min_lat is None:
+                continue
+            if (c_max_lat < min_lat or c_min_lat > max_lat or
+                    c_max_lon < min_lon or c_min_lon > max_lon):
+                continue
+            if rectangular and (c_min_lat >= min_lat and c_max_lat <= max_lat and
+                                c_min_lon >= min_lon and c_max_lon <= max_lon):
+                return True
+
+            f.seek(offset)
+            df = read_csv_rows(f, names, usecols=[lat_col, lon_col], nrows=nrows)
+            if _mask_any(df, lat_col, lon_col, region):
+                return True
+    return False
+
+
+def file_in_bbox(filepath, lat_col, lon_col, min_lat, max_lat, min_lon, max_lon, chunks=None):
+    """判断文件中是否有轨迹点位于矩形区域内"""
+    return file_in_region(filepath, lat_col, lon_col,
+                          rectangle(min_lat, max_lat, min_lon, max_lon), chunks)
+
+
+def scan_batch(tasks, region, segments=False):
+    """在工作进程中扫描一批文件，返回 [(key, in_area, error), ...]"""
+    results = []
+    for key, filepath, lat_col, lon_col, chunks in tasks:
+        try:
+            results.append((key, file_in_region(filepath, lat_col, lon_col, region, chunks, segments),
+                            None))
+        except Exception as e:
+            results.append((key, False, e))
+    return results
+
+
+# 启动工作进程时临时替换的空 __main__ 模块
+_BARE_MAIN = types.ModuleType('__main__')
+_main_lock = threading.Lock()
+
+
+class WorkerProcess(multiprocessing.context.SpawnProcess):
+    """不导入启动脚本的spawn进程
+
+    spawn 默认在子进程中重新执行启动脚本（以便反序列化其中定义的函数），
+    对GUI程序意味着每个工作进程都导入Qt和matplotlib。工作函数都在本模块中，
+    因此启动子进程时把 __main__ 临时换成空模块，子进程只按需导入本模块。
+
+    注意：替换的是整个进程的 sys.modules['__main__']，并依赖 spawn 在 start()
+    中读取 __main__ 的实现细节。替换期间（start() 执行的几毫秒内）其他线程若
+    导入 __main__ 或序列化其中定义的对象，拿到的是空模块而会出错；_main_lock
+    只能防止两个 WorkerProcess 同时替换。调用方应保证这段时间内没有这类操作：
+    本仓库的其他后台线程（统计、预取、瓦片下载）都不序列化对象、不导入 __main__。
+    """
+
+    def start(self):
+        with _main_lock:
+            main = sys.modules['__main__']
+            sys.modules['__main__'] = _BARE_MAIN
+            try:
+                super().start()
+            finally:
+                sys.modules['__main__'] = main
+
+
+class WorkerContext(multiprocessing.context.SpawnContext):
+    Process = WorkerProcess
+
+
+class ScanEngine:
+    """并行扫描引擎，进程池在多次筛选之间复用"""
+
+    def __init__(self, max_workers=None, chunksize=32):
+        self.max_workers = max_workers or default_workers()
+        self.chunksize = chunksize
+        self._executor = None
+
+    def set_max_workers(self, max_workers):
+        """修改工作进程数，下次扫描时按新配置重建进程池
+
+        进程数变化时立即关闭旧进程池并取消其中未开始的任务，因此不能在扫描进行中调用
+        （被取消的批次会以 CancelledError 作为错误产出）。
+        """
+        max_workers = max_workers or default_workers()
+        if max_workers != self.max_workers:
+            self.shutdown()
+            self.max_workers = max_workers
+
+    def _get_executor(self):
+        """延迟创建进程池（使用spawn，避免在Qt线程中fork）"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=WorkerContext())
+        return self._executor
+
+    def scan(self, tasks, region, segments=False):
+        """扫描文件，按完成顺序逐个产出 (key, in_area, error)
+
+        tasks 为 [(key, filepath, lat_col, lon_col, chunks), ...]，region 见 geo_filter，
+        segments=True 时同时检测穿越区域的航段
+        """
+        # 单进程或文件很少时直接在当前线程中处理，省去进程启动和通信开销
+        min_files = MIN_POOL_FILES if self._executor is None else self.max_workers * MIN_FILES_PER_WORKER
+        if self.max_workers <= 1 or len(tasks) < max(min_files, 2):
+            for task in tasks:
+                yield from scan_batch([task], region, segments)
+            return
+
+        # 按批提交，减少小文件的进程间通信开销，同时保证每个进程有多批任务可做
+        chunksize = max(1, min(self.chunksize, len(tasks) // (self.max_workers * 4)))
+        executor = self._get_executor()
+        futures = {
+            executor.submit(scan_batch, tasks[i:i + chunksize], region, segments): tasks[i:i + chunksize]
+            for i in range(0, len(tasks), chunksize)
+        }
+        for future in as_completed(futures):
+            try:
+                yield from future.result()
+            except Exception as e:
+                for task in futures[future]:
+                    yield task[0], False, e
+
+    def shutdown(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,215 @@
+"""已登记格式的轨迹CSV快速读取
+
+仓库中的轨迹文件只有两种固定格式：原始AIS（date,lat,lon,sog,cog,label）和
+H3特征（h3,center_lat,center_lon,start_time,...,label,mmsi,status）。按表头识别格式后：
+
+- 时间列按ISO格式（YYYY-MM-DD HH:MM:SS 等）向量化解析为datetime64[ns]，
+  不逐文件推断格式，不符合ISO格式的值再逐个推断；
+- 较大的文件按登记的类型解析：坐标为float64，其余测量值为float32，计数、MMSI和
+  H3船舶类型码为int64，原始AIS的船舶类型和H3的状态等文本列为Categorical；
+  安装了 pyarrow 时用 pyarrow 引擎多线程解析；数据与登记类型不符的列
+  （如含空值的整数列）保持 pandas 推断的类型；
+- 小文件（以及按 CHUNK_ROWS 行读取的行块）的耗时以每次调用的固定开销为主
+  （指定列类型、选列反而更慢），按普通方式读取，类型转换和时间解析由调用方
+  拼接成批后进行（如 track_cache.encode_column、track_manifest.summarize_file）。
+
+未登记的表头退回普通的 pd.read_csv。新格式用 register_schema 登记，
+Streamlit 应用按登记的 mapping 填写列名映射。
+"""
+import os
+import csv
+import pandas as pd
+from pandas.api.types import pandas_dtype
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# 不小于此字节数的文件用 pyarrow 引擎解析（小文件的线程开销大于收益）
+PYARROW_MIN_BYTES = 1024 * 1024
+# 小于此字节数的文件按普通方式整文件读取（此时 usecols/dtype 参数的开销大于收益）
+SMALL_FILE_BYTES = 256 * 1024
+
+TIME_DTYPE = 'datetime64[ns]'
+
+
+class TrackSchema:
+    """一种轨迹CSV格式：各列类型，以及与 Streamlit 列名映射对应的列"""
+
+    def __init__(self, name, title, dtypes, mapping):
+        self.name = name
+        self.title = title
+        self.dtypes = dtypes
+        self.mapping = mapping
+        # 预先解析的类型对象（按名称解析类型在每次 read_csv 调用中开销明显）
+        self.resolved = {column: pandas_dtype(dtype) for column, dtype in dtypes.items()}
+
+    def matches(self, header):
+        """表头是否包含该格式的全部列"""
+        return set(self.dtypes) <= set(header)
+
+    def column_dtypes(self, columns, times=True):
+        """columns 中已登记列的类型（pd.read_csv 的 dtype 参数）；times=False 时不含时间列"""
+        return {name: self.resolved[name] for name in columns
+                if name in self.resolved and (times or self.dtypes[name] != TIME_DTYPE)}
+
+    def time_columns(self, columns):
+        """columns 中已登记的时间列"""
+        return [name for name in columns if self.dtypes.get(name) == TIME_DTYPE]
+
+    def parse_time_columns(self, df):
+        """用 parse_times 解析 df 中已登记的时间列，已是datetime64[ns]的列不再处理"""
+        for name in self.time_columns(df.columns):
+            if df[name].dtype != TIME_DTYPE:
+                df[name] = parse_times(df[name])
+        return df
+
+    def apply_dtypes(self, df):
+        """逐列转换为登记的类型，无法转换的列（如含空值的整数列）保持原类型"""
+        for name, dtype in self.column_dtypes(df.columns, times=False).items():
+            try:
+                df[name] = df[name].astype(dtype)
+            except (ValueError, TypeError):
+                pass
+        return self.parse_time_columns(df)
+
+
+SCHEMAS = {}
+
+
+def register_schema(schema):
+    """登记一种格式，按登记顺序识别"""
+    SCHEMAS[schema.name] = schema
+    return schema
+
+
+RAW_AIS = register_schema(TrackSchema(
+    'raw_ais', '原始AIS（date,lat,lon,sog,cog,label）',
+    {'date': TIME_DTYPE, 'lat': 'float64', 'lon': 'float64',
+     'sog': 'float32', 'cog': 'float32', 'label': 'category'},
+    {'time': 'date', 'longitude': 'lon', 'latitude': 'lat', 'speed': 'sog', 'heading': 'cog'},
+))
+
+H3_FEATURES = register_schema(TrackSchema(
+    'h3_features', 'H3特征（h3,center_lat,center_lon,start_time,...,mmsi,status）',
+    {'h3': 'str', 'center_lat': 'float64', 'center_lon': 'float64',
+     'start_time': TIME_DTYPE, 'start_time_minutes': 'int64',
+     'avg_speed': 'float32', 'speed_std': 'float32', 'max_speed': 'float32', 'min_speed': 'float32',
+     'avg_speed_x': 'float32', 'avg_speed_y': 'float32', 'vector_avg_speed': 'float32',
+     'avg_accel': 'float32', 'max_accel': 'float32', 'accel_std': 'float32',
+     'avg_angular_vel': 'float32', 'max_angular_vel': 'float32', 'angular_std': 'float32',
+     'label': 'int64', 'mmsi': 'int64', 'status': 'category'},
+    {'time': 'start_time', 'longitude': 'center_lon', 'latitude': 'center_lat',
+     'speed': 'avg_speed', 'heading': ''},
+))
+
+
+def read_header(filepath):
+    """读取CSV表头（只读第一行），空文件返回空列表"""
+    with open(filepath, newline='', encoding='utf-8-sig') as f:
+        return next(csv.reader(f), [])
+
+
+def detect_schema(header):
+    """按表头识别已登记的格式，未识别时返回None"""
+    for schema in SCHEMAS.values():
+        if schema.matches(header):
+            return schema
+    return None
+
+
+def _to_datetime(series, format):
+    """按 format 解析时间，带时区的时间换算为UTC后去掉时区"""
+    times = pd.to_datetime(series, errors='coerce', format=format, utc=True)
+    return times.dt.tz_localize(None).astype(TIME_DTYPE)
+
+
+def parse_times(series):
+    """时间列解析为datetime64[ns]：按ISO格式向量化解析，不符合ISO格式的值再逐个推断格式
+
+    带时区的时间换算为UTC后去掉时区。
+    """
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        series = series.dt.tz_convert(None)
+    if pd.api.types.is_datetime64_dtype(series):
+        return series.astype(TIME_DTYPE)
+    if not pd.api.types.is_string_dtype(series):
+        # 数值列（如纪元时间戳）按 pd.to_datetime 的默认规则解析
+        return pd.to_datetime(series, errors='coerce')
+    try:
+        times = pd.to_datetime(series, errors='coerce', format='ISO8601')
+    except ValueError:
+        # 各值的时区偏移不一致
+        times = pd.to_datetime(series, errors='coerce', format='ISO8601', utc=True)
+    if isinstance(times.dtype, pd.DatetimeTZDtype):
+        times = times.dt.tz_convert(None)
+    times = times.astype(TIME_DTYPE)
+    invalid = times.isna() & series.notna()
+    if invalid.any():
+        times[invalid] = _to_datetime(series[invalid], 'mixed')
+    return times
+
+
+def _select_columns(header, usecols):
+    """usecols 中的列按表头顺序排列，表头中没有的列引发 ValueError（与 pd.read_csv 一致）"""
+    if usecols is None:
+        return list(header)
+    missing = [name for name in usecols if name not in header]
+    if missing:
+        raise ValueError(f"Usecols do not match columns, columns expected but not found: {missing}")
+    return [name for name in header if name in usecols]
+
+
+def read_csv_fast(filepath, usecols=None, schema=None):
+    """读取轨迹CSV，表头属于已登记格式时按登记类型快速解析，否则同 pd.read_csv
+
+    usecols 与 pd.read_csv 一致，列按文件中的顺序返回。
+    """
+    header = read_header(filepath)
+    schema = schema or detect_schema(header)
+    if schema is None:
+        return pd.read_csv(filepath, usecols=usecols)
+    columns = _select_columns(header, usecols)
+
+    size = os.path.getsize(filepath)
+    if size < SMALL_FILE_BYTES:
+        # 小文件整文件读取、保持推断的类型，时间解析和类型转换留给调用方按批进行
+        df = pd.read_csv(filepath)
+        return df[columns] if usecols is not None else df
+
+    if pyarrow is not None and size >= PYARROW_MIN_BYTES:
+        try:
+            df = pd.read_csv(filepath, usecols=columns, dtype=schema.column_dtypes(columns), engine='pyarrow')
+            return df[columns]
+        except Exception:
+            # 数据与登记类型不符时按C引擎读取，逐列转换
+            pass
+
+    # 时间列在读取时按ISO格式解析，不符合ISO格式的列保持文本，由 parse_time_columns 再解析
+    try:
+        df = pd.read_csv(filepath, usecols=columns, dtype=schema.column_dtypes(columns, times=False),
+                         parse_dates=schema.time_columns(columns), date_format='ISO8601')
+    except (ValueError, TypeError):
+        return schema.apply_dtypes(pd.read_csv(filepath, usecols=columns))
+    return schema.parse_time_columns(df)
+
+
+def iter_csv_fast(filepath, usecols=None, chunksize=None, schema=None):
+    """按 chunksize 行分块读取轨迹CSV，较大的文件各块使用登记的类型，小文件同 pd.read_csv"""
+    header = read_header(filepath)
+    schema = schema or detect_schema(header)
+    typed = schema is not None and os.path.getsize(filepath) >= SMALL_FILE_BYTES
+    columns = _select_columns(header, usecols) if typed else usecols
+    # 分块读取时某一块与登记类型不符无法重读，因此各块读取后逐列转换
+    with pd.read_csv(filepath, usecols=columns, chunksize=chunksize) as reader:
+        for df in reader:
+            yield schema.apply_dtypes(df) if typed else df
+
+
+def read_csv_rows(f, header, usecols=None, nrows=None):
+    """从已定位到某行开头的文件对象读取 nrows 行（不含表头）
+
+    行块很小（清单按 CHUNK_ROWS 行分块），与小文件一样按普通方式读取。
+    """
+    return pd.read_csv(f, header=None, names=header, usecols=usecols, nrows=nrows)
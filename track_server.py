@@ -0,0 +1,205 @@
+"""本地轨迹瓦片服务（仅监听回环地址）
+
+瓦片只供同一台机器上、与本服务同源的地图页面使用（见 map_bridge.MapBridge.load 的
+base_url），不允许跨域请求：其他网页无法读取轨迹数据。
+
+把 TrackStore 发布为按 z/x/y 划分的轨迹瓦片，地图页面只请求当前视图内的瓦片，
+页面内存和首次加载时间与视图大小相当，而不是与数据集大小相当。
+
+每个瓦片包含与瓦片范围相交的航段：点先按该缩放级别每像素的容差
+（见 track_simplify）做网格去重，再按航段是否与瓦片相交截取，连续的航段以
+Google 编码折线格式输出，起终点只出现在包含它的那一个瓦片中。
+各缩放级别的简化点只计算一次并缓存。LazyTrackLayer 按瓦片只读取相交的轨迹。
+"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import numpy as np
+from tile_cache import tile_lat
+from track_simplify import zoom_tolerance
+from track_store import TrackStore
+
+# 提供瓦片的最大缩放级别（约1米精度），更大的缩放级别由前端使用该级瓦片
+MAX_TILE_ZOOM = 16
+# 点数不超过此值的轨迹集合直接发送到页面，不经过瓦片服务
+INLINE_POINTS = 20000
+
+TILE_PATTERN = re.compile(r'/tiles/(?P<name>\w+)/(?P<version>\d+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.json')
+
+
+def encode_polyline(lats, lons, precision=5):
+    """Google 编码折线（向量化），前端由 decodePolyline 还原"""
+    points = np.round(np.column_stack((lats, lons)).astype(np.float64) * 10 ** precision).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = ((deltas << 1) ^ (deltas >> 63)).astype(np.uint64)
+
+    # 每个值从低位起每5位一组，除最后一组外加 0x20 续位标志
+    shifts = np.arange(7, dtype=np.uint64) * np.uint64(5)
+    groups = (values[:, None] >> shifts) & np.uint64(31)
+    counts = 1 + ((values[:, None] >> shifts[1:]) > 0).sum(axis=1)
+    position = np.arange(7)
+    chars = groups + np.uint64(63) + np.where(position < counts[:, None] - 1, 32, 0).astype(np.uint64)
+    return chars[position < counts[:, None]].astype(np.uint8).tobytes().decode('ascii')
+
+
+def tile_bounds(z, x, y):
+    """瓦片的 (south, north, west, east) 经纬度范围"""
+    n = 1 << z
+    return float(tile_lat(y + 1, z)), float(tile_lat(y, z)), x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+
+
+class TrackLayer:
+    """一个已发布的轨迹集合"""
+
+    def __init__(self, store, colors, tooltips):
+        self.store = store
+        self.colors = list(colors)
+        self.tooltips = list(tooltips)
+        self.bboxes = store.bboxes()
+        self.levels = {}
+        self.lock = threading.Lock()
+
+    def level(self, z):
+        """缩放级别 z 下保留的点，返回 (lats, lons, starts, ends)，按轨迹连续排列"""
+        with self.lock:
+            if z not in self.levels:
+                # 按瓦片每像素对应的网格去重（与点数成线性，不必等待全部轨迹的DP简化）
+                index, counts = self.store.grid_index(zoom_tolerance(z, detail_zooms=0))
+                ends = np.cumsum(counts)
+                self.levels[z] = (self.store.columns['lat'][index], self.store.columns['lon'][index],
+                                  ends - counts, ends)
+            return self.levels[z]
+
+    def points(self, z, candidates):
+        """候选轨迹在缩放级别 z 下保留的点，返回 (每条轨迹的点数, lats, lons)，按候选顺序连续排列"""
+        level_lats, level_lons, starts, ends = self.level(z)
+        lengths = ends[candidates] - starts[candidates]
+        offsets = np.repeat(starts[candidates] - (np.cumsum(lengths) - lengths), lengths)
+        index = np.arange(lengths.sum()) + offsets
+        return lengths, level_lats[index], level_lons[index]
+
+    def tile(self, z, x, y):
+        """瓦片内容：与瓦片相交的每条轨迹的颜色、提示、编码折线和起终点"""
+        south, north, west, east = tile_bounds(z, x, y)
+        lat_min, lat_max, lon_min, lon_max = self.bboxes
+        candidates = np.flatnonzero((lat_min <= north) & (lat_max >= south) &
+                                    (lon_min <= east) & (lon_max >= west))
+        if not len(candidates):
+            return {'tracks': []}
+
+        lengths, lats, lons = self.points(z, candidates)
+        ids = np.repeat(candidates, lengths)
+
+        # 与瓦片相交的航段（不跨轨迹连接），单点轨迹按点判断
+        same = ids[1:] == ids[:-1]
+        crossing = same & (np.fmin(lats[1:], lats[:-1]) <= north) & (np.fmax(lats[1:], lats[:-1]) >= south) & \
+            (np.fmin(lons[1:], lons[:-1]) <= east) & (np.fmax(lons[1:], lons[:-1]) >= west)
+        keep = (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+        keep[:-1] |= crossing
+        keep[1:] |= crossing
+
+        # 连续保留且由相交航段连接的点组成一段折线
+        kept = np.flatnonzero(keep)
+        joined = crossing[kept[:-1]] & (kept[1:] == kept[:-1] + 1)
+        breaks = np.flatnonzero(~joined) + 1
+        tracks = {}
+
+        def entry(track_id):
+            if track_id not in tracks:
+                tracks[track_id] = {'id': self.store.names[track_id], 'color': self.colors[track_id],
+                                    'tooltip': self.tooltips[track_id], 'lines': []}
+            return tracks[track_id]
+
+        for run in np.split(kept, breaks) if len(kept) else []:
+            entry(int(ids[run[0]]))['lines'].append(encode_polyline(lats[run], lons[run]))
+
+        # 起终点只放在包含它的瓦片中（左闭右开）
+        first = np.cumsum(lengths) - lengths
+        for position, track_id in enumerate(candidates):
+            if lengths[position] == 0:
+                continue
+            for key, point in (('start', first[position]), ('end', first[position] + lengths[position] - 1)):
+                lat, lon = lats[point], lons[point]
+                if south < lat <= north and west <= lon < east:
+                    entry(int(track_id))[key] = [round(float(lat), 5), round(float(lon), 5)]
+        return {'tracks': list(tracks.values())}
+
+
+class LazyTrackLayer(TrackLayer):
+    """按需读取坐标的轨迹图层（见 track_catalog）：只读取与请求的瓦片相交的轨迹
+
+    坐标由目录的内存LRU缓存保存，按缩放级别的网格去重在每个瓦片请求时计算。
+    """
+
+    def points(self, z, candidates):
+        tracks = [self.store.coords(index) for index in candidates]
+        lengths = np.array([len(lats) for lats, _ in tracks], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        store = TrackStore({'lat': np.concatenate([lats for lats, _ in tracks]),
+                            'lon': np.concatenate([lons for _, lons in tracks])}, ends - lengths, ends)
+        index, counts = store.grid_index(zoom_tolerance(z, detail_zooms=0))
+        return counts, store.columns['lat'][index], store.columns['lon'][index]
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        match = TILE_PATTERN.fullmatch(urlsplit(self.path).path)
+        published = self.server.layers.get(match['name']) if match else None
+        if published is None or published[0] != int(match['version']):
+            self.send_error(404)
+            return
+        z, x, y = int(match['z']), int(match['x']), int(match['y'])
+        if z > MAX_TILE_ZOOM or not (0 <= x < 1 << z and 0 <= y < 1 << z):
+            self.send_error(404)
+            return
+
+        body = json.dumps(published[1].tile(z, x, y), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'max-age=3600')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TrackServer:
+    """在后台线程中运行的回环瓦片服务，按名称发布轨迹图层"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), _TileHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.layers = {}
+        self.version = 0
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def publish(self, name, store, colors, tooltips):
+        """发布（或替换）名为 name 的图层，返回瓦片URL模板；旧版本的瓦片请求返回404"""
+        return self.publish_layer(name, TrackLayer(store, colors, tooltips))
+
+    def publish_layer(self, name, layer):
+        """发布已构建的图层（如 LazyTrackLayer），返回瓦片URL模板"""
+        self.version += 1
+        self.httpd.layers[name] = (self.version, layer)
+        return f"{self.url}/tiles/{name}/{self.version}/{{z}}/{{x}}/{{y}}.json"
+
+    def remove(self, name):
+        """撤销发布的图层，释放其数据和缓存的各级简化点"""
+        self.httpd.layers.pop(name, None)
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
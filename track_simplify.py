@@ -0,0 +1,140 @@
+"""轨迹简化金字塔（Douglas–Peucker）
+
+每条轨迹只运行一次 Douglas–Peucker，记录每个点的"重要度"：该点被选为
+分割点时到弦的距离，并以其祖先分割点的重要度为上限。重要度大于 tol 的点
+恰好就是容差为 tol 的 Douglas–Peucker 结果，因此各级简化结果互相嵌套，
+可以按任意容差直接筛选，不必为每一级重新简化。
+
+SimplifiedTrack 按 PYRAMID_TOLERANCES 预先取出各级的点下标；绘制时由当前
+视图每像素对应的经纬度换算容差并选择级别，放大到最细一级以下时使用原始点。
+距离按经纬度（度）计算，与地图坐标轴一致。
+"""
+import numpy as np
+
+# 金字塔各级容差（度），由细到粗
+PYRAMID_TOLERANCES = tuple(1e-5 * 4 ** k for k in range(8))
+# 允许的简化误差（像素）
+PIXEL_TOLERANCE = 0.5
+# folium地图在浏览器中还可以放大，按初始缩放级别再放大几级的精度输出
+DETAIL_ZOOMS = 2
+
+
+def segment_distances(y, x, y1, x1, y2, x2):
+    """点 (y, x) 到线段 (y1, x1)-(y2, x2) 的距离（向量化）"""
+    dy, dx = y2 - y1, x2 - x1
+    length2 = dx * dx + dy * dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(length2 > 0, ((x - x1) * dx + (y - y1) * dy) / length2, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(y - (y1 + t * dy), x - (x1 + t * dx))
+
+
+def point_importance(lats, lons, breaks=None):
+    """每个点的Douglas–Peucker重要度（首尾点为inf，NaN坐标的点总是保留）
+
+    按递归层同步处理：每一轮对所有未分割的线段同时求最远点并分割，
+    轮数等于递归深度。breaks 为固定保留的分割点（如拼接数组中各轨迹的
+    首尾点），可以一次处理多条轨迹。
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    n = len(lats)
+    importance = np.zeros(n, dtype=np.float64)
+    if n == 0:
+        return importance
+    importance[0] = importance[-1] = np.inf
+
+    splits = np.array([0, n - 1]) if n > 1 else np.array([0])
+    if breaks is not None and len(breaks):
+        splits = np.union1d(splits, np.asarray(breaks, dtype=np.int64))
+        importance[splits] = np.inf
+
+    # 未分割的点及其所在线段的起止点、上限（祖先分割点的重要度）
+    idx = np.setdiff1d(np.arange(n), splits)
+    seg = np.searchsorted(splits, idx, side='right') - 1
+    start, end = splits[seg], splits[seg + 1]
+    cap = np.full(len(idx), np.inf)
+
+    while len(idx):
+        distances = np.nan_to_num(
+            segment_distances(lats[idx], lons[idx], lats[start], lons[start], lats[end], lons[end]),
+            nan=np.inf
+        )
+
+        # 每条线段上距离最大的第一个点
+        group_starts = np.flatnonzero(np.concatenate(([True], start[1:] != start[:-1])))
+        group_sizes = np.diff(np.append(group_starts, len(idx)))
+        group_max = np.maximum.reduceat(distances, group_starts)
+        group_ids = np.repeat(np.arange(len(group_starts)), group_sizes)
+        is_max = np.flatnonzero(distances == group_max[group_ids])
+        chosen = is_max[np.concatenate(([True], group_ids[is_max][1:] != group_ids[is_max][:-1]))]
+
+        values = np.minimum(group_max, cap[group_starts])
+        importance[idx[chosen]] = values
+
+        # 所有点都在弦上的线段不必再分割，其中各点的重要度均为0
+        remaining = np.repeat(group_max > 0, group_sizes)
+        remaining[chosen] = False
+
+        # 分割点两侧的点分别归入新的左右线段
+        split_of = idx[chosen][group_ids]
+        left = idx < split_of
+        end = np.where(left, split_of, end)
+        start = np.where(left, start, split_of)
+        cap = values[group_ids]
+
+        idx, start, end, cap = idx[remaining], start[remaining], end[remaining], cap[remaining]
+    return importance
+
+
+def simplify(lats, lons, tolerance):
+    """容差为 tolerance 的Douglas–Peucker简化，返回保留点的下标"""
+    return np.flatnonzero(point_importance(lats, lons) > tolerance)
+
+
+def view_tolerance(xlim, ylim, width_px, height_px):
+    """视图中 PIXEL_TOLERANCE 个像素对应的经纬度"""
+    per_px = max(abs(xlim[1] - xlim[0]) / max(width_px, 1),
+                 abs(ylim[1] - ylim[0]) / max(height_px, 1))
+    return per_px * PIXEL_TOLERANCE
+
+
+def fit_zoom(xlim, ylim, width_px, height_px):
+    """能完整显示经纬度范围的Web地图缩放级别"""
+    lon_span = max(abs(xlim[1] - xlim[0]), 1e-9)
+    lat_span = max(abs(ylim[1] - ylim[0]), 1e-9)
+    zoom = min(np.log2(width_px * 360.0 / (256 * lon_span)),
+               np.log2(height_px * 180.0 / (256 * lat_span)))
+    return int(np.clip(np.floor(zoom), 0, 19))
+
+
+def zoom_tolerance(zoom, detail_zooms=DETAIL_ZOOMS):
+    """Web地图缩放级别对应的容差（保留再放大 detail_zooms 级所需的精度）"""
+    return 360.0 / (256 * 2 ** (zoom + detail_zooms)) * PIXEL_TOLERANCE
+
+
+class SimplifiedTrack:
+    """带简化金字塔的轨迹"""
+
+    def __init__(self, lats, lons, importance=None):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.importance = importance if importance is not None else point_importance(self.lats, self.lons)
+        self.levels = [(tol, np.flatnonzero(self.importance > tol)) for tol in PYRAMID_TOLERANCES]
+
+    def __len__(self):
+        return len(self.lats)
+
+    def indices(self, tolerance):
+        """误差不超过 tolerance 的最粗一级的点下标"""
+        chosen = None
+        for tol, indices in self.levels:
+            if tol > tolerance:
+                break
+            chosen = indices
+        return chosen if chosen is not None else np.arange(len(self.lats))
+
+    def coords(self, tolerance):
+        """返回简化后的 (lats, lons)"""
+        indices = self.indices(tolerance)
+        return self.lats[indices], self.lons[indices]
@@ -0,0 +1,333 @@
+"""不规则数组（ragged array）轨迹存储
+
+所有轨迹按字段各保存为一个连续数组，再用 starts/ends 偏移数组划分每条轨迹，
+与 data/track_indices.csv 的 start,end 格式一致。单条轨迹以零拷贝视图访问，
+跨全部轨迹的运算（边界框、主类型、区域判断等）都是向量化的。
+文本列按全局字典编码为小整数码，时间列为int64纳秒时间戳，坐标可按单精度保存。
+"""
+import os
+import sys
+import numpy as np
+import pandas as pd
+from track_cache import COORD_COLUMNS, encode_column, read_track
+from track_manifest import list_csv_files
+from geo_filter import points_in_region, segments_in_region, rectangle
+from track_simplify import SimplifiedTrack, point_importance
+
+# 由文件列表构建时每批拼接编码的行数（限制构建过程中的峰值内存）
+BUILD_BATCH_ROWS = 1_000_000
+
+
+class TrackView:
+    """单条轨迹的零拷贝视图"""
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def name(self):
+        return self.store.names[self.index]
+
+    def __len__(self):
+        return int(self.store.ends[self.index] - self.store.starts[self.index])
+
+    def __getitem__(self, column):
+        """返回该轨迹某列的数组视图（字典编码列为整数码）"""
+        start, end = self.store.starts[self.index], self.store.ends[self.index]
+        return self.store.columns[column][start:end]
+
+    def simplified(self):
+        """该轨迹的简化金字塔（重要度由所属存储一次性计算）"""
+        start, end = self.store.starts[self.index], self.store.ends[self.index]
+        return SimplifiedTrack(self['lat'], self['lon'], self.store.importance()[start:end])
+
+    def to_frame(self):
+        """转换为DataFrame（字典编码列还原为Categorical）"""
+        return pd.DataFrame({name: self.store.decode(name, self[name])
+                             for name in self.store.columns})
+
+
+class TrackStore:
+    """按字段连续存储的多轨迹容器"""
+
+    def __init__(self, columns, starts, ends, names=None, kinds=None, categories=None):
+        self.columns = columns
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.names = list(names) if names is not None else [str(i) for i in range(len(self.starts))]
+        self.kinds = kinds or {name: 'num' for name in columns}
+        self.categories = categories or {}
+        self._importance = None
+
+        rows = len(next(iter(columns.values()))) if columns else 0
+        if len(self.starts) != len(self.ends) or len(self.names) != len(self.starts):
+            raise ValueError("starts、ends 与 names 长度不一致")
+        if len(self.starts) and (self.ends.max() > rows or (self.starts > self.ends).any()):
+            raise ValueError("轨迹偏移超出数据范围")
+
+    @classmethod
+    def from_frame(cls, df, starts, ends, names=None, coord_dtype=np.float64):
+        """由拼接后的DataFrame和偏移数组构建"""
+        columns, kinds, categories = {}, {}, {}
+        for name in df.columns:
+            kind, array, cats = encode_column(name, df[name])
+            if name in COORD_COLUMNS:
+                array = array.astype(coord_dtype, copy=False)
+            columns[name] = np.ascontiguousarray(array)
+            kinds[name] = kind
+            if cats is not None:
+                categories[name] = cats
+        return cls(columns, starts, ends, names, kinds, categories)
+
+    @classmethod
+    def from_concatenated(cls, data_path, indices_path, coord_dtype=np.float64):
+        """由拼接的轨迹数据文件和 track_indices.csv 格式的偏移文件构建"""
+        indices = pd.read_csv(indices_path)
+        return cls.from_frame(read_track(data_path), indices['start'].to_numpy(),
+                              indices['end'].to_numpy(), coord_dtype=coord_dtype)
+
+    @classmethod
+    def from_files(cls, filepaths, required_columns=None, coord_dtype=np.float64):
+        """由每条轨迹一个CSV的文件列表构建，缺少必要列或读取失败的文件被跳过
+
+        文件按约 BUILD_BATCH_ROWS 行分批拼接并按列编码，文本列（如 label）的码映射到
+        全局字典，不保留逐文件的DataFrame和重复的字符串。只保留所有文件共有的列。
+        coord_dtype=np.float32 时经纬度按单精度保存（误差约1米）。
+        """
+        parts, dictionaries = None, {}
+        names, lengths, batch = [], [], []
+
+        def flush():
+            nonlocal parts
+            df = pd.concat(batch, ignore_index=True, join='inner')
+            batch.clear()
+            parts = {name: parts.get(name, []) for name in df.columns if name in parts} \
+                if parts is not None else {name: [] for name in df.columns}
+            for name in parts:
+                kind, array, cats = encode_column(name, df[name])
+                if cats is not None:
+                    lookup = dictionaries.setdefault(name, {})
+                    mapping = np.array([lookup.setdefault(c, len(lookup)) for c in cats] + [-1], dtype=np.int32)
+                    array = mapping[array]
+                elif name in COORD_COLUMNS:
+                    array = array.astype(coord_dtype, copy=False)
+                parts[name].append((kind, array))
+
+        batch_rows = 0
+        for filepath in filepaths:
+            try:
+                df = read_track(filepath)
+            except Exception as e:
+                print(f"Error loading {os.path.basename(filepath)}: {e}")
+                continue
+            if required_columns and not set(required_columns).issubset(df.columns):
+                continue
+            batch.append(df)
+            names.append(os.path.splitext(os.path.basename(filepath))[0])
+            lengths.append(len(df))
+            batch_rows += len(df)
+            if batch_rows >= BUILD_BATCH_ROWS:
+                flush()
+                batch_rows = 0
+        if batch:
+            flush()
+
+        if not names:
+            return cls({}, [], [], [])
+
+        columns, column_kinds, categories = {}, {}, {}
+        for name, encoded in parts.items():
+            kinds = {kind for kind, _ in encoded}
+            if len(kinds) > 1:
+                # 各文件中类型不一致的列（如某文件的文本列全为空）还原后整列重新编码
+                lookup = list(dictionaries.get(name, {}))
+                series = pd.concat([pd.Series(pd.Categorical.from_codes(array, categories=lookup) if kind == 'dict'
+                                              else array.view('datetime64[ns]') if kind == 'time' else array)
+                                    for kind, array in encoded], ignore_index=True)
+                kind, array, cats = encode_column(name, series)
+                if kind == 'num' and name in COORD_COLUMNS:
+                    array = array.astype(coord_dtype, copy=False)
+            else:
+                kind, array, cats = kinds.pop(), np.concatenate([array for _, array in encoded]), None
+                if kind == 'dict':
+                    cats = list(dictionaries[name])
+                    if len(cats) <= 32767:
+                        array = array.astype(np.int16)
+            columns[name] = np.ascontiguousarray(array)
+            column_kinds[name] = kind
+            if cats is not None:
+                categories[name] = cats
+
+        lengths = np.array(lengths, dtype=np.int64)
+        ends = np.cumsum(lengths)
+        return cls(columns, ends - lengths, ends, names, column_kinds, categories)
+
+    @classmethod
+    def from_folder(cls, folder, required_columns=None):
+        """由文件夹中的全部CSV文件构建"""
+        return cls.from_files([os.path.join(folder, f) for f in list_csv_files(folder)],
+                              required_columns)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return TrackView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield TrackView(self, index)
+
+    @property
+    def lengths(self):
+        """每条轨迹的点数"""
+        return self.ends - self.starts
+
+    @property
+    def total_points(self):
+        return int(self.lengths.sum())
+
+    @property
+    def nbytes(self):
+        """列数组、偏移数组、轨迹名和字典占用的字节数（子集与原存储共享的列数组也计入）"""
+        strings = self.names + [c for cats in self.categories.values() for c in cats]
+        return (sum(array.nbytes for array in self.columns.values()) + self.starts.nbytes +
+                self.ends.nbytes + sum(sys.getsizeof(s) for s in strings))
+
+    @property
+    def bytes_per_track(self):
+        return self.nbytes / len(self) if len(self) else 0.0
+
+    def decode(self, column, values):
+        """把字典编码列的整数码还原为Categorical，其余列原样返回"""
+        if self.kinds.get(column) == 'dict':
+            return pd.Categorical.from_codes(values, categories=self.categories[column])
+        if self.kinds.get(column) == 'time':
+            return values.view('datetime64[ns]')
+        return values
+
+    def track_ids(self):
+        """每个点所属的轨迹编号（只覆盖被轨迹引用的点，按轨迹顺序排列）"""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def point_index(self):
+        """被轨迹引用的点在列数组中的下标，与 track_ids() 一一对应"""
+        if self.is_contiguous():
+            return np.arange(self.starts[0], self.ends[-1]) if len(self) else np.empty(0, np.int64)
+        offsets = np.repeat(self.starts - np.concatenate(([0], np.cumsum(self.lengths)[:-1])),
+                            self.lengths)
+        return np.arange(self.total_points) + offsets
+
+    def is_contiguous(self):
+        """轨迹是否首尾相接地覆盖一段连续数据"""
+        return len(self) == 0 or bool((self.starts[1:] == self.ends[:-1]).all())
+
+    def reduce(self, column, ufunc):
+        """对每条轨迹的某列做 ufunc 归约（如 np.fmin），空轨迹返回NaN"""
+        values = self.columns[column]
+        if len(self) == 0:
+            return np.empty(0, dtype=np.float64)
+        if self.ends.max() >= len(values):
+            values = np.append(values, values[:1])
+
+        indices = np.empty(2 * len(self), dtype=np.int64)
+        indices[0::2] = self.starts
+        indices[1::2] = self.ends
+        result = ufunc.reduceat(values, indices)[0::2].astype(np.float64)
+        result[self.lengths == 0] = np.nan
+        return result
+
+    def bboxes(self):
+        """每条轨迹的边界框，返回 (lat_min, lat_max, lon_min, lon_max) 四个数组"""
+        return (self.reduce('lat', np.fmin), self.reduce('lat', np.fmax),
+                self.reduce('lon', np.fmin), self.reduce('lon', np.fmax))
+
+    def mode(self, column):
+        """每条轨迹中该列的众数，返回类别值（字符串）列表，空轨迹或全为空值时为None
+
+        字典编码列直接按码计数；数值列（如各文件中全为空、按数值保存的 label 列）
+        先按值编码（空值不计），值与字典一样转换为字符串。
+        """
+        if column in self.categories:
+            codes = self.columns[column][self.point_index()].astype(np.int64)
+            categories = self.categories[column]
+        else:
+            codes, uniques = pd.factorize(self.columns[column][self.point_index()])
+            categories = [str(value) for value in uniques.tolist()]
+        ids = self.track_ids()
+        valid = codes >= 0
+        n_categories = max(len(categories), 1)
+        counts = np.bincount(ids[valid] * n_categories + codes[valid],
+                             minlength=len(self) * n_categories).reshape(len(self), n_categories)
+        best = counts.argmax(axis=1)
+        return [categories[c] if counts[i, c] > 0 else None
+                for i, c in enumerate(best)]
+
+    def polylines(self, tolerance=None):
+        """每条轨迹的 (lon, lat) 坐标数组列表，可供 LineCollection 使用
+
+        tolerance 不为None时按边长为 tolerance 的网格去重：与前一个点落在同一
+        网格内的点被略去（首尾点保留），误差不超过网格对角线，耗时与点数成线性。
+        """
+        index, counts = self.grid_index(tolerance) if tolerance else (self.point_index(), self.lengths)
+        coords = np.column_stack((self.columns['lon'][index], self.columns['lat'][index]))
+        return np.split(coords, np.cumsum(counts)[:-1]) if len(self) else []
+
+    def grid_index(self, tolerance):
+        """按边长为 tolerance 的网格去重后保留的点，返回 (列数组下标, 每条轨迹的点数)"""
+        index = self.point_index()
+        if not len(index):
+            return index, self.lengths
+        ids = self.track_ids()
+        cells = np.floor(np.column_stack((self.columns['lon'][index], self.columns['lat'][index])) / tolerance)
+        new_track = ids[1:] != ids[:-1]
+        keep = np.ones(len(index), dtype=bool)
+        keep[1:] = (cells[1:] != cells[:-1]).any(axis=1) | new_track
+        keep[:-1] |= new_track
+        return index[keep], np.bincount(ids[keep], minlength=len(self))
+
+    def tracks_in_bbox(self, min_lat, max_lat, min_lon, max_lon):
+        """返回有点位于矩形区域内的轨迹编号"""
+        return self.tracks_in_region(rectangle(min_lat, max_lat, min_lon, max_lon))
+
+    def tracks_in_region(self, region, segments=False):
+        """返回经过多边形区域（见 geo_filter）的轨迹编号（跨全部轨迹向量化计算）
+
+        segments=True 时同时检测相邻点之间穿越区域的航段（不跨轨迹连接）
+        """
+        index = self.point_index()
+        lats, lons = self.columns['lat'][index], self.columns['lon'][index]
+        ids = self.track_ids()
+        in_area = points_in_region(lats, lons, region)
+        hits = ids[in_area]
+        if segments and len(ids) > 1:
+            crossing = segments_in_region(lats, lons, region) & (ids[:-1] == ids[1:])
+            hits = np.concatenate([hits, ids[:-1][crossing]])
+        return np.unique(hits)
+
+    def importance(self):
+        """每个点的Douglas–Peucker重要度（见 track_simplify），所有轨迹一次计算并缓存"""
+        if self._importance is None:
+            index = self.point_index()
+            ends = np.cumsum(self.lengths)
+            starts = ends - self.lengths
+            breaks = np.concatenate((starts, ends - 1))[np.concatenate((self.lengths, self.lengths)) > 0]
+            importance = np.full(len(self.columns['lat']), np.inf)
+            importance[index] = point_importance(self.columns['lat'][index],
+                                                 self.columns['lon'][index], breaks)
+            self._importance = importance
+        return self._importance
+
+    def subset(self, indices):
+        """按轨迹编号选出子集，共享底层列数组"""
+        indices = np.asarray(indices, dtype=np.int64)
+        subset = TrackStore(self.columns, self.starts[indices], self.ends[indices],
+                            [self.names[i] for i in indices], self.kinds, self.categories)
+        subset._importance = self._importance
+        return subset
@@ -1,6 +1,8 @@
 import sys
 import os
 import shutil
+import time
+from collections import Counter
 import pandas as pd
 import numpy as np
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
@@ -14,14 +16,29 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 import matplotlib.patches as patches
-from matplotlib.patches import Rectangle
-import contextily as ctx
+from matplotlib.patches import Rectangle, Polygon
+from matplotlib.collections import LineCollection
+from matplotlib.markers import MarkerStyle
+from matplotlib.lines import Line2D
+from matplotlib.colors import to_rgba
 import geopandas as gpd
 from shapely.geometry import Point
 import requests
 from io import BytesIO
 from PIL import Image
 import warnings
+from track_manifest import (load_manifest, list_csv_files, bbox_intersects, bbox_within, detect_column,
+                            LAT_COLUMNS, LON_COLUMNS)
+from h3_index import load_index, h3_available, CENTER_COLUMNS
+from track_scan import ScanEngine, default_workers
+from track_cache import compile_folder, read_track
+from geo_filter import rectangle, is_rectangle, parse_region, region_bbox
+from tile_cache import TileCache, TileFetcher, discover_offline_sources, view_tiles
+from track_simplify import SimplifiedTrack, view_tolerance
+from track_store import TrackStore
+from track_density import point_density, segment_density, density_rgba
+from track_prefetch import TrackPrefetcher, neighbours
+from track_estimate import StratifiedSample
 warnings.filterwarnings('ignore')
 
 # 在线地图瓦片URL配置
@@ -32,7 +49,35 @@ MAP_TILES = {
     'Stamen Terrain': 'https://stamen-tiles.a.ssl.fastly.net/terrain/{z}/{x}/{y}.jpg',
 }
 
+# 离线瓦片（*.mbtiles 或 {z}/{x}/{y} 瓦片目录）放在此文件夹中，启动时自动加入地图样式
+OFFLINE_TILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tiles')
+MAP_TILES.update(discover_offline_sources(OFFLINE_TILES_DIR))
+
+# 文件夹统计过程中刷新部分结果的间隔（秒）
+STATS_UPDATE_INTERVAL = 0.2
+# 文件数不少于此值时按分层抽样顺序扫描，统计完成前显示估算结果
+ESTIMATE_MIN_FILES = 500
+# 统计报告中列出的船舶类型数
+STATS_TOP_LABELS = 10
+
+def trajectory_coords(df):
+    """单条轨迹的 (lons, lats)，经纬度列按清单的规则识别（如H3特征文件的 center_lat/center_lon）"""
+    lat_col = detect_column(df.columns, LAT_COLUMNS)
+    lon_col = detect_column(df.columns, LON_COLUMNS)
+    if lat_col is None or lon_col is None:
+        raise KeyError("缺少经纬度列")
+    return df[lon_col].values, df[lat_col].values
+
+def trajectory_limits(lons, lats, margin=0.01):
+    """单条轨迹的显示范围 (xlim, ylim)"""
+    return ((np.nanmin(lons) - margin, np.nanmax(lons) + margin),
+            (np.nanmin(lats) - margin, np.nanmax(lats) + margin))
+
 class MapCanvas(FigureCanvas):
+    # 工作线程获取的瓦片通过信号交给界面线程绘制
+    tile_loaded = pyqtSignal(int, object, object)
+    tiles_finished = pyqtSignal(int, int)
+    
     def __init__(self, parent=None):
         self.fig = Figure(figsize=(12, 8), facecolor='#1e1e1e')
         super().__init__(self.fig)
@@ -43,6 +88,36 @@ class MapCanvas(FigureCanvas):
         self.ax = self.fig.add_subplot(111)
         self.setup_map()
         
+        # 底图瓦片（磁盘缓存 + 离线源）
+        self.map_style = 'CartoDB Dark'
+        self.tile_cache = TileCache(MAP_TILES)
+        self.tile_fetcher = TileFetcher(self.tile_cache)
+        self.tile_generation = None
+        self.basemap_artists = []
+        self.stale_basemap = []
+        # 已绘制的轨迹线及其简化金字塔，视图变化后按缩放级别切换
+        self.track_lines = []
+        self.track_collections = []
+        # 密度图层 (图像, TrackStore, 是否按航段插值)，视图变化后只对可见范围重新统计
+        self.density_layer = None
+        self.tile_loaded.connect(self.on_tile_loaded)
+        self.tiles_finished.connect(self.on_tiles_finished)
+        
+        # 视图变化停止后再按新范围加载瓦片
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(250)
+        self.refresh_timer.timeout.connect(self.refresh_map)
+        
+        # 交互过程中缓存的画面 (图像, xlim, ylim)，手势结束后再完整重绘
+        self.gesture = None
+        # 手势进行中到达的瓦片不立即重绘，记录下来在手势结束时补上
+        self.draw_deferred = False
+        self.gesture_timer = QTimer(self)
+        self.gesture_timer.setSingleShot(True)
+        self.gesture_timer.setInterval(200)
+        self.gesture_timer.timeout.connect(self.end_gesture)
+        
         # 鼠标事件
         self.press = None
         self.mpl_connect('button_press_event', self.on_press)
@@ -63,35 +138,156 @@ class MapCanvas(FigureCanvas):
         self.refresh_map()
         
     def refresh_map(self):
-        """刷新地图底图"""
+        """刷新地图底图（后台并发加载瓦片，到达一块绘制一块）"""
         try:
-            # 获取当前视图范围
-            xlim = self.ax.get_xlim()
-            ylim = self.ax.get_ylim()
+            # 旧底图保留到新瓦片全部到达，避免闪烁
+            self.stale_basemap.extend(self.basemap_artists)
+            self.basemap_artists = []
             
-            # 添加在线地图瓦片
             if self.map_style in MAP_TILES:
-                ctx.add_basemap(self.ax, crs='EPSG:4326', 
-                              source=MAP_TILES[self.map_style],
-                              alpha=0.8, attribution='')
-            
-            # 恢复视图范围
-            self.ax.set_xlim(xlim)
-            self.ax.set_ylim(ylim)
+                source = self.tile_cache.source(self.map_style)
+                tiles = view_tiles(self.ax.get_xlim(), self.ax.get_ylim(),
+                                   self.ax.bbox.width, source.max_zoom)
+                if not tiles:
+                    # 视图内没有瓦片：没有新底图可等，直接移除旧底图
+                    self.cancel_tiles()
+                    self.remove_stale_basemap()
+                    self.request_draw()
+                    return
+                # 新请求会取消上一次视图尚未完成的瓦片
+                self.tile_generation = self.tile_fetcher.request(
+                    self.map_style, tiles, self.tile_loaded.emit, self.tiles_finished.emit
+                )
+            else:
+                self.cancel_tiles()
+                self.remove_stale_basemap()
             
         except Exception as e:
             print(f"无法加载在线地图: {e}")
             # 如果在线地图加载失败，使用默认样式
             pass
+    
+    def warm_basemap(self, style, width_px, xlim, ylim):
+        """把给定视图范围的底图瓦片预取到磁盘缓存（可在工作线程中调用，不访问界面对象）
+
+        style 和 width_px（地图宽度像素）应在界面线程中读取后传入。
+        """
+        if style in MAP_TILES:
+            source = self.tile_cache.source(style)
+            self.tile_fetcher.warm(style, view_tiles(xlim, ylim, width_px, source.max_zoom))
+        
+    def cancel_tiles(self):
+        """取消正在加载的瓦片"""
+        self.refresh_timer.stop()
+        self.tile_fetcher.cancel()
+        self.tile_generation = None
+    
+    def remove_stale_basemap(self):
+        for artist in self.stale_basemap:
+            artist.remove()
+        self.stale_basemap = []
+    
+    def request_draw(self):
+        """请求重绘；手势进行中时推迟到手势结束"""
+        if self.gesture is None:
+            self.draw_idle()
+        else:
+            self.draw_deferred = True
+    
+    def on_tile_loaded(self, generation, image, extent):
+        """绘制一个到达的瓦片"""
+        if generation != self.tile_generation:
+            return
+        # imshow 会自动调整坐标范围，绘制后恢复
+        xlim = self.ax.get_xlim()
+        ylim = self.ax.get_ylim()
+        self.basemap_artists.append(
+            self.ax.imshow(image, extent=extent, alpha=0.8, zorder=0,
+                           aspect='auto', interpolation='bilinear')
+        )
+        self.ax.set_xlim(xlim)
+        self.ax.set_ylim(ylim)
+        self.request_draw()
+    
+    def on_tiles_finished(self, generation, failed):
+        """本次视图的瓦片全部处理完毕"""
+        if generation != self.tile_generation:
+            return
+        self.remove_stale_basemap()
+        if failed:
+            print(f"无法加载在线地图: {failed} 个瓦片加载失败")
+        self.request_draw()
+    
+    def begin_gesture(self):
+        """开始平移/缩放：缓存当前渲染结果"""
+        if self.gesture is None:
+            self.gesture = (np.asarray(self.buffer_rgba()).copy(),
+                            self.ax.get_xlim(), self.ax.get_ylim())
+    
+    def blit_gesture(self):
+        """按当前视图范围平移/缩放缓存画面并只刷新坐标区（不重绘图元）"""
+        image, xlim0, ylim0 = self.gesture
+        xlim, ylim = self.ax.get_xlim(), self.ax.get_ylim()
+        bbox = self.ax.bbox
+        height = image.shape[0]
+        x0, x1 = int(round(bbox.x0)), int(round(bbox.x1))
+        r0, r1 = height - int(round(bbox.y1)), height - int(round(bbox.y0))
+        
+        # 屏幕像素 -> 当前视图的经纬度 -> 缓存画面中的像素
+        xs = np.arange(x0, x1) + 0.5
+        lons = xlim[0] + (xs - bbox.x0) / bbox.width * (xlim[1] - xlim[0])
+        src_x = bbox.x0 + (lons - xlim0[0]) / (xlim0[1] - xlim0[0]) * bbox.width
+        ys = height - (np.arange(r0, r1) + 0.5)
+        lats = ylim[0] + (ys - bbox.y0) / bbox.height * (ylim[1] - ylim[0])
+        src_y = bbox.y0 + (lats - ylim0[0]) / (ylim0[1] - ylim0[0]) * bbox.height
+        src_rows = np.floor(height - src_y).astype(np.int64)
+        src_cols = np.floor(src_x).astype(np.int64)
+        valid_rows = (src_rows >= r0) & (src_rows < r1)
+        valid_cols = (src_cols >= x0) & (src_cols < x1)
+        
+        region = image[np.clip(src_rows, 0, height - 1)[:, None],
+                       np.clip(src_cols, 0, image.shape[1] - 1)[None, :]]
+        region[~(valid_rows[:, None] & valid_cols[None, :])] = \
+            np.array(self.fig.get_facecolor()) * 255
+        np.asarray(self.buffer_rgba())[r0:r1, x0:x1] = region
+        self.blit(bbox)
+    
+    def end_gesture(self):
+        """手势结束：视图范围变化时完整重绘一次并按新范围加载瓦片"""
+        self.gesture_timer.stop()
+        if self.gesture is None:
+            return
+        _, xlim0, ylim0 = self.gesture
+        self.gesture = None
+        deferred, self.draw_deferred = self.draw_deferred, False
+        if self.ax.get_xlim() == xlim0 and self.ax.get_ylim() == ylim0:
+            # 单击等未改变视图的手势：不重新统计、不请求瓦片，只补上手势期间推迟的重绘
+            if deferred:
+                self.draw_idle()
+            return
+        self.update_simplification()
+        self.update_density()
+        self.draw()
+        self.refresh_timer.start()
+    
+    def update_simplification(self):
+        """按当前视图每像素的经纬度为每条轨迹线选择简化级别"""
+        tolerance = view_tolerance(self.ax.get_xlim(), self.ax.get_ylim(),
+                                   self.ax.bbox.width, self.ax.bbox.height)
+        for line, track in self.track_lines:
+            lats, lons = track.coords(tolerance)
+            line.set_data(lons, lats)
+        for collection, store in self.track_collections:
+            collection.set_segments(store.polylines(tolerance))
         
     def plot_trajectory(self, df, color='#00aaff', alpha=0.9, linewidth=2.5):
         """绘制单条轨迹"""
         if len(df) > 0:
-            lons = df['lon'].values
-            lats = df['lat'].values
+            lons, lats = trajectory_coords(df)
             
-            # 绘制轨迹线
-            self.ax.plot(lons, lats, color=color, alpha=alpha, linewidth=linewidth, zorder=5)
+            # 绘制轨迹线（按缩放级别使用简化后的点）
+            line, = self.ax.plot(lons, lats, color=color, alpha=alpha, linewidth=linewidth, zorder=5)
+            self.track_lines.append((line, SimplifiedTrack(lats, lons)))
             
             # 绘制起点和终点
             self.ax.scatter(lons[0], lats[0], color='#ff6b6b', s=120, marker='o', 
@@ -100,17 +296,113 @@ class MapCanvas(FigureCanvas):
                           label='End', zorder=6, edgecolors='white', linewidth=1)
             
             # 自动调整视图范围
-            margin = 0.01
-            self.ax.set_xlim(min(lons) - margin, max(lons) + margin)
-            self.ax.set_ylim(min(lats) - margin, max(lats) + margin)
+            xlim, ylim = trajectory_limits(lons, lats)
+            self.ax.set_xlim(*xlim)
+            self.ax.set_ylim(*ylim)
+            self.update_simplification()
             
             # 刷新地图底图
             self.refresh_map()
             self.draw()
     
+    def plot_trajectories(self, store, alpha=0.8, linewidth=1.2):
+        """批量绘制多条轨迹（TrackStore）
+
+        所有轨迹线放在一个 LineCollection 中、起终点放在一个 PathCollection 中，
+        按 label 众数着色，只重绘一次。
+        """
+        store = store.subset(np.flatnonzero(store.lengths > 0))
+        if len(store) == 0:
+            return
+        
+        # 按船舶类型分配颜色
+        labels = store.mode('label') if 'label' in store.columns else [None] * len(store)
+        cmap = plt.get_cmap('tab20')
+        label_colors = {label: cmap(i % cmap.N)
+                        for i, label in enumerate(sorted({str(l) for l in labels if l is not None}))}
+        colors = [label_colors[str(l)] if l is not None else to_rgba('#00aaff') for l in labels]
+        
+        # 自动调整视图范围
+        lat_min, lat_max, lon_min, lon_max = store.bboxes()
+        margin = 0.01
+        self.ax.set_xlim(np.nanmin(lon_min) - margin, np.nanmax(lon_max) + margin)
+        self.ax.set_ylim(np.nanmin(lat_min) - margin, np.nanmax(lat_max) + margin)
+        tolerance = view_tolerance(self.ax.get_xlim(), self.ax.get_ylim(),
+                                   self.ax.bbox.width, self.ax.bbox.height)
+        
+        # 轨迹线（按屏幕像素简化）
+        collection = LineCollection(store.polylines(tolerance), colors=colors, alpha=alpha,
+                                    linewidths=linewidth, zorder=5)
+        self.ax.add_collection(collection)
+        self.track_collections.append((collection, store))
+        
+        # 起点和终点：偏移按 [起点, 终点, 起点, 终点, ...] 排列，标记形状和颜色随之循环
+        ends = np.column_stack((store.starts, store.ends - 1)).ravel()
+        markers = self.ax.scatter(store.columns['lon'][ends], store.columns['lat'][ends],
+                                  s=40, zorder=6, edgecolors='white', linewidths=0.8)
+        markers.set_facecolor(['#ff6b6b', '#4ecdc4'])
+        markers.set_paths([MarkerStyle(m).get_path().transformed(MarkerStyle(m).get_transform())
+                           for m in ('o', 's')])
+        
+        # 类型图例
+        if label_colors:
+            handles = [Line2D([], [], color=color, linewidth=2, label=label)
+                       for label, color in list(label_colors.items())[:20]]
+            legend = self.ax.legend(handles=handles, loc='upper right', fontsize=8,
+                                    facecolor='#2d2d2d', edgecolor='#555555', labelcolor='white')
+            legend.set_zorder(7)
+        
+        # 刷新地图底图
+        self.refresh_map()
+        self.draw()
+    
+    def plot_density(self, store, segments=True):
+        """以密度栅格图层显示全部轨迹点（或插值航段）"""
+        if store.total_points == 0:
+            return
+        lat_min, lat_max, lon_min, lon_max = store.bboxes()
+        margin = 0.01
+        self.ax.set_xlim(np.nanmin(lon_min) - margin, np.nanmax(lon_max) + margin)
+        self.ax.set_ylim(np.nanmin(lat_min) - margin, np.nanmax(lat_max) + margin)
+        
+        image = self.ax.imshow(np.zeros((1, 1, 4), dtype=np.uint8), zorder=3,
+                               aspect='auto', interpolation='nearest')
+        self.density_layer = (image, store, segments)
+        self.update_density()
+        
+        # 刷新地图底图
+        self.refresh_map()
+        self.draw()
+    
+    def update_density(self):
+        """按当前视图范围和像素大小重新统计密度栅格"""
+        if self.density_layer is None:
+            return
+        image, store, segments = self.density_layer
+        xlim, ylim = self.ax.get_xlim(), self.ax.get_ylim()
+        width, height = max(int(self.ax.bbox.width), 1), max(int(self.ax.bbox.height), 1)
+        
+        index = store.point_index()
+        lats, lons = store.columns['lat'][index], store.columns['lon'][index]
+        if segments:
+            grid = segment_density(lats, lons, xlim, ylim, width, height, store.track_ids())
+        else:
+            grid = point_density(lats, lons, xlim, ylim, width, height)
+        image.set_data(density_rgba(grid))
+        image.set_extent((xlim[0], xlim[1], ylim[0], ylim[1]))
+        # set_extent 会自动调整坐标范围，统计后恢复
+        self.ax.set_xlim(xlim)
+        self.ax.set_ylim(ylim)
+    
     def clear_trajectories(self):
         """清除所有轨迹"""
+        self.cancel_tiles()
         self.ax.clear()
+        self.basemap_artists = []
+        self.stale_basemap = []
+        self.track_lines = []
+        self.track_collections = []
+        self.density_layer = None
         self.setup_map()
         self.draw()
     
@@ -121,6 +413,15 @@ class MapCanvas(FigureCanvas):
         self.ax.add_patch(rect)
         self.draw()
     
+    def plot_selection_region(self, region):
+        """绘制多边形选择区域"""
+        for polygon in region:
+            for ring in polygon:
+                patch = Polygon(ring[:, ::-1], closed=True, linewidth=3, edgecolor='#ffd93d',
+                                facecolor='#ffd93d', alpha=0.2, zorder=4)
+                self.ax.add_patch(patch)
+        self.draw()
+    
     def on_scroll(self, event):
         """鼠标滚轮缩放事件"""
         if event.inaxes != self.ax:
@@ -149,15 +450,19 @@ class MapCanvas(FigureCanvas):
         new_xlim = [center_x - new_xrange/2, center_x + new_xrange/2]
         new_ylim = [center_y - new_yrange/2, center_y + new_yrange/2]
         
+        self.begin_gesture()
         self.ax.set_xlim(new_xlim)
         self.ax.set_ylim(new_ylim)
-        self.draw()
+        self.blit_gesture()
+        # 滚轮停止后结束手势
+        self.gesture_timer.start()
     
     def on_press(self, event):
         """鼠标按下事件"""
         if event.inaxes != self.ax:
             return
         self.press = (event.xdata, event.ydata)
+        self.begin_gesture()
     
     def on_motion(self, event):
         """鼠标移动事件"""
@@ -175,60 +480,297 @@ class MapCanvas(FigureCanvas):
         
         self.ax.set_xlim(xlim[0] - dx, xlim[1] - dx)
         self.ax.set_ylim(ylim[0] - dy, ylim[1] - dy)
-        self.draw()
+        self.blit_gesture()
     
     def on_release(self, event):
         """鼠标释放事件"""
         self.press = None
-        self.draw()
+        self.end_gesture()
 
 class TrajectoryProcessor(QThread):
     progress_updated = pyqtSignal(int)
     file_processed = pyqtSignal(str, bool)
+    # 扫描失败的文件 (文件名, 错误信息)，这些文件不计入筛选结果
+    file_failed = pyqtSignal(str, str)
     finished_processing = pyqtSignal(list)
     
-    def __init__(self, folder_path, min_lat, max_lat, min_lon, max_lon):
+    def __init__(self, folder_path, min_lat, max_lat, min_lon, max_lon, scan_engine=None, region=None,
+                 segments=False):
         super().__init__()
         self.folder_path = folder_path
         self.min_lat = min_lat
         self.max_lat = max_lat
         self.min_lon = min_lon
         self.max_lon = max_lon
+        self.scan_engine = scan_engine or ScanEngine(max_workers=1)
+        # 多边形区域（见 geo_filter），未指定时使用经纬度矩形
+        self.region = region or rectangle(min_lat, max_lat, min_lon, max_lon)
+        # 是否同时检测相邻定位点之间穿越区域的航段
+        self.segments = segments
         
     def run(self):
         """处理轨迹文件，筛选经过指定区域的轨迹"""
-        csv_files = [f for f in os.listdir(self.folder_path) if f.endswith('.csv')]
-        filtered_files = []
+        # 加载（或增量更新）文件夹清单，首次构建时用进度条显示扫描进度
+        files = load_manifest(
+            self.folder_path,
+            progress_callback=lambda done, total: self.progress_updated.emit(int(done / total * 100))
+        )
+        bbox = (self.min_lat, self.max_lat, self.min_lon, self.max_lon)
+        rectangular = is_rectangle(self.region)
+        names = list(files)
+        hits = set()
+        scan_tasks = []
+        processed = 0
+
+        # H3特征文件先通过单元倒排索引判断：内部单元命中的文件必然经过区域，
+        # 只在边界单元出现的文件仍按真实坐标扫描
+        h3_index, h3_hits, h3_candidates = None, set(), set()
+        if h3_available():
+            h3_index = load_index(self.folder_path)
+            h3_hits, h3_candidates = h3_index.query_region(self.region)
+
+        def report(filename, in_area):
+            nonlocal processed
+            if in_area:
+                hits.add(filename)
+            self.file_processed.emit(filename, in_area)
+
+            # 更新进度
+            processed += 1
+            self.progress_updated.emit(int(processed / len(names) * 100))
+
+        for filename in names:
+            entry = files[filename]
+
+            # 边界框不相交的文件无需读取
+            if not bbox_intersects(entry, *bbox):
+                report(filename, False)
+
+            # 边界框完全位于矩形区域内的文件必然经过该区域
+            elif rectangular and bbox_within(entry, *bbox):
+                report(filename, True)
+
+            # H3索引只能判断点；航段模式下未命中的文件仍需检查航段
+            elif (h3_index is not None and h3_index.is_indexed(filename) and
+                  (entry['lat_col'], entry['lon_col']) == CENTER_COLUMNS and
+                  (filename in h3_hits or (filename not in h3_candidates and not self.segments))):
+                report(filename, filename in h3_hits)
+
+            # 其余文件交给并行扫描引擎逐点检查
+            else:
+                filepath = os.path.join(self.folder_path, filename)
+                scan_tasks.append((filename, filepath, entry['lat_col'], entry['lon_col'], entry['chunks']))
+
+        for filename, in_area, error in self.scan_engine.scan(scan_tasks, self.region, self.segments):
+            if error is not None:
+                self.file_failed.emit(filename, str(error) or type(error).__name__)
+            report(filename, in_area)
+
+        filtered_files = [os.path.join(self.folder_path, f) for f in names if f in hits]
+        self.finished_processing.emit(filtered_files)
+
+class CacheCompiler(QThread):
+    progress_updated = pyqtSignal(int)
+    finished_compiling = pyqtSignal(int)
+    
+    def __init__(self, folder_path):
+        super().__init__()
+        self.folder_path = folder_path
+    
+    def run(self):
+        """把文件夹中的CSV编译为列式二进制缓存"""
+        count = compile_folder(
+            self.folder_path,
+            progress_callback=lambda done, total: self.progress_updated.emit(int(done / total * 100))
+        )
+        self.finished_compiling.emit(count)
+
+class FolderStatistics:
+    """按文件清单条目累加的文件夹统计（口径与逐文件读取时一致：需要 lat/lon 列，时间取 date 列）
+
+    给出 sample（track_estimate.StratifiedSample）时，每个文件同时计入分层样本，
+    统计未完成时的报告按样本估算全文件夹的总量。
+    """
+    
+    def __init__(self, total_files, sample=None):
+        self.total_files = total_files
+        self.sample = sample
+        self.scanned_files = 0
+        self.valid_files = 0
+        self.total_points = 0
+        self.max_points = 0
+        self.min_points = 0
+        self.date_range = {'min': None, 'max': None}
+        self.lat_range = {'min': float('inf'), 'max': float('-inf')}
+        self.lon_range = {'min': float('inf'), 'max': float('-inf')}
+        self.labels = Counter()
+    
+    def add(self, entry, index=None):
+        """累加一个文件的摘要（见 track_manifest.summarize_file），index 为文件在样本中的序号"""
+        self.scanned_files += 1
+        valid = not entry['error'] and entry['lat_col'] == 'lat' and entry['lon_col'] == 'lon'
+        if self.sample is not None:
+            values = {'valid': 1, 'points': entry['rows'], 'label:' + str(entry.get('label')): 1} if valid else {}
+            self.sample.add(index, values)
+        if not valid:
+            return
         
-        for i, filename in enumerate(csv_files):
-            filepath = os.path.join(self.folder_path, filename)
-            try:
-                df = pd.read_csv(filepath)
-                
-                # 检查是否包含必要的列
-                required_cols = ['lat', 'lon']
-                if not all(col in df.columns for col in required_cols):
-                    self.file_processed.emit(filename, False)
-                    continue
-                
-                # 检查轨迹是否经过指定区域
-                in_area = ((df['lat'] >= self.min_lat) & (df['lat'] <= self.max_lat) & 
-                          (df['lon'] >= self.min_lon) & (df['lon'] <= self.max_lon))
-                
-                if in_area.any():
-                    filtered_files.append(filepath)
-                    self.file_processed.emit(filename, True)
+        points_count = entry['rows']
+        self.max_points = max(self.max_points, points_count) if self.valid_files else points_count
+        self.min_points = min(self.min_points, points_count) if self.valid_files else points_count
+        self.valid_files += 1
+        self.total_points += points_count
+        self.labels[entry.get('label')] += 1
+        
+        if entry['lat_min'] is not None:
+            self.lat_range['min'] = min(self.lat_range['min'], entry['lat_min'])
+            self.lat_range['max'] = max(self.lat_range['max'], entry['lat_max'])
+            self.lon_range['min'] = min(self.lon_range['min'], entry['lon_min'])
+            self.lon_range['max'] = max(self.lon_range['max'], entry['lon_max'])
+        
+        if entry['time_col'] == 'date' and entry['time_min'] is not None:
+            file_min_date = pd.Timestamp(entry['time_min'])
+            file_max_date = pd.Timestamp(entry['time_max'])
+            if self.date_range['min'] is None or file_min_date < self.date_range['min']:
+                self.date_range['min'] = file_min_date
+            if self.date_range['max'] is None or file_max_date > self.date_range['max']:
+                self.date_range['max'] = file_max_date
+    
+    def estimating(self):
+        """统计尚未完成且样本已足够估算"""
+        return (self.sample is not None and self.scanned_files < self.total_files
+                and self.sample.ready())
+    
+    def report(self):
+        """统计报告文本；统计未完成时按样本估算（± 为95%置信区间），样本不足时显示已统计部分"""
+        estimating = self.estimating()
+        if estimating:
+            valid, valid_error = self.sample.total('valid')
+            points, points_error = self.sample.total('points', ratio=True)
+            progress = f"（估算：已统计 {self.scanned_files}/{self.total_files}，± 为95%置信区间）"
+            valid_text = f"≈ {valid:,.0f} ± {valid_error:,.0f}"
+            invalid_text = f"≈ {self.total_files - valid:,.0f} ± {valid_error:,.0f}"
+            points_text = f"≈ {points:,.0f} ± {points_error:,.0f}"
+            mean_text = f"≈ {points / valid:,.0f}" if valid > 0 else "0"
+            max_text, min_text = f"≥ {self.max_points}", f"≤ {self.min_points}"
+            range_note = "（已统计文件，全部范围不小于此）"
+        else:
+            progress = "" if self.scanned_files >= self.total_files else f"（统计中 {self.scanned_files}/{self.total_files}）"
+            valid_text = self.valid_files
+            invalid_text = self.scanned_files - self.valid_files
+            points_text = f"{self.total_points:,}"
+            mean_text = int(self.total_points/self.valid_files) if self.valid_files > 0 else 0
+            max_text, min_text = self.max_points, self.min_points
+            range_note = ""
+        
+        stats_report = f"""📊 文件夹统计信息{progress}
+{'='*40}
+📁 总文件数: {self.total_files}
+✅ 有效轨迹文件: {valid_text}
+❌ 无效文件: {invalid_text}
+
+📈 轨迹数据统计
+{'='*40}
+🎯 总轨迹点数: {points_text}
+📏 平均每文件点数: {mean_text}
+📊 最大文件点数: {max_text}
+📉 最小文件点数: {min_text}
+
+🗺️ 地理范围{range_note}
+{'='*40}
+🌍 纬度范围: {self.lat_range['min']:.6f} ~ {self.lat_range['max']:.6f}
+🌐 经度范围: {self.lon_range['min']:.6f} ~ {self.lon_range['max']:.6f}
+📐 纬度跨度: {self.lat_range['max'] - self.lat_range['min']:.6f}°
+📐 经度跨度: {self.lon_range['max'] - self.lon_range['min']:.6f}°
+
+⏰ 时间范围{range_note}
+{'='*40}"""
+        
+        if self.date_range['min'] and self.date_range['max']:
+            stats_report += f"""
+📅 开始时间: {self.date_range['min'].strftime('%Y-%m-%d %H:%M:%S')}
+📅 结束时间: {self.date_range['max'].strftime('%Y-%m-%d %H:%M:%S')}
+⏱️ 时间跨度: {(self.date_range['max'] - self.date_range['min']).days} 天"""
+        else:
+            stats_report += f"""
+📅 时间信息: 无法解析日期字段"""
+        
+        if self.labels:
+            stats_report += f"""
+
+🚢 船舶类型构成
+{'='*40}"""
+            for label, count in self.labels.most_common(STATS_TOP_LABELS):
+                name = label if label is not None else "未知"
+                if estimating:
+                    share, share_error = self.sample.total('label:' + str(label))
+                    stats_report += f"\n{name}: ≈ {share / valid:.1%} ± {share_error / valid:.1%}"
                 else:
-                    self.file_processed.emit(filename, False)
-                    
-            except Exception as e:
-                self.file_processed.emit(filename, False)
+                    stats_report += f"\n{name}: {count} ({count / self.valid_files:.1%})"
+        return stats_report
+
+class StatisticsCancelled(Exception):
+    """统计任务被取消"""
+
+class StatisticsWorker(QThread):
+    progress_updated = pyqtSignal(int)
+    statistics_updated = pyqtSignal(str)
+    finished_statistics = pyqtSignal(str)
+    
+    def __init__(self, folder_path, parent=None):
+        super().__init__(parent)
+        self.folder_path = folder_path
+        self.cancelled = False
+    
+    def cancel(self):
+        """停止统计（如选择了新的文件夹），之后不再发送结果"""
+        self.cancelled = True
+    
+    def run(self):
+        """按文件清单统计（只重新扫描新增或变化的文件），定时发送部分结果
+
+        文件较多时按文件大小分层的随机顺序扫描，部分结果是全文件夹的估算，
+        随扫描进行逐步收敛到精确值。
+        """
+        try:
+            csv_files = list_csv_files(self.folder_path)
+            order, sample = None, None
+            if len(csv_files) >= ESTIMATE_MIN_FILES:
+                sizes = []
+                for name in csv_files:
+                    try:
+                        sizes.append(os.stat(os.path.join(self.folder_path, name)).st_size)
+                    except OSError:
+                        sizes.append(0)
+                sample = StratifiedSample(sizes)
+                order = [csv_files[i] for i in sample.order()]
+            index = {name: i for i, name in enumerate(csv_files)}
             
-            # 更新进度
-            progress = int((i + 1) / len(csv_files) * 100)
-            self.progress_updated.emit(progress)
-        
-        self.finished_processing.emit(filtered_files)
+            stats = FolderStatistics(len(csv_files), sample)
+            last_update = [time.monotonic()]
+            
+            def on_entry(name, entry):
+                if self.cancelled:
+                    raise StatisticsCancelled()
+                stats.add(entry, index[name])
+                now = time.monotonic()
+                if now - last_update[0] >= STATS_UPDATE_INTERVAL:
+                    last_update[0] = now
+                    self.statistics_updated.emit(stats.report())
+            
+            load_manifest(
+                self.folder_path,
+                progress_callback=lambda done, total: self.progress_updated.emit(int(done / total * 100)),
+                entry_callback=on_entry,
+                order=order
+            )
+            if not self.cancelled:
+                self.finished_statistics.emit(stats.report() if stats.total_files else "未找到CSV文件")
+        except StatisticsCancelled:
+            pass
+        except Exception as e:
+            if not self.cancelled:
+                self.finished_statistics.emit(f"分析失败: {str(e)}")
 
 class ShipTrajectorySystem(QMainWindow):
     def __init__(self):
@@ -357,6 +899,9 @@ class ShipTrajectorySystem(QMainWindow):
             }
         """)
         
+        self.scan_engine = ScanEngine()
+        # 逐条浏览时预取前后的轨迹文件（按内存大小淘汰的LRU缓存）
+        self.track_prefetcher = TrackPrefetcher()
         self.setup_ui()
         self.current_trajectory_files = []
         self.current_file_index = 0
@@ -402,6 +947,10 @@ class ShipTrajectorySystem(QMainWindow):
         self.select_file_btn.clicked.connect(self.select_file)
         file_layout.addWidget(self.select_file_btn)
         
+        self.compile_cache_btn = QPushButton("编译文件夹缓存")
+        self.compile_cache_btn.clicked.connect(self.compile_folder_cache)
+        file_layout.addWidget(self.compile_cache_btn)
+        
         self.file_path_label = QLabel("未选择文件")
         file_layout.addWidget(self.file_path_label)
         
@@ -413,6 +962,7 @@ class ShipTrajectorySystem(QMainWindow):
         
         self.map_style_combo = QComboBox()
         self.map_style_combo.addItems(['CartoDB Dark', 'OpenStreetMap', 'CartoDB Positron', 'Stamen Terrain'])
+        self.map_style_combo.addItems([style for style in MAP_TILES if style.startswith('离线')])
         self.map_style_combo.currentTextChanged.connect(self.change_map_style)
         map_style_layout.addWidget(self.map_style_combo)
         
@@ -450,13 +1000,27 @@ class ShipTrajectorySystem(QMainWindow):
         self.max_lon_input.setDecimals(6)
         filter_layout.addWidget(self.max_lon_input, 3, 1)
         
+        filter_layout.addWidget(QLabel("多边形顶点:"), 4, 0)
+        self.polygon_input = QLineEdit()
+        self.polygon_input.setPlaceholderText("可选: lat,lon; lat,lon; ... 多个多边形用 | 分隔")
+        filter_layout.addWidget(self.polygon_input, 4, 1)
+        
+        filter_layout.addWidget(QLabel("并行进程数:"), 5, 0)
+        self.workers_input = QSpinBox()
+        self.workers_input.setRange(1, default_workers())
+        self.workers_input.setValue(default_workers())
+        filter_layout.addWidget(self.workers_input, 5, 1)
+        
+        self.segments_checkbox = QCheckBox("检测定位点之间穿越区域的航段")
+        filter_layout.addWidget(self.segments_checkbox, 6, 0, 1, 2)
+        
         self.filter_btn = QPushButton("筛选轨迹")
         self.filter_btn.clicked.connect(self.filter_trajectories)
-        filter_layout.addWidget(self.filter_btn, 4, 0, 1, 2)
+        filter_layout.addWidget(self.filter_btn, 7, 0, 1, 2)
         
         self.show_area_btn = QPushButton("显示筛选区域")
         self.show_area_btn.clicked.connect(self.show_selection_area)
-        filter_layout.addWidget(self.show_area_btn, 5, 0, 1, 2)
+        filter_layout.addWidget(self.show_area_btn, 8, 0, 1, 2)
         
         tool_layout.addWidget(filter_group)
         
@@ -477,6 +1041,19 @@ class ShipTrajectorySystem(QMainWindow):
         self.prev_btn.setEnabled(False)
         control_layout.addWidget(self.prev_btn)
         
+        self.show_all_btn = QPushButton("显示全部筛选轨迹")
+        self.show_all_btn.clicked.connect(self.show_all_trajectories)
+        self.show_all_btn.setEnabled(False)
+        control_layout.addWidget(self.show_all_btn)
+        
+        self.density_btn = QPushButton("显示轨迹密度图")
+        self.density_btn.clicked.connect(self.show_density)
+        control_layout.addWidget(self.density_btn)
+        
+        self.density_segments_checkbox = QCheckBox("密度图按航段插值")
+        self.density_segments_checkbox.setChecked(True)
+        control_layout.addWidget(self.density_segments_checkbox)
+        
         self.save_btn = QPushButton("保存当前轨迹")
         self.save_btn.clicked.connect(self.save_current_trajectory)
         self.save_btn.setEnabled(False)
@@ -553,103 +1130,53 @@ class ShipTrajectorySystem(QMainWindow):
             self.analyze_folder_statistics(folder)
     
     def analyze_folder_statistics(self, folder_path):
-        """分析文件夹统计信息"""
-        try:
-            csv_files = [f for f in os.listdir(folder_path) if f.endswith('.csv')]
-            total_files = len(csv_files)
-            
-            if total_files == 0:
-                self.update_statistics("未找到CSV文件")
-                return
-            
-            valid_files = 0
-            total_points = 0
-            date_range = {'min': None, 'max': None}
-            lat_range = {'min': float('inf'), 'max': float('-inf')}
-            lon_range = {'min': float('inf'), 'max': float('-inf')}
-            file_sizes = []
-            
-            self.log_message(f"开始分析 {total_files} 个CSV文件...")
-            
-            for i, filename in enumerate(csv_files):
-                try:
-                    filepath = os.path.join(folder_path, filename)
-                    df = pd.read_csv(filepath)
-                    
-                    # 检查必要列
-                    if 'lat' in df.columns and 'lon' in df.columns:
-                        valid_files += 1
-                        points_count = len(df)
-                        total_points += points_count
-                        file_sizes.append(points_count)
-                        
-                        # 更新经纬度范围
-                        lat_range['min'] = min(lat_range['min'], df['lat'].min())
-                        lat_range['max'] = max(lat_range['max'], df['lat'].max())
-                        lon_range['min'] = min(lon_range['min'], df['lon'].min())
-                        lon_range['max'] = max(lon_range['max'], df['lon'].max())
-                        
-                        # 处理日期范围
-                        if 'date' in df.columns:
-                            try:
-                                df['date'] = pd.to_datetime(df['date'])
-                                file_min_date = df['date'].min()
-                                file_max_date = df['date'].max()
-                                
-                                if date_range['min'] is None or file_min_date < date_range['min']:
-                                    date_range['min'] = file_min_date
-                                if date_range['max'] is None or file_max_date > date_range['max']:
-                                    date_range['max'] = file_max_date
-                            except:
-                                pass
-                    
-                    # 更新进度
-                    if i % 10 == 0:  # 每10个文件更新一次进度
-                        progress = int((i + 1) / total_files * 100)
-                        self.progress_bar.setValue(progress)
-                
-                except Exception as e:
-                    continue
-            
-            # 生成统计报告
-            stats_report = f"""📊 文件夹统计信息
-{'='*40}
-📁 总文件数: {total_files}
-✅ 有效轨迹文件: {valid_files}
-❌ 无效文件: {total_files - valid_files}
-
-📈 轨迹数据统计
-{'='*40}
-🎯 总轨迹点数: {total_points:,}
-📏 平均每文件点数: {int(total_points/valid_files) if valid_files > 0 else 0}
-📊 最大文件点数: {max(file_sizes) if file_sizes else 0}
-📉 最小文件点数: {min(file_sizes) if file_sizes else 0}
-
-🗺️ 地理范围
-{'='*40}
-🌍 纬度范围: {lat_range['min']:.6f} ~ {lat_range['max']:.6f}
-🌐 经度范围: {lon_range['min']:.6f} ~ {lon_range['max']:.6f}
-📐 纬度跨度: {lat_range['max'] - lat_range['min']:.6f}°
-📐 经度跨度: {lon_range['max'] - lon_range['min']:.6f}°
-
-⏰ 时间范围
-{'='*40}"""
-            
-            if date_range['min'] and date_range['max']:
-                stats_report += f"""
-📅 开始时间: {date_range['min'].strftime('%Y-%m-%d %H:%M:%S')}
-📅 结束时间: {date_range['max'].strftime('%Y-%m-%d %H:%M:%S')}
-⏱️ 时间跨度: {(date_range['max'] - date_range['min']).days} 天"""
-            else:
-                stats_report += f"""
-📅 时间信息: 无法解析日期字段"""
-            
-            self.update_statistics(stats_report)
+        """在后台线程中统计文件夹，统计过程中随时显示部分结果"""
+        # 之前的统计任务停止扫描，已发出但尚未处理的结果也不再显示
+        previous = getattr(self, 'stats_worker', None)
+        if previous is not None:
+            previous.cancel()
+            for signal in (previous.progress_updated, previous.statistics_updated, previous.finished_statistics):
+                signal.disconnect()
+        self.stats_worker = StatisticsWorker(folder_path, self)
+        self.stats_worker.progress_updated.connect(self.on_statistics_progress)
+        self.stats_worker.statistics_updated.connect(self.on_statistics_updated)
+        self.stats_worker.finished_statistics.connect(self.on_statistics_finished)
+        self.log_message(f"开始分析文件夹统计信息: {folder_path}")
+        self.stats_worker.start()
+    
+    def on_statistics_progress(self, value):
+        if self.sender() is self.stats_worker:
+            self.progress_bar.setValue(value)
+    
+    def on_statistics_updated(self, stats_text):
+        # 已被新的统计任务取代的结果不再显示
+        if self.sender() is self.stats_worker:
+            self.update_statistics(stats_text)
+    
+    def on_statistics_finished(self, stats_text):
+        if self.sender() is self.stats_worker:
+            self.update_statistics(stats_text)
             self.progress_bar.setValue(0)
-            
-        except Exception as e:
-            self.update_statistics(f"分析失败: {str(e)}")
-            self.log_message(f"统计分析出错: {str(e)}")
+            self.log_message("文件夹统计完成")
+    
+    def compile_folder_cache(self):
+        """编译当前文件夹的列式缓存"""
+        if not hasattr(self, 'current_folder'):
+            QMessageBox.warning(self, "警告", "请先选择文件夹")
+            return
+        
+        self.log_message(f"开始编译缓存: {self.current_folder}")
+        self.compile_cache_btn.setEnabled(False)
+        self.cache_compiler = CacheCompiler(self.current_folder)
+        self.cache_compiler.progress_updated.connect(self.update_progress)
+        self.cache_compiler.finished_compiling.connect(self.on_cache_compiled)
+        self.cache_compiler.start()
+    
+    def on_cache_compiled(self, count):
+        """缓存编译完成"""
+        self.compile_cache_btn.setEnabled(True)
+        self.progress_bar.setValue(0)
+        self.log_message(f"缓存编译完成，更新 {count} 个文件")
     
     def update_statistics(self, stats_text):
         """更新统计信息显示"""
@@ -672,7 +1199,7 @@ class ShipTrajectorySystem(QMainWindow):
     def load_single_file(self, file_path):
         """加载单个文件"""
         try:
-            df = pd.read_csv(file_path)
+            df = read_track(file_path)
             self.map_canvas.clear_trajectories()
             self.map_canvas.plot_trajectory(df)
             self.log_message(f"加载文件: {os.path.basename(file_path)}")
@@ -686,6 +1213,41 @@ class ShipTrajectorySystem(QMainWindow):
             QMessageBox.warning(self, "警告", "请先选择文件夹")
             return
         
+        region = self.get_selection_region()
+        if region is None:
+            return
+        min_lat, max_lat, min_lon, max_lon = region_bbox(region)
+        
+        if self.polygon_input.text().strip():
+            self.log_message(f"开始筛选轨迹，多边形区域: {len(region)} 个多边形")
+        else:
+            self.log_message(f"开始筛选轨迹，区域: ({min_lat}, {min_lon}) - ({max_lat}, {max_lon})")
+        
+        # 创建处理线程；筛选期间禁用按钮，进程池不会在扫描中途按新的进程数重建
+        self.filter_btn.setEnabled(False)
+        self.scan_failures = 0
+        self.scan_engine.set_max_workers(self.workers_input.value())
+        self.processor = TrajectoryProcessor(self.current_folder, min_lat, max_lat, min_lon, max_lon,
+                                             scan_engine=self.scan_engine, region=region,
+                                             segments=self.segments_checkbox.isChecked())
+        self.processor.progress_updated.connect(self.update_progress)
+        self.processor.file_processed.connect(self.on_file_processed)
+        self.processor.file_failed.connect(self.on_file_failed)
+        self.processor.finished_processing.connect(self.on_filtering_finished)
+        # 线程结束（包括出错退出）后才允许再次筛选
+        self.processor.finished.connect(lambda: self.filter_btn.setEnabled(True))
+        self.processor.start()
+    
+    def get_selection_region(self):
+        """获取筛选区域：填写了多边形顶点时使用多边形，否则使用经纬度矩形"""
+        text = self.polygon_input.text().strip()
+        if text:
+            try:
+                return parse_region(text)
+            except ValueError as e:
+                QMessageBox.warning(self, "警告", f"多边形顶点格式错误: {str(e)}")
+                return None
+        
         min_lat = self.min_lat_input.value()
         max_lat = self.max_lat_input.value()
         min_lon = self.min_lon_input.value()
@@ -693,16 +1255,9 @@ class ShipTrajectorySystem(QMainWindow):
         
         if min_lat >= max_lat or min_lon >= max_lon:
             QMessageBox.warning(self, "警告", "经纬度范围设置错误")
-            return
-        
-        self.log_message(f"开始筛选轨迹，区域: ({min_lat}, {min_lon}) - ({max_lat}, {max_lon})")
+            return None
         
-        # 创建处理线程
-        self.processor = TrajectoryProcessor(self.current_folder, min_lat, max_lat, min_lon, max_lon)
-        self.processor.progress_updated.connect(self.update_progress)
-        self.processor.file_processed.connect(self.on_file_processed)
-        self.processor.finished_processing.connect(self.on_filtering_finished)
-        self.processor.start()
+        return rectangle(min_lat, max_lat, min_lon, max_lon)
     
     def update_progress(self, value):
         """更新进度条"""
@@ -715,8 +1270,15 @@ class ShipTrajectorySystem(QMainWindow):
         else:
             self.log_message(f"✗ {filename} 未经过目标区域")
     
+    def on_file_failed(self, filename, error):
+        """单个文件扫描失败"""
+        self.scan_failures += 1
+        self.log_message(f"⚠ {filename} 扫描失败: {error}")
+    
     def on_filtering_finished(self, filtered_files):
         """筛选完成"""
+        if self.scan_failures:
+            self.log_message(f"警告: {self.scan_failures} 个文件扫描失败，筛选结果可能不完整")
         self.current_trajectory_files = filtered_files
         self.current_file_index = 0
         
@@ -724,6 +1286,7 @@ class ShipTrajectorySystem(QMainWindow):
             self.trajectory_info_label.setText(f"当前轨迹: 1/{len(filtered_files)}")
             self.next_btn.setEnabled(True)
             self.prev_btn.setEnabled(True)
+            self.show_all_btn.setEnabled(True)
             self.save_btn.setEnabled(True)
             self.show_current_trajectory()
             self.log_message(f"筛选完成，找到 {len(filtered_files)} 条符合条件的轨迹")
@@ -731,6 +1294,7 @@ class ShipTrajectorySystem(QMainWindow):
             self.trajectory_info_label.setText("当前轨迹: 0/0")
             self.next_btn.setEnabled(False)
             self.prev_btn.setEnabled(False)
+            self.show_all_btn.setEnabled(False)
             self.save_btn.setEnabled(False)
             self.log_message("未找到符合条件的轨迹")
             QMessageBox.information(self, "提示", "未找到符合条件的轨迹")
@@ -744,9 +1308,10 @@ class ShipTrajectorySystem(QMainWindow):
         
         current_file = self.current_trajectory_files[self.current_file_index]
         try:
-            df = pd.read_csv(current_file)
+            df = self.track_prefetcher.load(current_file)
             self.map_canvas.clear_trajectories()
             self.map_canvas.plot_trajectory(df)
+            self.prefetch_neighbours()
             
             # 更新信息
             filename = os.path.basename(current_file)
@@ -758,6 +1323,50 @@ class ShipTrajectorySystem(QMainWindow):
         except Exception as e:
             self.log_message(f"显示轨迹失败: {str(e)}")
     
+    def prefetch_neighbours(self):
+        """后台预取当前轨迹前后的文件并预热其底图，翻页时直接从内存绘制"""
+        canvas = self.map_canvas
+        canvas.tile_fetcher.cancel_warm()
+        # 底图样式和地图宽度在界面线程中读取，预取线程只计算轨迹范围
+        style, width_px = canvas.map_style, canvas.ax.bbox.width
+        self.track_prefetcher.prefetch(
+            neighbours(self.current_trajectory_files, self.current_file_index),
+            lambda path, df: canvas.warm_basemap(style, width_px, *trajectory_limits(*trajectory_coords(df)))
+        )
+    
+    def show_all_trajectories(self):
+        """一次绘制全部筛选结果"""
+        if not self.current_trajectory_files:
+            return
+        
+        try:
+            store = TrackStore.from_files(self.current_trajectory_files, required_columns=['lat', 'lon'])
+            self.map_canvas.clear_trajectories()
+            self.map_canvas.plot_trajectories(store)
+            self.trajectory_info_label.setText(f"全部轨迹: {len(store)} 条")
+            self.log_message(f"显示全部筛选轨迹: {len(store)} 条, {store.total_points} 个点")
+        except Exception as e:
+            self.log_message(f"显示全部轨迹失败: {str(e)}")
+    
+    def show_density(self):
+        """显示筛选结果（未筛选时为整个文件夹）的轨迹密度图"""
+        if self.current_trajectory_files:
+            files = self.current_trajectory_files
+        elif hasattr(self, 'current_folder'):
+            # 与清单和筛选使用相同的文件列表
+            files = [os.path.join(self.current_folder, f) for f in list_csv_files(self.current_folder)]
+        else:
+            QMessageBox.warning(self, "警告", "请先选择文件夹")
+            return
+        
+        try:
+            store = TrackStore.from_files(files, required_columns=['lat', 'lon'])
+            self.map_canvas.clear_trajectories()
+            self.map_canvas.plot_density(store, self.density_segments_checkbox.isChecked())
+            self.log_message(f"显示轨迹密度图: {len(store)} 条轨迹, {store.total_points} 个点")
+        except Exception as e:
+            self.log_message(f"显示密度图失败: {str(e)}")
+    
     def next_trajectory(self):
         """下一条轨迹"""
         if self.current_file_index < len(self.current_trajectory_files) - 1:
@@ -801,6 +1410,14 @@ class ShipTrajectorySystem(QMainWindow):
     
     def show_selection_area(self):
         """显示筛选区域"""
+        if self.polygon_input.text().strip():
+            region = self.get_selection_region()
+            if region is None:
+                return
+            self.map_canvas.plot_selection_region(region)
+            self.log_message("显示筛选区域")
+            return
+        
         min_lat = self.min_lat_input.value()
         max_lat = self.max_lat_input.value()
         min_lon = self.min_lon_input.value()
@@ -814,6 +1431,13 @@ class ShipTrajectorySystem(QMainWindow):
         self.map_canvas.clear_trajectories()
         self.log_message("清除地图")
     
+    def closeEvent(self, event):
+        """关闭窗口时释放扫描进程池、预取线程和瓦片下载线程"""
+        self.scan_engine.shutdown()
+        self.track_prefetcher.shutdown()
+        self.map_canvas.tile_fetcher.shutdown()
+        super().closeEvent(event)
+    
     def log_message(self, message):
         """记录日志消息"""
         from datetime import datetime
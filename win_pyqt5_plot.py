@@ -7,11 +7,113 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWebEngineWidgets import QWebEngineView
 import folium
-from folium.plugins import MarkerCluster
 from io import BytesIO
 from PIL import Image, ImageEnhance
 import geopandas as gpd
-from shapely.geometry import Point, Polygon
+from geo_filter import rectangle, parse_region, region_bbox
+from track_store import TrackStore
+from track_simplify import zoom_tolerance
+from track_density import segment_density, density_rgba
+from map_bridge import MapBridge, track_feature, region_geojson
+from track_server import TrackServer, LazyTrackLayer, INLINE_POINTS, MAX_TILE_ZOOM
+from track_catalog import TrackCatalog
+from folium.utilities import image_to_url, mercator_transform
+
+# 文件数不少于此值时自动按需加载轨迹
+LAZY_MIN_FILES = 5000
+
+class LoadCancelled(Exception):
+    """后台加载被取消（如选择了新的文件夹）"""
+
+
+class TrackLoader(QThread):
+    """在后台加载文件夹：按需加载时只构建元数据目录（首次打开时逐文件生成清单），否则构建 TrackStore"""
+    progress_updated = pyqtSignal(int)
+    finished_loading = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    
+    def __init__(self, folder_path, csv_files, lazy, parent=None):
+        super().__init__(parent)
+        self.folder_path = folder_path
+        self.csv_files = csv_files
+        self.lazy = lazy
+        self.cancelled = False
+    
+    def cancel(self):
+        """停止加载，之后不再发送结果"""
+        self.cancelled = True
+    
+    def report(self, done, total):
+        if self.cancelled:
+            raise LoadCancelled()
+        self.progress_updated.emit(int(done / max(total, 1) * 100))
+    
+    def filepaths(self):
+        """逐个产出文件路径并报告进度"""
+        for i, file in enumerate(self.csv_files):
+            self.report(i, len(self.csv_files))
+            yield os.path.join(self.folder_path, file)
+    
+    def run(self):
+        try:
+            if self.lazy:
+                # 只加载清单中的元数据，坐标在绘制或筛选时按需读取
+                data = TrackCatalog.from_folder(self.folder_path, progress_callback=self.report)
+            else:
+                # 所有轨迹按字段拼接为连续数组，每条轨迹是其上的零拷贝视图；
+                # 坐标按单精度、船舶类型按全局字典码保存
+                data = TrackStore.from_files(
+                    self.filepaths(),
+                    required_columns=['lat', 'lon', 'sog', 'cog', 'label'],
+                    coord_dtype=np.float32
+                )
+        except LoadCancelled:
+            return
+        except Exception as e:
+            if not self.cancelled:
+                self.failed.emit(str(e))
+            return
+        if not self.cancelled:
+            self.finished_loading.emit(data)
+
+
+class DensityWorker(QThread):
+    """在后台生成密度栅格图片（按需加载时需要读取全部轨迹的坐标）"""
+    progress_updated = pyqtSignal(int)
+    finished_density = pyqtSignal(str, list)
+    failed = pyqtSignal(str)
+    
+    def __init__(self, data, width, height, parent=None):
+        super().__init__(parent)
+        self.data = data
+        self.width = width
+        self.height = height
+    
+    def indices(self):
+        """逐个产出轨迹编号并报告进度"""
+        for index in range(len(self.data)):
+            self.progress_updated.emit(int(index / len(self.data) * 100))
+            yield index
+    
+    def run(self):
+        try:
+            # 按需加载时密度图需要全部坐标，临时读取（只读经纬度两列），不常驻
+            data = self.data.materialize(self.indices()) if isinstance(self.data, TrackCatalog) else self.data
+            lat_min, lat_max, lon_min, lon_max = data.bboxes()
+            xlim = (float(np.nanmin(lon_min)), float(np.nanmax(lon_max)))
+            ylim = (float(np.nanmin(lat_min)), float(np.nanmax(lat_max)))
+            
+            index = data.point_index()
+            grid = segment_density(data.columns['lat'][index], data.columns['lon'][index],
+                                   xlim, ylim, self.width, self.height, data.track_ids())
+            
+            # 栅格按纬度线性排列，投影到Web墨卡托后作为图片叠加
+            url = image_to_url(mercator_transform(density_rgba(grid), ylim))
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.finished_density.emit(url, [[ylim[0], xlim[0]], [ylim[1], xlim[1]]])
+
 
 class ShipTrackVisualizer(QMainWindow):
     def __init__(self):
@@ -19,9 +121,9 @@ class ShipTrackVisualizer(QMainWindow):
         self.setWindowTitle("船舶轨迹态势可视化系统")
         self.setGeometry(100, 100, 1600, 900)
         self.setup_ui()
-        self.ship_data = {}
-        self.current_map = None
-        self.map_html = ""
+        self.ship_data = TrackStore({}, [], [], [])
+        self.track_loader = None
+        self.density_worker = None
         self.dark_theme = True
         self.apply_dark_theme()
 
@@ -59,6 +161,15 @@ class ShipTrackVisualizer(QMainWindow):
         folder_layout.addWidget(QLabel("数据文件夹路径:"))
         folder_layout.addWidget(self.folder_path)
         folder_layout.addWidget(folder_btn)
+        self.lazy_check = QCheckBox("按需加载轨迹（只读取元数据）")
+        self.lazy_check.setToolTip(f"打开文件夹时只读取清单中的元数据，坐标在绘制或筛选时才读取；"
+                                   f"文件数不少于 {LAZY_MIN_FILES} 时自动启用")
+        folder_layout.addWidget(self.lazy_check)
+        # 加载文件夹和生成密度图时的进度
+        self.load_progress = QProgressBar()
+        self.load_progress.setRange(0, 100)
+        self.load_progress.hide()
+        folder_layout.addWidget(self.load_progress)
         control_layout.addWidget(folder_group)
 
         # 区域筛选
@@ -79,9 +190,17 @@ class ShipTrackVisualizer(QMainWindow):
         filter_layout.addWidget(QLabel("最大经度:"), 3, 0)
         filter_layout.addWidget(self.max_lon, 3, 1)
         
+        self.polygon_text = QLineEdit()
+        self.polygon_text.setPlaceholderText("可选: lat,lon; lat,lon; ... 多个用 | 分隔")
+        filter_layout.addWidget(QLabel("多边形顶点:"), 4, 0)
+        filter_layout.addWidget(self.polygon_text, 4, 1)
+        
+        self.segments_check = QCheckBox("检测定位点之间穿越区域的航段")
+        filter_layout.addWidget(self.segments_check, 5, 0, 1, 2)
+        
         filter_btn = QPushButton("筛选并绘制")
         filter_btn.clicked.connect(self.filter_and_plot)
-        filter_layout.addWidget(filter_btn, 4, 0, 1, 2)
+        filter_layout.addWidget(filter_btn, 6, 0, 1, 2)
         
         control_layout.addWidget(filter_group)
 
@@ -136,6 +255,10 @@ class ShipTrackVisualizer(QMainWindow):
         self.theme_btn.triggered.connect(self.toggle_theme)
         toolbar.addAction(self.theme_btn)
         
+        self.density_btn = QAction(QIcon(self.create_icon("density", "#1E90FF")), "密度图", self)
+        self.density_btn.triggered.connect(self.plot_density)
+        toolbar.addAction(self.density_btn)
+        
         map_layout.addWidget(toolbar)
 
         # Web视图显示地图
@@ -172,6 +295,9 @@ class ShipTrackVisualizer(QMainWindow):
         elif icon_type == "theme":
             painter.drawEllipse(4, 4, 16, 16)
             painter.drawLine(12, 12, 20, 20)
+        elif icon_type == "density":
+            for x, y in [(6, 6), (12, 10), (16, 6), (8, 16), (15, 16), (11, 13)]:
+                painter.drawEllipse(x - 2, y - 2, 4, 4)
         
         painter.end()
         return pixmap
@@ -260,23 +386,17 @@ class ShipTrackVisualizer(QMainWindow):
         self.setStyleSheet(dark_stylesheet)
 
     def init_map(self):
-        """初始化地图"""
-        self.current_map = folium.Map(
+        """初始化地图：基础页面只加载一次，之后通过 map_bridge 增量更新"""
+        self.map_bridge = MapBridge(self.web_view.page())
+        self.track_server = TrackServer().start()
+        # 页面以瓦片服务的地址为来源，请求瓦片时不跨域
+        self.map_bridge.load(folium.Map(
             location=[30.0, 120.0],
             zoom_start=8,
             tiles='CartoDB dark_matter',
             control_scale=True,
             attr='Marine Traffic Visualization'
-        )
-        self.update_map()
-
-    def update_map(self):
-        """更新地图显示"""
-        if self.current_map:
-            data = BytesIO()
-            self.current_map.save(data, close_file=False)
-            self.map_html = data.getvalue().decode()
-            self.web_view.setHtml(self.map_html)
+        ), base_url=QUrl(self.track_server.url + '/'))
 
     def select_folder(self):
         """选择包含船舶轨迹CSV的文件夹"""
@@ -284,27 +404,58 @@ class ShipTrackVisualizer(QMainWindow):
         if folder:
             self.folder_path.setText(folder)
             self.load_ship_data(folder)
-            self.plot_all_tracks()
 
     def load_ship_data(self, folder_path):
-        """加载文件夹中的所有CSV文件"""
-        self.ship_data = {}
+        """在后台加载文件夹中的所有CSV文件，加载完成后绘制全部轨迹"""
+        self.ship_data = TrackStore({}, [], [], [])
+        # 轨迹ID为文件名，不同文件夹中的同名文件不是同一条轨迹，页面上的旧轨迹全部移除
+        self.map_bridge.clear_tracks()
+        # 之前的加载任务停止读取，已发出但尚未处理的结果也不再使用
+        previous = self.track_loader
+        if previous is not None:
+            previous.cancel()
+            for signal in (previous.progress_updated, previous.finished_loading, previous.failed):
+                signal.disconnect()
+            self.track_loader = None
         csv_files = [f for f in os.listdir(folder_path) if f.endswith('.csv')]
         
         if not csv_files:
+            self.load_progress.hide()
+            self.update_stats()
             QMessageBox.warning(self, "警告", "未找到CSV文件！")
             return
         
-        for file in csv_files:
-            try:
-                df = pd.read_csv(os.path.join(folder_path, file))
-                if {'lat', 'lon', 'sog', 'cog', 'label'}.issubset(df.columns):
-                    ship_id = file.split('.')[0]
-                    self.ship_data[ship_id] = df
-            except Exception as e:
-                print(f"Error loading {file}: {e}")
-        
+        lazy = self.lazy_check.isChecked() or len(csv_files) >= LAZY_MIN_FILES
+        self.track_loader = TrackLoader(folder_path, csv_files, lazy, self)
+        self.track_loader.progress_updated.connect(self.on_load_progress)
+        self.track_loader.finished_loading.connect(self.on_data_loaded)
+        self.track_loader.failed.connect(self.on_load_failed)
+        self.load_progress.setValue(0)
+        self.load_progress.show()
+        self.stats_label.setText("正在加载数据...")
+        self.track_loader.start()
+
+    def on_load_progress(self, value):
+        if self.sender() is self.track_loader:
+            self.load_progress.setValue(value)
+
+    def on_data_loaded(self, data):
+        """后台加载完成：更新统计并绘制全部轨迹"""
+        if self.sender() is not self.track_loader:
+            return
+        self.track_loader = None
+        self.load_progress.hide()
+        self.ship_data = data
         self.update_stats()
+        self.plot_all_tracks()
+
+    def on_load_failed(self, error):
+        if self.sender() is not self.track_loader:
+            return
+        self.track_loader = None
+        self.load_progress.hide()
+        self.update_stats()
+        QMessageBox.warning(self, "加载错误", f"加载数据失败: {error}")
 
     def update_stats(self):
         """更新统计信息"""
@@ -313,40 +464,35 @@ class ShipTrackVisualizer(QMainWindow):
             return
         
         num_ships = len(self.ship_data)
-        total_points = sum(len(df) for df in self.ship_data.values())
+        total_points = self.ship_data.total_points
         
         ship_types = {}
-        for df in self.ship_data.values():
-            ship_type = df['label'].mode()[0] if 'label' in df.columns else '未知'
+        for ship_type in self.ship_data.mode('label'):
+            ship_type = ship_type or '未知'
             ship_types[ship_type] = ship_types.get(ship_type, 0) + 1
         
         type_info = "\n".join([f"{k}: {v}艘" for k, v in ship_types.items()])
         
+        time_info = ""
+        if isinstance(self.ship_data, TrackCatalog):
+            time_range = self.ship_data.time_range()
+            if time_range:
+                time_info = f"<br>时间范围: {time_range[0]:%Y-%m-%d} ~ {time_range[1]:%Y-%m-%d}（按需加载）"
+        
         stats_text = f"""
         <b>数据统计:</b>
         <br>船舶数量: <font color='#1E90FF'>{num_ships}</font> 艘
         <br>轨迹点总数: <font color='#1E90FF'>{total_points}</font> 个
+        <br>内存占用: <font color='#1E90FF'>{self.ship_data.nbytes / 2**20:.1f}</font> MB
+        （每条轨迹 {self.ship_data.bytes_per_track / 1024:.1f} KB）{time_info}
         <br>
         <br><b>船舶类型分布:</b>
         <br>{type_info}
         """
         self.stats_label.setText(stats_text)
 
-    def plot_all_tracks(self):
-        """绘制所有船舶轨迹"""
-        if not self.ship_data:
-            return
-        
-        self.current_map = folium.Map(
-            location=self.get_center(),
-            zoom_start=8,
-            tiles='CartoDB dark_matter',
-            control_scale=True
-        )
-        
-        # 创建聚类标记
-        marker_cluster = MarkerCluster(name="船舶位置").add_to(self.current_map)
-        
+    def track_styles(self, store):
+        """每条轨迹按船舶类型的颜色和提示文字"""
         # 船舶类型颜色映射
         color_map = {
             'cargo': '#4169E1',    # 货船 - 皇家蓝
@@ -357,143 +503,139 @@ class ShipTrackVisualizer(QMainWindow):
             'default': '#1E90FF'    # 默认 - 道奇蓝
         }
         
-        # 绘制每条轨迹
-        for ship_id, df in self.ship_data.items():
-            ship_type = df['label'].mode()[0] if 'label' in df.columns else 'default'
-            color = color_map.get(ship_type.lower(), color_map['default'])
-            
-            # 创建轨迹线
-            points = list(zip(df['lat'], df['lon']))
-            folium.PolyLine(
-                points,
-                color=color,
-                weight=2,
-                opacity=0.7,
-                tooltip=f"{ship_id} ({ship_type})"
-            ).add_to(self.current_map)
-            
-            # 添加起点和终点标记
-            if len(points) > 0:
-                # 起点
-                folium.Marker(
-                    points[0],
-                    icon=folium.Icon(color='green', icon='play', prefix='fa'),
-                    tooltip=f"{ship_id} 起点"
-                ).add_to(marker_cluster)
-                
-                # 终点
-                folium.Marker(
-                    points[-1],
-                    icon=folium.Icon(color='red', icon='stop', prefix='fa'),
-                    tooltip=f"{ship_id} 终点"
-                ).add_to(marker_cluster)
-        
-        # 添加图层控制
-        folium.LayerControl().add_to(self.current_map)
-        self.update_map()
+        colors, tooltips = [], []
+        for name, ship_type in zip(store.names, store.mode('label')):
+            ship_type = ship_type or 'default'
+            colors.append(color_map.get(ship_type.lower(), color_map['default']))
+            tooltips.append(f"{name} ({ship_type})")
+        return colors, tooltips
+
+    def track_features(self, store):
+        """返回 (轨迹ID列表, 按ID生成GeoJSON要素的函数)，要素只在需要发送时生成"""
+        tracks = {}
+        for track, color, tooltip in zip(store, *self.track_styles(store)):
+            tracks[track.name] = (track, color, tooltip)
+        
+        # 按初始缩放级别简化（见 track_simplify），HTML/消息大小与屏幕像素相当
+        tolerance = zoom_tolerance(10)
+        
+        def make_feature(ship_id):
+            track, color, tooltip = tracks[ship_id]
+            lats, lons = track.simplified().coords(tolerance)
+            return track_feature(ship_id, lats, lons, color, tooltip)
+        
+        return list(tracks), make_feature
+
+    def show_tracks(self, store, style):
+        """显示轨迹集合：点数较少时增量发送到页面，否则发布到本地瓦片服务，页面只加载视图内的瓦片
+
+        按需加载的目录总是经瓦片服务显示，只有与视图内瓦片相交的轨迹才读取坐标。
+        """
+        if isinstance(store, TrackCatalog):
+            self.map_bridge.clear_tracks()
+            url = self.track_server.publish_layer('tracks', LazyTrackLayer(store, *self.track_styles(store)))
+            self.map_bridge.call('setTrackTiles', url, style, MAX_TILE_ZOOM)
+        elif store.total_points <= INLINE_POINTS:
+            self.map_bridge.call('removeTrackTiles')
+            self.track_server.remove('tracks')
+            self.map_bridge.call('setTrackStyle', style)
+            self.map_bridge.sync_tracks(*self.track_features(store))
+        else:
+            self.map_bridge.clear_tracks()
+            url = self.track_server.publish('tracks', store, *self.track_styles(store))
+            self.map_bridge.call('setTrackTiles', url, style, MAX_TILE_ZOOM)
+
+    def plot_all_tracks(self):
+        """绘制所有船舶轨迹（只发送地图上尚未显示的轨迹）"""
+        if not self.ship_data:
+            return
+        
+        self.map_bridge.call('removeOverlay', 'density')
+        self.map_bridge.call('removeOverlay', 'region')
+        self.show_tracks(self.ship_data, {'weight': 2, 'opacity': 0.7})
+        self.map_bridge.call('setView', self.get_center(), 8)
+
+    def plot_density(self):
+        """以密度栅格图层显示全部轨迹（航段插值，栅格与地图窗口大小相当），栅格在后台生成"""
+        if not self.ship_data:
+            QMessageBox.warning(self, "数据错误", "请先加载船舶数据")
+            return
+        if self.density_worker is not None:
+            return
+        
+        self.density_btn.setEnabled(False)
+        self.density_worker = DensityWorker(self.ship_data, max(self.web_view.width(), 1),
+                                            max(self.web_view.height(), 1), self)
+        self.density_worker.progress_updated.connect(self.load_progress.setValue)
+        self.density_worker.finished_density.connect(self.on_density_ready)
+        self.density_worker.failed.connect(self.on_density_failed)
+        self.density_worker.finished.connect(self.on_density_finished)
+        self.load_progress.setValue(0)
+        self.load_progress.show()
+        self.density_worker.start()
+
+    def on_density_ready(self, url, bounds):
+        """密度栅格生成完毕：替换轨迹显示为密度图层"""
+        # 生成期间换了文件夹时丢弃旧数据的密度图
+        if self.density_worker is None or self.density_worker.data is not self.ship_data:
+            return
+        self.map_bridge.clear_tracks()
+        self.map_bridge.call('removeTrackTiles')
+        self.map_bridge.call('removeOverlay', 'region')
+        self.map_bridge.call('setImageOverlay', 'density', url, bounds)
+        self.map_bridge.call('fitBounds', bounds)
+
+    def on_density_failed(self, error):
+        QMessageBox.warning(self, "密度图错误", f"生成密度图失败: {error}")
+
+    def on_density_finished(self):
+        self.density_worker = None
+        self.density_btn.setEnabled(True)
+        if self.track_loader is None:
+            self.load_progress.hide()
 
     def filter_and_plot(self):
-        """根据输入的经纬度范围筛选并绘制船舶轨迹"""
+        """根据输入的经纬度范围或多边形筛选并绘制船舶轨迹"""
         try:
-            min_lat = float(self.min_lat.text())
-            max_lat = float(self.max_lat.text())
-            min_lon = float(self.min_lon.text())
-            max_lon = float(self.max_lon.text())
+            if self.polygon_text.text().strip():
+                region = parse_region(self.polygon_text.text())
+            else:
+                region = rectangle(float(self.min_lat.text()), float(self.max_lat.text()),
+                                   float(self.min_lon.text()), float(self.max_lon.text()))
         except ValueError:
             QMessageBox.warning(self, "输入错误", "请输入有效的经纬度数值")
             return
+        min_lat, max_lat, min_lon, max_lon = region_bbox(region)
         
         if not self.ship_data:
             QMessageBox.warning(self, "数据错误", "请先加载船舶数据")
             return
         
-        # 创建筛选区域多边形
-        area_polygon = Polygon([
-            (min_lat, min_lon),
-            (min_lat, max_lon),
-            (max_lat, max_lon),
-            (max_lat, min_lon)
-        ])
-        
-        # 筛选轨迹
-        filtered_data = {}
-        for ship_id, df in self.ship_data.items():
-            # 检查是否有轨迹点位于区域内
-            in_area = False
-            for _, row in df.iterrows():
-                point = Point(row['lat'], row['lon'])
-                if point.within(area_polygon):
-                    in_area = True
-                    break
-            if in_area:
-                filtered_data[ship_id] = df
+        # 筛选轨迹（对所有轨迹点一次性向量化判断；按需加载时先按边界框初筛，只读取候选轨迹）
+        filtered_data = self.ship_data.subset(
+            self.ship_data.tracks_in_region(region, segments=self.segments_check.isChecked())
+        )
         
         if not filtered_data:
             QMessageBox.information(self, "筛选结果", "该区域内未发现船舶轨迹")
             return
         
-        # 更新地图
-        self.current_map = folium.Map(
-            location=[(min_lat + max_lat)/2, (min_lon + max_lon)/2],
-            zoom_start=10,
-            tiles='CartoDB dark_matter',
-            control_scale=True
-        )
-        
         # 绘制筛选区域
-        folium.Rectangle(
-            bounds=[[min_lat, min_lon], [max_lat, max_lon]],
-            color='#FF4500',
-            fill=True,
-            fill_color='#FF4500',
-            fill_opacity=0.1,
-            weight=2,
-            tooltip="筛选区域"
-        ).add_to(self.current_map)
-        
-        # 船舶类型颜色映射
-        color_map = {
-            'cargo': '#4169E1',
-            'tanker': '#32CD32',
-            'passenger': '#FF8C00',
-            'fishing': '#9400D3',
-            'military': '#DC143C',
-            'default': '#1E90FF'
-        }
-        
-        # 绘制筛选后的轨迹
-        for ship_id, df in filtered_data.items():
-            ship_type = df['label'].mode()[0] if 'label' in df.columns else 'default'
-            color = color_map.get(ship_type.lower(), color_map['default'])
-            
-            points = list(zip(df['lat'], df['lon']))
-            folium.PolyLine(
-                points,
-                color=color,
-                weight=3,
-                opacity=0.8,
-                tooltip=f"{ship_id} ({ship_type})"
-            ).add_to(self.current_map)
-            
-            # 添加起点和终点标记
-            if len(points) > 0:
-                folium.Marker(
-                    points[0],
-                    icon=folium.Icon(color='green', icon='play', prefix='fa'),
-                    tooltip=f"{ship_id} 起点"
-                ).add_to(self.current_map)
-                
-                folium.Marker(
-                    points[-1],
-                    icon=folium.Icon(color='red', icon='stop', prefix='fa'),
-                    tooltip=f"{ship_id} 终点"
-                ).add_to(self.current_map)
-        
-        self.update_map()
+        self.map_bridge.call('removeOverlay', 'density')
+        self.map_bridge.call('setOverlay', 'region', region_geojson(region), {
+            'color': '#FF4500',
+            'fillColor': '#FF4500',
+            'fillOpacity': 0.1,
+            'weight': 2
+        }, "筛选区域")
+        
+        # 结果较少时只增删进入或离开筛选结果的轨迹，较多时改由瓦片服务按视图加载
+        self.show_tracks(filtered_data, {'weight': 3, 'opacity': 0.8})
+        self.map_bridge.call('setView', [(min_lat + max_lat)/2, (min_lon + max_lon)/2], 10)
         
         # 更新统计信息
         num_ships = len(filtered_data)
-        total_points = sum(len(df) for df in filtered_data.values())
+        total_points = filtered_data.total_points
         self.stats_label.setText(
             f"<b>筛选结果:</b><br>"
             f"区域内船舶数量: <font color='#1E90FF'>{num_ships}</font> 艘<br>"
@@ -505,19 +647,15 @@ class ShipTrackVisualizer(QMainWindow):
         if not self.ship_data:
             return [30.0, 120.0]  # 默认位置（中国东海附近）
         
-        all_lats = []
-        all_lons = []
+        if isinstance(self.ship_data, TrackCatalog):
+            return self.ship_data.center() or [30.0, 120.0]
         
-        for df in self.ship_data.values():
-            if not df.empty:
-                all_lats.extend(df['lat'].tolist())
-                all_lons.extend(df['lon'].tolist())
-        
-        if not all_lats:
+        index = self.ship_data.point_index()
+        if len(index) == 0:
             return [30.0, 120.0]
         
-        avg_lat = sum(all_lats) / len(all_lats)
-        avg_lon = sum(all_lons) / len(all_lons)
+        avg_lat = float(self.ship_data.columns['lat'][index].mean())
+        avg_lon = float(self.ship_data.columns['lon'][index].mean())
         return [avg_lat, avg_lon]
 
     def refresh_map(self):
@@ -534,27 +672,29 @@ class ShipTrackVisualizer(QMainWindow):
         self.web_view.page().runJavaScript("map.setZoom(map.getZoom()-1);")
 
     def toggle_theme(self):
-        """切换地图主题"""
+        """切换地图主题（只替换底图图层）"""
         if self.dark_theme:
-            tiles = 'OpenStreetMap'
+            self.map_bridge.call('setTiles', 'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+                'attribution': '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
+            })
         else:
-            tiles = 'CartoDB dark_matter'
-        
-        self.web_view.page().runJavaScript(f"map.eachLayer(function(layer){{map.removeLayer(layer);}});")
-        self.web_view.page().runJavaScript(f"""
-            L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
-                attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
-            }}).addTo(map);
-        """ if not self.dark_theme else f"""
-            L.tileLayer('https://{{s}}.basemaps.cartocdn.com/dark_all/{{z}}/{{x}}/{{y}}{{r}}.png', {{
-                attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
-                subdomains: 'abcd',
-                maxZoom: 20
-            }}).addTo(map);
-        """)
+            self.map_bridge.call('setTiles', 'https://{s}.basemaps.cartocdn.com/dark_all/{z}/{x}/{y}{r}.png', {
+                'attribution': '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors &copy; <a href="https://carto.com/attributions">CARTO</a>',
+                'subdomains': 'abcd',
+                'maxZoom': 20
+            })
         
         self.dark_theme = not self.dark_theme
 
+    def closeEvent(self, event):
+        """关闭窗口时停止后台加载（等待线程退出）和本地瓦片服务"""
+        for worker in self.findChildren(QThread):
+            if isinstance(worker, TrackLoader):
+                worker.cancel()
+            worker.wait()
+        self.track_server.shutdown()
+        super().closeEvent(event)
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     app.setStyle("Fusion")